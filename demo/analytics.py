@@ -0,0 +1,145 @@
+import threading
+
+import numpy as np
+from django.db.models import Q
+
+from demo.models import Book
+
+DTYPES = {
+    'id': np.int64,
+    'author_id': np.int64,
+    'page_count': np.int64,
+    # NULL dates load as NaT
+    'publication_date': 'datetime64[D]',
+}
+COLUMNS = list(DTYPES)
+AGGREGATES = ['count', 'sum', 'mean', 'min', 'max']
+
+
+def _fetch(queryset):
+    rows = list(queryset.order_by('id').values_list(*COLUMNS))
+    values = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    return {name: np.array(column, dtype=DTYPES[name]) for (name, column) in zip(COLUMNS, values)}
+
+
+class BookSnapshot:
+    """ Columnar in-memory copy of the Book columns in COLUMNS, one NumPy
+    array per column, sorted by id.
+
+    The snapshot is loaded with a single values_list() pass on first use.
+    refresh() then re-reads only the books saved or deleted through the
+    handlers in demo/signals.py plus any books with a higher id than the
+    snapshot has seen (e.g. bulk inserts), so dashboards can answer several
+    aggregate questions from memory between cheap refreshes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = None
+        self._dirty = set()
+
+    def load(self):
+        with self._lock:
+            self._dirty = set()
+            self._columns = _fetch(Book.objects.all())
+        return len(self)
+
+    def refresh(self):
+        """ Brings the snapshot up to date and returns the number of rows re-read. """
+        if self._columns is None:
+            return self.load()
+        with self._lock:
+            (dirty, self._dirty) = (self._dirty, set())
+            ids = self._columns['id']
+            max_id = int(ids[-1]) if len(ids) else 0
+            fetched = _fetch(Book.objects.filter(Q(id__gt=max_id) | Q(id__in=dirty)))
+            # Dirty ids that were not fetched again have been deleted.
+            keep = ~np.isin(ids, np.fromiter(dirty, dtype=np.int64, count=len(dirty)))
+            merged = {name: np.concatenate([column[keep], fetched[name]])
+                      for (name, column) in self._columns.items()}
+            order = np.argsort(merged['id'], kind='stable')
+            self._columns = {name: column[order] for (name, column) in merged.items()}
+            return len(fetched['id'])
+
+    def mark_dirty(self, book_ids):
+        with self._lock:
+            self._dirty.update(book_ids)
+
+    def __len__(self):
+        return len(self._columns['id']) if self._columns is not None else 0
+
+    def column(self, name):
+        if self._columns is None:
+            self.load()
+        return self._columns[name]
+
+    def _values(self, name, mask):
+        values = self.column(name)
+        return values if mask is None else values[mask]
+
+    ##########################################
+    # AGGREGATES
+    ##########################################
+    def group_by(self, by, column='page_count', aggregates=('count',), mask=None):
+        """ Aggregates `column` per distinct value of `by`, e.g.
+        group_by('author_id', 'page_count', ['count', 'max']). Returns a dict of
+        equal-length arrays keyed by `by` and each of the `aggregates`.
+
+        `mask` is an optional boolean array over the snapshot's rows, e.g.
+        snapshot.column('page_count') > 300.
+        """
+        unknown = set(aggregates) - set(AGGREGATES)
+        if unknown:
+            raise ValueError(f'aggregates must be among {", ".join(AGGREGATES)}, not {", ".join(sorted(unknown))}')
+        keys = self._values(by, mask)
+        values = self._values(column, mask)
+        (groups, inverse) = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(groups))
+
+        result = {by: groups}
+        for aggregate in aggregates:
+            if aggregate == 'count':
+                result['count'] = counts
+            elif aggregate in ('sum', 'mean'):
+                sums = np.bincount(inverse, weights=values, minlength=len(groups))
+                result[aggregate] = sums if aggregate == 'sum' else sums / counts
+            else:
+                order = np.argsort(inverse, kind='stable')
+                starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+                reduce = np.minimum if aggregate == 'min' else np.maximum
+                result[aggregate] = reduce.reduceat(values[order], starts) if len(values) else values[:0]
+        return result
+
+    def top_k(self, column='page_count', k=10, largest=True, mask=None):
+        """ Returns (ids, values) of the `k` rows with the largest (or smallest)
+        `column`, best first, ties broken by lowest id.
+        """
+        ids = self._values('id', mask)
+        values = self._values(column, mask)
+        if values.dtype.kind == 'M':
+            present = ~np.isnat(values)
+            (ids, values) = (ids[present], values[present])
+        k = min(k, len(values))
+        if k == 0:
+            return (ids[:0], values[:0])
+        ranked = -values.astype(np.int64) if largest else values.astype(np.int64)
+        candidates = np.argpartition(ranked, k - 1)[:k]
+        # Widen to every row tied with the k-th so the tie-break is stable.
+        candidates = np.flatnonzero(ranked <= ranked[candidates].max())
+        best = candidates[np.lexsort((ids[candidates], ranked[candidates]))][:k]
+        return (ids[best], values[best])
+
+    def histogram(self, column='page_count', bins=10, range=None, mask=None):
+        """ Returns (counts, edges) like numpy.histogram. Date columns skip NULLs
+        and return their edges as dates.
+        """
+        values = self._values(column, mask)
+        if values.dtype.kind != 'M':
+            return np.histogram(values, bins=bins, range=range)
+        days = values[~np.isnat(values)].astype(np.int64)
+        if range is not None:
+            range = tuple(np.datetime64(bound, 'D').astype(np.int64) for bound in range)
+        (counts, edges) = np.histogram(days, bins=bins, range=range)
+        return (counts, edges.astype(np.int64).astype('datetime64[D]'))
+
+
+book_snapshot = BookSnapshot()
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class DemoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'demo'
+
+    def ready(self):
+        from django.db.models.signals import pre_migrate
+
+        from demo import signals  # noqa: F401
+        from demo.partitioning import refuse_partitioned_migrate
+        pre_migrate.connect(refuse_partitioned_migrate, sender=self)
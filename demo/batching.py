@@ -0,0 +1,139 @@
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+
+from django.db import connection
+from django.db.models import F, Lookup
+from django.db.models.expressions import RawSQL
+from django.db.models.query import ModelIterable, ValuesIterable
+
+DEFAULT_CHUNK_SIZE = 5_000
+STRATEGIES = ['in', 'any', 'unnest']
+
+
+class AnyLookup(Lookup):
+    """ `AnyLookup(F(field), [...])` -> `field = ANY(%s)` with the whole list
+    bound as a single array parameter (PostgreSQL only). Unlike `__in`, the
+    statement text does not grow with the number of keys. Passed to filter()
+    directly rather than registered, so no field gains an `__any` lookup.
+    """
+    lookup_name = 'any'
+    prepare_rhs = False
+
+    def process_rhs(self, compiler, connection):
+        return ('%s', [list(self.rhs)])
+
+    def as_sql(self, compiler, connection):
+        (lhs, lhs_params) = self.process_lhs(compiler, connection)
+        (rhs, rhs_params) = self.process_rhs(compiler, connection)
+        return (f'{lhs} = ANY({rhs})', [*lhs_params, *rhs_params])
+
+
+def _filter(queryset, field, keys, strategy):
+    if strategy == 'in':
+        return queryset.filter(**{f'{field}__in': keys})
+    if strategy == 'any':
+        return queryset.filter(AnyLookup(F(field), keys))
+    if strategy == 'unnest':
+        # A semi-join against the unnested array parameter
+        return queryset.filter(**{f'{field}__in': RawSQL('SELECT unnest(%s)', [list(keys)])})
+    raise ValueError(f'strategy must be one of {", ".join(STRATEGIES)}, not {strategy!r}')
+
+
+def _key_getter(queryset, field):
+    if queryset._iterable_class not in (ModelIterable, ValuesIterable):
+        raise ValueError('Pass key= for values_list() querysets')
+    attname = queryset.model._meta.get_field(field).attname if field != 'pk' else 'pk'
+
+    def get_key(row):
+        return row[field] if isinstance(row, dict) else getattr(row, attname)
+    return get_key
+
+
+def _chunks(keys, chunk_size):
+    if not chunk_size:
+        return [keys]
+    return [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+
+
+def _fetch_concurrently(queryset, field, chunks, strategy, workers):
+    """ Yields each chunk's rows in chunk order while up to `workers` threads,
+    each on its own database connection, fetch chunks ahead. When the caller
+    stops iterating, the threads stop after the chunks they are fetching.
+    """
+    results = [None] * len(chunks)
+    ready = [threading.Event() for _ in chunks]
+    work = Queue()
+    for i in range(len(chunks)):
+        work.put(i)
+    stop = threading.Event()
+
+    def worker():
+        try:
+            while not stop.is_set():
+                try:
+                    i = work.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[i] = list(_filter(queryset, field, chunks[i], strategy))
+                except Exception as e:
+                    results[i] = e
+                ready[i].set()
+        finally:
+            connection.close()
+
+    workers = min(workers, len(chunks))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch_in')
+    for _ in range(workers):
+        executor.submit(worker)
+    try:
+        for i in range(len(chunks)):
+            ready[i].wait()
+            if isinstance(results[i], Exception):
+                raise results[i]
+            yield results[i]
+            results[i] = None
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_in(queryset, field, keys, strategy='any', chunk_size=DEFAULT_CHUNK_SIZE, workers=1, key=None):
+    """ Generator over the rows of `queryset` whose `field` is in `keys`, in
+    the order of `keys` (rows for repeated keys are repeated, missing keys are
+    skipped).
+
+    Keys are fetched `chunk_size` at a time (None for a single query) with one
+    of the STRATEGIES:
+      'in'      field IN (%s, %s, ...), one parameter per key
+      'any'     field = ANY(%s), one array parameter (PostgreSQL)
+      'unnest'  field IN (SELECT unnest(%s)), one array parameter (PostgreSQL)
+
+    With workers > 1, chunks are fetched concurrently over separate
+    connections, which do not see the caller's uncommitted writes.
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    get_key = key or _key_getter(queryset, field)
+    # Each chunk is de-duplicated; order is restored per chunk below.
+    chunks = [list(dict.fromkeys(chunk)) for chunk in _chunks(keys, chunk_size)]
+    positions = _chunks(keys, chunk_size)
+
+    if workers > 1 and len(chunks) > 1:
+        chunk_rows = _fetch_concurrently(queryset, field, chunks, strategy, workers)
+    else:
+        chunk_rows = (list(_filter(queryset, field, chunk, strategy)) for chunk in chunks)
+
+    try:
+        for (chunk_keys, rows) in zip(positions, chunk_rows):
+            by_key = defaultdict(list)
+            for row in rows:
+                by_key[get_key(row)].append(row)
+            for k in chunk_keys:
+                yield from by_key.get(k, ())
+    finally:
+        # Stops the workers when the caller abandons this generator early
+        chunk_rows.close()
@@ -0,0 +1,244 @@
+import argparse
+import importlib
+import inspect
+import json
+import statistics
+import subprocess
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from time import perf_counter_ns
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.db.models.query import QuerySet
+
+from demo.instrumentation import fingerprint
+from demo.models import Author, Book
+
+DEFAULT_WARMUP = 1
+DEFAULT_TRIALS = 5
+# Only the first few distinct statements of a trial are explained; N+1 functions
+# would otherwise EXPLAIN ANALYZE the same shape tens of thousands of times.
+MAX_EXPLAINED_STATEMENTS = 5
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    trials_ns: list = field(default_factory=list)
+    query_counts: list = field(default_factory=list)
+    explains: list = field(default_factory=list)
+    result: object = None
+
+    @property
+    def min_ms(self):
+        return min(self.trials_ns) / 1_000_000
+
+    @property
+    def median_ms(self):
+        return statistics.median(self.trials_ns) / 1_000_000
+
+    @property
+    def p95_ms(self):
+        return percentile(self.trials_ns, 95) / 1_000_000
+
+    @property
+    def queries(self):
+        return max(self.query_counts)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trials': len(self.trials_ns),
+            'min_ms': self.min_ms,
+            'median_ms': self.median_ms,
+            'p95_ms': self.p95_ms,
+            'trials_ms': [ns / 1_000_000 for ns in self.trials_ns],
+            'query_counts': self.query_counts,
+            'explains': self.explains,
+        }
+
+
+def percentile(values, pct):
+    """ Nearest-rank percentile, so the result is always an observed value. """
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class _StatementRecorder:
+    """ execute_wrapper that counts statements and remembers the first few
+    distinct SELECT shapes (by fingerprint) so they can be explained after the trial.
+    """
+    def __init__(self, capture):
+        self.count = 0
+        self.capture = capture
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        if (self.capture and not many and len(self.statements) < MAX_EXPLAINED_STATEMENTS
+                and sql.lstrip().upper().startswith(('SELECT', 'WITH'))):
+            self.statements.setdefault(fingerprint(sql), (sql, params))
+        return execute(sql, params, many, context)
+
+
+def explain_statement(sql, params):
+    """ Runs EXPLAIN (ANALYZE, BUFFERS) on a statement and returns the JSON plan.
+    Only supported on PostgreSQL; note that ANALYZE executes the statement.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def positive_int(value):
+    """ argparse type for --trials: run_benchmark needs at least one trial. """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, not {number}')
+    return number
+
+
+def run_once(f, args, kwargs):
+    if inspect.iscoroutinefunction(f):
+        res = async_to_sync(f)(*args, **kwargs)
+    else:
+        res = f(*args, **kwargs)
+    # Querysets are lazy, so evaluate them inside the timed region.
+    if isinstance(res, QuerySet):
+        res = list(res)
+    return res
+
+
+def run_benchmark(f, args=(), kwargs=None, warmup=DEFAULT_WARMUP, trials=DEFAULT_TRIALS,
+                  explain=False, name=None):
+    if trials < 1:
+        raise ValueError(f'trials must be at least 1, not {trials}')
+    kwargs = kwargs or {}
+    result = BenchmarkResult(name=name or f.__name__)
+
+    for _ in range(warmup):
+        run_once(f, args, kwargs)
+
+    for trial in range(trials):
+        capture = explain and trial == 0 and connection.vendor == 'postgresql'
+        recorder = _StatementRecorder(capture)
+        with connection.execute_wrapper(recorder):
+            start_ns = perf_counter_ns()
+            result.result = run_once(f, args, kwargs)
+            result.trials_ns.append(perf_counter_ns() - start_ns)
+        result.query_counts.append(recorder.count)
+        for (sql, params) in recorder.statements.values():
+            result.explains.append({'sql': sql, 'plan': explain_statement(sql, params)})
+
+    return result
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def export_json(results, path, **metadata):
+    payload = {
+        'commit': current_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'database': connection.vendor,
+        **metadata,
+        'results': [result.to_dict() for result in results],
+    }
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2, default=str)
+
+
+##########################################
+# QUERY SET
+##########################################
+@dataclass
+class BenchmarkCase:
+    name: str
+    func: object
+    args: tuple = ()
+
+
+def command_module(name):
+    return importlib.import_module(f'demo.management.commands.{name}')
+
+
+def get_query_set(size=50_000):
+    """ The functions compared by the demo, optimize_me and challenge commands,
+    with arguments drawn from the current database. `size` caps the id and
+    title lists handed to the bulk variants.
+    """
+    demo = command_module('demo')
+    optimize_me = command_module('optimize_me')
+    challenge = command_module('challenge_2025-01-30')
+
+    titles = list(Book.objects.order_by('id').values_list('title', flat=True)[:size])
+    author_ids = list(Author.objects.order_by('id').values_list('id', flat=True)[:size])
+    book_ids = list(Book.objects.order_by('id').values_list('id', flat=True)[:size])
+    single_title = titles[len(titles) // 2] if titles else ''
+    single_author_id = author_ids[1] if len(author_ids) > 1 else None
+
+    cases = []
+    for func in [demo.get_books_by_title_bulk, demo.get_books_by_title]:
+        cases.append(BenchmarkCase(f'demo.{func.__name__}[2]', func, (titles[:2],)))
+        cases.append(BenchmarkCase(f'demo.{func.__name__}[{len(titles[:5000])}]', func, (titles[:5000],)))
+    cases.append(BenchmarkCase(f'demo.get_books_by_title_batched[{len(titles[:5000])}]',
+                               demo.get_books_by_title_batched, (titles[:5000],)))
+    cases.append(BenchmarkCase(f'demo.aget_books_by_title[{len(titles[:5000])}]',
+                               demo.aget_books_by_title, (titles[:5000],)))
+    for func in [demo.get_book_by_title, demo.get_book_by_title_without_index, demo.get_book_by_title_cached,
+                 demo.aget_book_by_title]:
+        cases.append(BenchmarkCase(f'demo.{func.__name__}', func, (single_title,)))
+    for func in [demo.search_books_by_title_icontains, demo.search_books_by_title_prefix,
+                 demo.search_books_by_title_fuzzy]:
+        cases.append(BenchmarkCase(f'demo.{func.__name__}', func, ('Banana',)))
+    for func in [demo.count_books_by_author, demo.count_books_by_author_db, demo.count_books_by_author_cached,
+                 demo.count_books_by_author_snapshot, demo.acount_books_by_author_db]:
+        cases.append(BenchmarkCase(f'demo.{func.__name__}', func, (single_author_id,)))
+    for func in [demo.get_books_with_author_names, demo.get_books_with_author_names_select_related,
+                 demo.get_books_with_author_names_rows,
+                 demo.aget_books_with_author_names_select_related]:
+        cases.append(BenchmarkCase(f'demo.{func.__name__}', func))
+
+    for func in [optimize_me.get_formatted_author_intros,
+                 optimize_me.get_formatted_author_intros_OPTIMIZED_PREFETCH,
+                 optimize_me.get_formatted_author_intros_OPTIMIZED_ANNOTATE,
+                 optimize_me.get_formatted_author_intros_OPTIMIZED_ANNOTATE_AND_VALUES,
+                 optimize_me.get_formatted_author_intros_OPTIMIZED_DENORMALIZED,
+                 optimize_me.aget_formatted_author_intros_OPTIMIZED_DENORMALIZED]:
+        cases.append(BenchmarkCase(f'optimize_me.{func.__name__}', func, (author_ids,)))
+    for func in [optimize_me.get_highest_page_count_book_title,
+                 optimize_me.get_highest_page_count_book_title_OPTIMIZED,
+                 optimize_me.get_highest_page_count_book_title_SNAPSHOT,
+                 optimize_me.aget_highest_page_count_book_title_OPTIMIZED]:
+        cases.append(BenchmarkCase(f'optimize_me.{func.__name__}', func))
+    for func in [optimize_me.get_book_intros,
+                 optimize_me.get_book_intros_OPTIMIZED_PREFETCH_RELATED,
+                 optimize_me.get_book_intros_OPTIMIZED_ANNOTATE,
+                 optimize_me.get_book_intros_OPTIMIZED_SELECT_RELATED,
+                 optimize_me.get_book_intros_OPTIMIZED_CACHED,
+                 optimize_me.get_book_intros_OPTIMIZED_BATCHED,
+                 optimize_me.aget_book_intros_OPTIMIZED_SELECT_RELATED]:
+        cases.append(BenchmarkCase(f'optimize_me.{func.__name__}', func, (book_ids,)))
+
+    for func in [challenge.get_book_genres_PREFETCH_RELATED, challenge.get_book_genres_SELECT_RELATED,
+                 challenge.get_book_genres_BITMAP_INDEX, challenge.aget_book_genres_SELECT_RELATED]:
+        cases.append(BenchmarkCase(f'challenge.{func.__name__}', func, (titles,)))
+    for func in [challenge.get_list_of_titles_excluding_latest_books_by_author,
+                 challenge.get_list_of_titles_excluding_latest_books_by_author_2,
+                 challenge.get_list_of_titles_excluding_latest_books_by_author_SUMMARY_TABLE,
+                 challenge.get_books_with_author_info_SELECT_RELATED,
+                 challenge.get_books_with_author_info_PREFETCH_RELATED,
+                 challenge.get_books_with_author_info_ROWS,
+                 challenge.aget_books_with_author_info_SELECT_RELATED]:
+        cases.append(BenchmarkCase(f'challenge.{func.__name__}', func))
+
+    return cases
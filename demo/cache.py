@@ -0,0 +1,196 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from demo.models import Author, Book
+
+DEFAULT_TIMEOUT = 60 * 60
+# The local tier cannot see invalidations made by other processes, so entries
+# only live long enough to absorb bursts of repeated lookups.
+DEFAULT_LOCAL_TIMEOUT = 5
+DEFAULT_LOCAL_SIZE = 10_000
+
+
+class LRUCache:
+    """ Bounded, thread-safe in-process cache with a per-entry TTL. """
+    def __init__(self, max_size=DEFAULT_LOCAL_SIZE, timeout=DEFAULT_LOCAL_TIMEOUT):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            (value, expires_at) = entry
+            if expires_at < monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ModelCache:
+    """ Read-through cache of model instances keyed by primary key, with an
+    optional secondary lookup field (e.g. Book.title).
+
+    Lookups check the in-process LRU tier, then the shared Django cache
+    (settings.CACHES[alias]) and finally the database, filling both tiers on
+    the way back. Entries are invalidated by the handlers in demo/signals.py.
+    """
+    def __init__(self, queryset, lookup_field=None, alias='default',
+                 timeout=DEFAULT_TIMEOUT, local=None):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.lookup_field = lookup_field
+        self.alias = alias
+        self.timeout = timeout
+        self.local = local if local is not None else LRUCache()
+        self.prefix = f'demo:{self.model._meta.label_lower}'
+        # Keys invalidated in this thread's open transaction (see _uncommitted)
+        self._pending = threading.local()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def key(self, pk):
+        return f'{self.prefix}:pk:{pk}'
+
+    def lookup_key(self, value):
+        # Hash the value so arbitrary titles make valid memcached keys.
+        digest = hashlib.sha1(str(value).encode()).hexdigest()
+        return f'{self.prefix}:{self.lookup_field}:{digest}'
+
+    def _uncommitted(self):
+        """ Keys invalidated in the current transaction. Rows read for them
+        may hold its uncommitted writes, which a rollback would leave in the
+        cache, so they are not cached until the transaction ends.
+        """
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            self._pending.keys = set()
+            self._pending.transaction = None
+        elif getattr(self._pending, 'transaction', None) is not connection.atomic_blocks[0]:
+            # A transaction opened since the keys were recorded; theirs ended
+            self._pending.keys = set()
+            self._pending.transaction = connection.atomic_blocks[0]
+        return self._pending.keys
+
+    def _primary(self):
+        """ The queryset on the primary. A replica may not have replayed the
+        write whose invalidation caused the miss yet, and its old row would be
+        cached for the full timeout.
+        """
+        return self.queryset.using(DEFAULT_DB_ALIAS)
+
+    def _store(self, instance):
+        key = self.key(instance.pk)
+        if key in self._uncommitted():
+            return
+        self.local.set(key, instance)
+        self.shared.set(key, instance, self.timeout)
+
+    def get(self, pk):
+        return self.get_many([pk]).get(pk)
+
+    def get_many(self, pks):
+        """ Returns {pk: instance} for the pks that exist, in input order. """
+        found = {}
+        missing = []
+        for pk in pks:
+            instance = self.local.get(self.key(pk))
+            if instance is None:
+                missing.append(pk)
+            else:
+                found[pk] = instance
+
+        if missing:
+            shared_hits = self.shared.get_many([self.key(pk) for pk in missing])
+            still_missing = []
+            for pk in missing:
+                instance = shared_hits.get(self.key(pk))
+                if instance is None:
+                    still_missing.append(pk)
+                else:
+                    self.local.set(self.key(pk), instance)
+                    found[pk] = instance
+
+            if still_missing:
+                loaded = self._primary().in_bulk(still_missing)
+                uncommitted = self._uncommitted()
+                cacheable = {self.key(pk): instance for (pk, instance) in loaded.items()
+                             if self.key(pk) not in uncommitted}
+                self.shared.set_many(cacheable, self.timeout)
+                for (key, instance) in cacheable.items():
+                    self.local.set(key, instance)
+                found.update(loaded)
+
+        return {pk: found[pk] for pk in pks if pk in found}
+
+    def get_by(self, value):
+        """ Returns the first instance (by pk) whose lookup field equals `value`. """
+        key = self.lookup_key(value)
+        pk = self.local.get(key)
+        if pk is None:
+            pk = self.shared.get(key)
+        if pk is not None:
+            instance = self.get(pk)
+            # The row may have been renamed since the pk was cached.
+            if instance is not None and getattr(instance, self.lookup_field) == value:
+                self.local.set(key, pk)
+                return instance
+
+        instance = self._primary().filter(**{self.lookup_field: value}).order_by('pk').first()
+        if instance is not None and key not in self._uncommitted():
+            self.local.set(key, instance.pk)
+            self.shared.set(key, instance.pk, self.timeout)
+            self._store(instance)
+        return instance
+
+    def invalidate(self, pks, lookup_values=()):
+        keys = [self.key(pk) for pk in pks]
+        if self.lookup_field:
+            keys += [self.lookup_key(value) for value in lookup_values]
+
+        def delete():
+            for key in keys:
+                self.local.delete(key)
+            self.shared.delete_many(keys)
+
+        # Invalidate now and again after commit, so a concurrent reader cannot
+        # re-cache the pre-commit row in between.
+        delete()
+        if transaction.get_connection().in_atomic_block:
+            self._uncommitted().update(keys)
+        transaction.on_commit(delete)
+
+
+author_cache = ModelCache(Author.objects.all())
+book_cache = ModelCache(
+    Book.objects.select_related('author').prefetch_related('genres'),
+    lookup_field='title'
+)
@@ -0,0 +1,169 @@
+import threading
+from time import monotonic
+
+import numpy as np
+from django.db import transaction
+
+from demo.models import Book, Genre
+
+# Writes from other processes, and writes that bypass signals (bulk_create,
+# COPY, raw SQL), are only picked up when the index is rebuilt.
+DEFAULT_MAX_AGE = 5 * 60
+
+
+class GenreBitmapIndex:
+    """ In-process index of which books have which genres: one boolean array
+    over book ids per genre, stacked into a (genres x books) matrix.
+
+    The index is built lazily from the Book.genres table on first use (or once
+    it is older than `max_age` seconds) and kept current by the handlers in
+    demo/signals.py. Updates are applied when the writing transaction commits.
+
+    The matrix, genre ids and names are never modified in place: each update
+    builds new ones and swaps them in with a single assignment, so a reader
+    always sees one consistent snapshot.
+    """
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        # (matrix, genre_ids, names)
+        self._snapshot = None
+        self._built_at = None
+
+    def _build(self):
+        pairs = np.array(
+            Book.genres.through.objects.values_list('book_id', 'genre_id'), dtype=np.int64
+        ).reshape(-1, 2)
+        names = dict(Genre.objects.order_by('id').values_list('id', 'name'))
+        genre_ids = list(names)
+        width = int(pairs[:, 0].max()) + 1 if len(pairs) else 0
+
+        matrix = np.zeros((len(genre_ids), width), dtype=bool)
+        known = np.isin(pairs[:, 1], genre_ids)
+        # genre_ids is sorted, so a genre's row is its position in that list.
+        matrix[np.searchsorted(genre_ids, pairs[known, 1]), pairs[known, 0]] = True
+
+        self._snapshot = (matrix, genre_ids, names)
+        self._built_at = monotonic()
+
+    def _current(self):
+        """ Returns (matrix, genre_ids, names), rebuilding if needed. """
+        with self._lock:
+            if self._built_at is None or monotonic() - self._built_at > self.max_age:
+                self._build()
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    ##########################################
+    # QUERIES
+    ##########################################
+    def _columns(self, matrix, book_ids):
+        book_ids = np.fromiter(book_ids, dtype=np.int64)
+        # Books newer than the index have no genres yet.
+        return book_ids[(book_ids >= 0) & (book_ids < matrix.shape[1])]
+
+    def genres_of(self, book_ids):
+        """ Returns the sorted names of the genres any of `book_ids` have. """
+        (matrix, genre_ids, names) = self._current()
+        present = matrix[:, self._columns(matrix, book_ids)].any(axis=1)
+        return sorted(names[genre_ids[row]] for row in np.flatnonzero(present))
+
+    def untagged_books(self, book_ids):
+        """ Returns the ids among `book_ids` that have no genre at all. """
+        (matrix, _, _) = self._current()
+        book_ids = np.unique(np.fromiter(book_ids, dtype=np.int64))
+        columns = self._columns(matrix, book_ids)
+        tagged = columns[matrix[:, columns].any(axis=0)]
+        return np.setdiff1d(book_ids, tagged)
+
+    def books_in(self, genre_names, match_all=False):
+        """ Returns the ids of the books having any (or, with match_all, every)
+        one of the named genres, as a sorted NumPy array.
+        """
+        (matrix, genre_ids, names) = self._current()
+        genre_names = set(genre_names)
+        rows = [row for (row, genre_id) in enumerate(genre_ids) if names[genre_id] in genre_names]
+        if not rows or (match_all and len(rows) < len(genre_names)):
+            return np.array([], dtype=np.int64)
+        selected = matrix[rows]
+        return np.flatnonzero(selected.all(axis=0) if match_all else selected.any(axis=0))
+
+    ##########################################
+    # UPDATES
+    ##########################################
+    def _on_commit(self, update):
+        """ Once the transaction commits, replaces the snapshot with
+        update(matrix, genre_ids, names), which must not modify its arguments.
+        """
+        def apply():
+            with self._lock:
+                # Not built yet: the next build reads the committed rows.
+                if self._built_at is not None:
+                    self._snapshot = update(*self._snapshot)
+        transaction.on_commit(apply)
+
+    @staticmethod
+    def _copy(matrix, book_ids=()):
+        """ Returns a copy of `matrix`, widened to fit `book_ids`. """
+        width = max(max(book_ids, default=-1) + 1, matrix.shape[1])
+        if width > matrix.shape[1]:
+            width = max(width, 2 * matrix.shape[1])
+        copy = np.zeros((matrix.shape[0], width), dtype=bool)
+        copy[:, :matrix.shape[1]] = matrix
+        return copy
+
+    @staticmethod
+    def _rows(genre_ids, names, of_genre_ids):
+        return [genre_ids.index(genre_id) for genre_id in of_genre_ids if genre_id in names]
+
+    def set_genres(self, book_ids, genre_ids, value):
+        """ Marks each of `book_ids` as having (or not having) each of `genre_ids`. """
+        book_ids = list(book_ids)
+        of_genre_ids = list(genre_ids)
+
+        def update(matrix, genre_ids, names):
+            matrix = self._copy(matrix, book_ids if value else ())
+            rows = self._rows(genre_ids, names, of_genre_ids)
+            columns = [book_id for book_id in book_ids if book_id < matrix.shape[1]]
+            matrix[np.ix_(rows, columns)] = value
+            return (matrix, genre_ids, names)
+        self._on_commit(update)
+
+    def clear_books(self, book_ids):
+        book_ids = list(book_ids)
+
+        def update(matrix, genre_ids, names):
+            matrix = self._copy(matrix)
+            matrix[:, [book_id for book_id in book_ids if book_id < matrix.shape[1]]] = False
+            return (matrix, genre_ids, names)
+        self._on_commit(update)
+
+    def clear_genre(self, genre_id):
+        def update(matrix, genre_ids, names):
+            matrix = self._copy(matrix)
+            matrix[self._rows(genre_ids, names, [genre_id])] = False
+            return (matrix, genre_ids, names)
+        self._on_commit(update)
+
+    def save_genre(self, genre_id, name):
+        def update(matrix, genre_ids, names):
+            if genre_id not in names:
+                matrix = np.vstack([matrix, np.zeros((1, matrix.shape[1]), dtype=bool)])
+                genre_ids = [*genre_ids, genre_id]
+            return (matrix, genre_ids, {**names, genre_id: name})
+        self._on_commit(update)
+
+    def delete_genre(self, genre_id):
+        def update(matrix, genre_ids, names):
+            if genre_id not in names:
+                return (matrix, genre_ids, names)
+            row = genre_ids.index(genre_id)
+            names = {key: name for (key, name) in names.items() if key != genre_id}
+            return (np.delete(matrix, row, axis=0), genre_ids[:row] + genre_ids[row + 1:], names)
+        self._on_commit(update)
+
+
+genre_index = GenreBitmapIndex()
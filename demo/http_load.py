@@ -0,0 +1,94 @@
+import http.client
+import statistics
+import threading
+from dataclasses import dataclass, field
+from time import perf_counter, perf_counter_ns
+from urllib.parse import urlsplit
+
+from demo.benchmark import percentile
+
+
+@dataclass
+class LoadResult:
+    url: str
+    concurrency: int
+    elapsed_s: float = 0
+    latencies_ns: list = field(default_factory=list)
+    errors: int = 0
+
+    @property
+    def requests(self):
+        return len(self.latencies_ns)
+
+    @property
+    def rps(self):
+        return self.requests / self.elapsed_s if self.elapsed_s else 0
+
+    def latency_ms(self, pct):
+        return percentile(self.latencies_ns, pct) / 1_000_000 if self.latencies_ns else 0
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'concurrency': self.concurrency,
+            'requests': self.requests,
+            'errors': self.errors,
+            'rps': self.rps,
+            'mean_ms': statistics.mean(self.latencies_ns) / 1_000_000 if self.latencies_ns else 0,
+            'p50_ms': self.latency_ms(50),
+            'p99_ms': self.latency_ms(99),
+        }
+
+
+def _client(url, deadline, result, lock, timeout):
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    connection = None
+    latencies = []
+    errors = 0
+    while perf_counter() < deadline:
+        if connection is None:
+            connection = connection_class(parts.netloc, timeout=timeout)
+        start_ns = perf_counter_ns()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = None
+            continue
+        if response.status >= 400:
+            errors += 1
+        else:
+            latencies.append(perf_counter_ns() - start_ns)
+        if response.will_close:
+            connection.close()
+            connection = None
+    if connection is not None:
+        connection.close()
+    with lock:
+        result.latencies_ns.extend(latencies)
+        result.errors += errors
+
+
+def run_http_load(url, concurrency, duration=10, timeout=30):
+    """ Hammers `url` with GET requests from `concurrency` keep-alive clients
+    (one thread each) for `duration` seconds.
+    """
+    result = LoadResult(url=url, concurrency=concurrency)
+    lock = threading.Lock()
+    start = perf_counter()
+    deadline = start + duration
+    threads = [
+        threading.Thread(target=_client, args=(url, deadline, result, lock, timeout))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.elapsed_s = perf_counter() - start
+    return result
@@ -0,0 +1,146 @@
+import re
+from dataclasses import dataclass
+
+from django.apps import apps
+
+# Scans and sorts over fewer rows than this are cheap enough to ignore
+# (e.g. the handful of Genre rows).
+MIN_ROWS = 1_000
+
+_IDENTIFIER = re.compile(r'[a-z_][a-z0-9_]*')
+_SORT_KEY = re.compile(r'^\(?(?:(\w+)\.)?(\w+)\)?( DESC)?$')
+
+
+@dataclass
+class Finding:
+    kind: str  # 'Seq Scan' or 'Sort'
+    relation: str
+    detail: str
+    rows: int
+    fields: tuple  # proposed index fields, '-' prefixed when descending; empty if none
+
+
+def walk_plan(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk_plan(child)
+
+
+def _model_for_table(table):
+    for model in apps.get_app_config('demo').get_models():
+        if model._meta.db_table == table:
+            return model
+    return None
+
+
+def _field_for_column(model, column):
+    for field in model._meta.concrete_fields:
+        if field.column == column:
+            return field
+    return None
+
+
+def _scanned_rows(node):
+    return node.get('Actual Rows', node.get('Plan Rows', 0)) + node.get('Rows Removed by Filter', 0)
+
+
+def _seq_scan_finding(node):
+    model = _model_for_table(node['Relation Name'])
+    filter_text = node.get('Filter', '')
+    fields = []
+    if model is not None:
+        for identifier in _IDENTIFIER.findall(filter_text):
+            field = _field_for_column(model, identifier)
+            if field is not None and field.name not in fields:
+                fields.append(field.name)
+    return Finding('Seq Scan', node['Relation Name'], filter_text, _scanned_rows(node), tuple(fields))
+
+
+def _sort_finding(node):
+    aliases = {
+        child['Alias']: child['Relation Name']
+        for child in walk_plan(node) if 'Relation Name' in child
+    }
+    relations = set(aliases.values())
+    fields = []
+    relation = None
+    for key in node.get('Sort Key', []):
+        match = _SORT_KEY.match(key)
+        if not match:
+            return Finding('Sort', relation or '', ', '.join(node['Sort Key']), node.get('Plan Rows', 0), ())
+        (alias, column, desc) = match.groups()
+        key_relation = aliases.get(alias) if alias else (next(iter(relations)) if len(relations) == 1 else None)
+        if key_relation is None or (relation is not None and key_relation != relation):
+            fields = []
+            break
+        relation = key_relation
+        model = _model_for_table(relation)
+        field = _field_for_column(model, column) if model is not None else None
+        if field is None:
+            fields = []
+            break
+        fields.append(f'-{field.name}' if desc else field.name)
+    rows = max((_scanned_rows(child) for child in walk_plan(node) if 'Relation Name' in child), default=0)
+    return Finding('Sort', relation or '', ', '.join(node.get('Sort Key', [])), rows, tuple(fields))
+
+
+def analyze_plan(plan):
+    """ Returns the sequential scans and sorts in an EXPLAIN (FORMAT JSON) plan
+    that touch at least MIN_ROWS rows.
+    """
+    root = plan[0]['Plan'] if isinstance(plan, list) else plan['Plan']
+    findings = []
+    for node in walk_plan(root):
+        if node['Node Type'] in ('Seq Scan', 'Parallel Seq Scan'):
+            finding = _seq_scan_finding(node)
+        elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+            finding = _sort_finding(node)
+        else:
+            continue
+        if finding.rows >= MIN_ROWS:
+            findings.append(finding)
+    return findings
+
+
+def _existing_indexes(model):
+    indexes = [tuple(index.fields) for index in model._meta.indexes]
+    for field in model._meta.concrete_fields:
+        if field.primary_key or field.db_index or field.unique:
+            indexes.append((field.name,))
+    return indexes
+
+
+def _is_covered(model, fields, ordered):
+    def normalize(names):
+        return [name if ordered else name.lstrip('-') for name in names]
+
+    wanted = normalize(fields)
+    reversed_wanted = [name[1:] if name.startswith('-') else f'-{name}' for name in wanted]
+    for index in _existing_indexes(model):
+        prefix = normalize(index)[:len(wanted)]
+        # A B-tree can be scanned backwards, so fully reversed sorts are covered too.
+        if prefix == wanted or (ordered and prefix == reversed_wanted):
+            return True
+    return False
+
+
+def propose_indexes(findings):
+    """ Returns {model: [field tuples]} for findings not already served by an index. """
+    proposals = {}
+    for finding in findings:
+        model = _model_for_table(finding.relation)
+        if model is None or not finding.fields:
+            continue
+        if _is_covered(model, finding.fields, ordered=finding.kind == 'Sort'):
+            continue
+        model_proposals = proposals.setdefault(model, [])
+        if finding.fields not in model_proposals:
+            model_proposals.append(finding.fields)
+    return proposals
+
+
+def index_name(model, fields):
+    """ Django limits index names to 30 characters. """
+    parts = [field.lstrip('-') + ('_desc' if field.startswith('-') else '') for field in fields]
+    name = f'{model._meta.model_name}_{"_".join(parts)}_idx'
+    return name if len(name) <= 30 else f'{name[:26]}_idx'
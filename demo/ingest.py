@@ -0,0 +1,241 @@
+import csv
+import json
+from dataclasses import dataclass
+from datetime import date
+from time import perf_counter
+
+from django.db import transaction
+
+from demo.analytics import book_snapshot
+from demo.cache import author_cache, book_cache
+from demo.genre_index import genre_index
+from demo.models import Author, Book, Genre, LatestBook
+from demo.page_cache import AUTHORS, BOOKS, GENRES, bump_versions, version_key
+
+DEFAULT_BATCH_SIZE = 1_000
+INGEST_FORMATS = ['csv', 'ndjson']
+# CSV rows list their genres in one column, e.g. "Fantasy|Horror"
+CSV_GENRE_SEPARATOR = '|'
+UPDATE_FIELDS = ['title_without_index', 'page_count', 'publication_date', 'updated_at']
+TITLE_MAX_LENGTH = Book._meta.get_field('title').max_length
+AUTHOR_NAME_MAX_LENGTH = Author._meta.get_field('name').max_length
+GENRE_NAME_MAX_LENGTH = Genre._meta.get_field('name').max_length
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+@dataclass
+class IngestRow:
+    title: str
+    author_name: str
+    page_count: int
+    publication_date: date = None
+    # None leaves an existing book's genres untouched
+    genre_names: list = None
+
+
+@dataclass
+class IngestResult:
+    rows: int = 0
+    batches: int = 0
+    authors_created: int = 0
+    genres_created: int = 0
+    elapsed_s: float = 0
+
+    @property
+    def rows_per_s(self):
+        return self.rows / self.elapsed_s if self.elapsed_s else 0
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'batches': self.batches,
+            'authors_created': self.authors_created,
+            'genres_created': self.genres_created,
+            'seconds': self.elapsed_s,
+            'rows_per_s': self.rows_per_s,
+        }
+
+
+##########################################
+# PARSING
+##########################################
+def _clean(record, line):
+    if not isinstance(record, dict):
+        raise InvalidRow(f'line {line}: expected an object')
+    try:
+        title = str(record['title']).strip()
+        author_name = str(record['author_name']).strip()
+        page_count = int(record['page_count'])
+        publication_date = record.get('publication_date') or None
+        if publication_date is not None:
+            publication_date = date.fromisoformat(publication_date)
+    except KeyError as e:
+        raise InvalidRow(f'line {line}: missing {e.args[0]}')
+    except (TypeError, ValueError) as e:
+        raise InvalidRow(f'line {line}: {e}')
+    if not title or not author_name:
+        raise InvalidRow(f'line {line}: title and author_name must not be empty')
+    if len(title) > TITLE_MAX_LENGTH or len(author_name) > AUTHOR_NAME_MAX_LENGTH:
+        raise InvalidRow(f'line {line}: title or author_name is too long')
+
+    genre_names = record.get('genres')
+    if isinstance(genre_names, str):
+        genre_names = genre_names.split(CSV_GENRE_SEPARATOR)
+    if genre_names is not None:
+        if not isinstance(genre_names, list) or not all(isinstance(name, str) for name in genre_names):
+            raise InvalidRow(f'line {line}: genres must be a list of names')
+        genre_names = sorted({name.strip() for name in genre_names} - {''})
+        if any(len(name) > GENRE_NAME_MAX_LENGTH for name in genre_names):
+            raise InvalidRow(f'line {line}: a genre name is too long')
+    return IngestRow(title, author_name, page_count, publication_date, genre_names)
+
+
+def parse_csv(lines):
+    """ Rows from CSV text lines with a header naming the title, author_name,
+    page_count and optional publication_date (YYYY-MM-DD) and genres columns.
+    """
+    reader = csv.DictReader(lines)
+    for record in reader:
+        # A CSV without a genres column leaves genres untouched
+        if 'genres' in record and record['genres'] is None:
+            record['genres'] = ''
+        yield _clean(record, reader.line_num)
+
+
+def parse_ndjson(lines):
+    """ Rows from NDJSON lines, one object per line with the CSV columns as
+    keys and genres as a list of names.
+    """
+    for (line_num, line) in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise InvalidRow(f'line {line_num}: {e}')
+        yield _clean(record, line_num)
+
+
+PARSERS = {'csv': parse_csv, 'ndjson': parse_ndjson}
+
+
+##########################################
+# WRITING
+##########################################
+class BookImporter:
+    """ Upserts books in batches of `batch_size`, each in its own transaction:
+      1. look up the batch's authors and genres by name and bulk_create the missing ones
+      2. bulk_create the books with update_conflicts on (author, title)
+      3. replace the batch's genre links with one DELETE and one INSERT
+      4. repair what the skipped signals would have maintained: Author.book_count,
+         LatestBook and the caches
+    Batches committed before an invalid row stay committed.
+    """
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        # Names resolved by earlier batches
+        self.author_ids = {}
+        self.genre_ids = {}
+        self.result = IngestResult()
+
+    def _resolve(self, model, names, known):
+        """ Adds the ids of `names` to `known`, creating the missing rows.
+        Returns the number created.
+        """
+        missing = set(names) - set(known)
+        if not missing:
+            return 0
+        # The lowest id wins when a name is not unique
+        for (name, pk) in model.objects.filter(name__in=missing).order_by('-id').values_list('name', 'id'):
+            known[name] = pk
+        created = model.objects.bulk_create([model(name=name) for name in sorted(missing - set(known))])
+        for instance in created:
+            known[instance.name] = instance.pk
+        return len(created)
+
+    def write_batch(self, rows):
+        # The last row wins when a batch repeats a book: ON CONFLICT cannot
+        # update the same row twice in one statement.
+        rows = list({(row.author_name, row.title): row for row in rows}.values())
+        with transaction.atomic():
+            authors_created = self._resolve(Author, {row.author_name for row in rows}, self.author_ids)
+            genres_created = self._resolve(
+                Genre, {name for row in rows for name in row.genre_names or ()}, self.genre_ids
+            )
+            self.result.authors_created += authors_created
+            self.result.genres_created += genres_created
+
+            books = Book.objects.bulk_create(
+                [
+                    Book(
+                        title=row.title,
+                        title_without_index=row.title,
+                        page_count=row.page_count,
+                        publication_date=row.publication_date,
+                        author_id=self.author_ids[row.author_name],
+                    )
+                    for row in rows
+                ],
+                update_conflicts=True,
+                unique_fields=['author', 'title'],
+                update_fields=UPDATE_FIELDS,
+            )
+
+            Through = Book.genres.through
+            tagged = [(book, row) for (book, row) in zip(books, rows) if row.genre_names is not None]
+            if tagged:
+                Through.objects.filter(book_id__in=[book.pk for (book, _) in tagged]).delete()
+                Through.objects.bulk_create([
+                    Through(book_id=book.pk, genre_id=self.genre_ids[name])
+                    for (book, row) in tagged
+                    for name in row.genre_names
+                ])
+
+            book_ids = [book.pk for book in books]
+            author_ids = {book.author_id for book in books}
+            Author.refresh_book_counts(author_ids)
+            LatestBook.refresh_authors(author_ids)
+            book_cache.invalidate(book_ids, [book.title for book in books])
+            author_cache.invalidate(author_ids)
+            book_snapshot.mark_dirty(book_ids)
+            transaction.on_commit(lambda: book_snapshot.mark_dirty(book_ids))
+            if tagged:
+                transaction.on_commit(genre_index.invalidate)
+            # An upsert may add books, so the book lists go stale as well
+            bump_versions(
+                [version_key('book', book_id) for book_id in book_ids]
+                + [version_key(kind, author_id) for author_id in author_ids for kind in ('author', 'author_books')]
+                + [version_key(BOOKS)]
+                + ([version_key(AUTHORS)] if authors_created else [])
+                + ([version_key(GENRES)] if genres_created else [])
+            )
+
+        self.result.rows += len(rows)
+        self.result.batches += 1
+
+    def run(self, rows):
+        start = perf_counter()
+        batch = []
+        try:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    self.write_batch(batch)
+                    batch = []
+            if batch:
+                self.write_batch(batch)
+        finally:
+            self.result.elapsed_s = perf_counter() - start
+        return self.result
+
+
+def ingest_books(lines, input_format, batch_size=DEFAULT_BATCH_SIZE):
+    """ Upserts the books in `lines` (text lines in one of INGEST_FORMATS)
+    and returns an IngestResult. Raises InvalidRow on the first bad row.
+    """
+    if input_format not in PARSERS:
+        raise ValueError(f'format must be one of {", ".join(INGEST_FORMATS)}, not {input_format!r}')
+    return BookImporter(batch_size).run(PARSERS[input_format](lines))
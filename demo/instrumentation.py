@@ -0,0 +1,179 @@
+import logging
+import re
+import threading
+import traceback
+from collections import Counter
+from contextlib import ContextDecorator
+from functools import partial
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPEAT_THRESHOLD = 10
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """ Normalizes a statement so that queries differing only in their
+    literal values (or in the length of an IN list) share a fingerprint.
+
+        SELECT ... WHERE "id" = 7            -> SELECT ... WHERE "id" = ?
+        SELECT ... WHERE "id" IN (%s, %s)    -> SELECT ... WHERE "id" IN (...)
+    """
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryRecord:
+    def __init__(self, fp, sql):
+        self.fingerprint = fp
+        self.sql = sql
+        self.count = 0
+        # Stack of the first repeated execution, which points at the loop
+        # responsible for the N+1.
+        self.stack = None
+
+
+class BudgetFrame:
+    """ What one entry into a query_budget has counted. """
+    def __init__(self):
+        self.wrapper_cm = None
+        self.reset()
+
+    def reset(self):
+        self.records = {}
+        self.total = 0
+
+
+class query_budget(ContextDecorator):
+    """ Counts the statements run on a connection and enforces a budget.
+
+    Use as a context manager or decorator:
+
+        with query_budget(max_queries=2):
+            get_book_intros_OPTIMIZED_SELECT_RELATED(book_ids)
+
+        @query_budget(max_queries=1, repeat_threshold=3, action='log')
+        def get_book_by_title(title): ...
+
+    `max_queries` caps the total statement count and `repeat_threshold` caps
+    how often a single fingerprint may repeat before it is reported as an N+1.
+    Either can be None to disable that check. With action='raise' (the default)
+    a violation raises QueryBudgetExceeded when the block exits; with
+    action='log' it is logged as a warning along with the offending stack.
+    """
+    def __init__(self, max_queries=None, repeat_threshold=DEFAULT_REPEAT_THRESHOLD,
+                 action='raise', using=DEFAULT_DB_ALIAS):
+        if action not in ('raise', 'log'):
+            raise ValueError(f"action must be 'raise' or 'log', not {action!r}")
+        self.max_queries = max_queries
+        self.repeat_threshold = repeat_threshold
+        self.action = action
+        self.using = using
+        # One frame per entry, so a decorated function may recurse or the same
+        # instance may be nested; each frame counts the statements run inside it.
+        # Per thread, since a decorated function may run in several at once
+        self._local = threading.local()
+
+    @property
+    def _frames(self):
+        frames = getattr(self._local, 'frames', None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    @property
+    def _frame(self):
+        """ This thread's innermost active entry, or the last one to exit. """
+        if self._frames:
+            return self._frames[-1]
+        last = getattr(self._local, 'last', None)
+        if last is None:
+            last = self._local.last = BudgetFrame()
+        return last
+
+    @property
+    def records(self):
+        return self._frame.records
+
+    @property
+    def total(self):
+        return self._frame.total
+
+    def reset(self):
+        self._frame.reset()
+
+    def _execute(self, frame, execute, sql, params, many, context):
+        frame.total += 1
+        fp = fingerprint(sql)
+        record = frame.records.get(fp)
+        if record is None:
+            record = frame.records[fp] = QueryRecord(fp, sql)
+        record.count += 1
+        if (record.stack is None and self.repeat_threshold is not None
+                and record.count > self.repeat_threshold):
+            record.stack = ''.join(traceback.format_stack()[:-1])
+        return execute(sql, params, many, context)
+
+    def _repeated(self, frame):
+        if self.repeat_threshold is None:
+            return []
+        return sorted(
+            (record for record in frame.records.values() if record.count > self.repeat_threshold),
+            key=lambda record: -record.count
+        )
+
+    @property
+    def repeated(self):
+        """ Records whose fingerprint repeated more than `repeat_threshold` times. """
+        return self._repeated(self._frame)
+
+    @property
+    def counts(self):
+        return Counter({fp: record.count for (fp, record) in self.records.items()})
+
+    def violations(self, frame=None):
+        frame = frame or self._frame
+        messages = []
+        if self.max_queries is not None and frame.total > self.max_queries:
+            messages.append(f'{frame.total} queries exceeded the budget of {self.max_queries}')
+        for record in self._repeated(frame):
+            messages.append(
+                f'Possible N+1: {record.count} executions of: {record.fingerprint}\n{record.stack}'
+            )
+        return messages
+
+    def __enter__(self):
+        frame = BudgetFrame()
+        frame.wrapper_cm = connections[self.using].execute_wrapper(partial(self._execute, frame))
+        frame.wrapper_cm.__enter__()
+        self._frames.append(frame)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        frame = self._frames.pop()
+        frame.wrapper_cm.__exit__(exc_type, exc_value, tb)
+        frame.wrapper_cm = None
+        self._local.last = frame
+        if exc_type is not None:
+            return False
+        messages = self.violations(frame)
+        if not messages:
+            return False
+        if self.action == 'raise':
+            raise QueryBudgetExceeded('\n'.join(messages))
+        for message in messages:
+            logger.warning(message)
+        return False
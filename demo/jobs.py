@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import traceback
+from datetime import timedelta
+from time import monotonic, sleep
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from demo.benchmark import command_module
+from demo.models import Author, ReportJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULT_TTL = 60 * 60
+DEFAULT_JOB_TIMEOUT = 10 * 60
+DEFAULT_MAX_ATTEMPTS = 3
+POLL_INTERVAL = 1
+# Seconds between a worker's passes over stale and expired jobs
+HOUSEKEEPING_INTERVAL = 60
+
+Status = ReportJob.Status
+
+
+##########################################
+# REPORTS
+##########################################
+def prize_candidates():
+    """ Titles of books that are not their author's latest, read off the
+    LatestBook summary table (see challenge_2025-01-30).
+    """
+    challenge = command_module('challenge_2025-01-30')
+    return challenge.get_list_of_titles_excluding_latest_books_by_author_SUMMARY_TABLE()
+
+
+def author_intros():
+    """ The intro of every author in the catalogue, in id order. """
+    optimize_me = command_module('optimize_me')
+    return optimize_me.get_formatted_author_intros_OPTIMIZED_DENORMALIZED(Author.objects.values('id'))
+
+
+# Name -> function called with the job's params; results must be JSON serializable
+REPORTS = {
+    'prize_candidates': prize_candidates,
+    'author_intros': author_intros,
+}
+
+
+def result_ttl():
+    return getattr(settings, 'DEMO_REPORT_TTL', DEFAULT_RESULT_TTL)
+
+
+def report_key(report, params):
+    return hashlib.md5(json.dumps([report, params], sort_keys=True).encode()).hexdigest()
+
+
+##########################################
+# CALLERS
+##########################################
+def request_report(report, params=None):
+    """ The job for `report` with `params`: the latest finished one whose
+    result has not expired, else the one already queued or running, else a
+    newly queued one. Poll get_job(job.id) until its status is done or failed.
+    """
+    if report not in REPORTS:
+        raise ValueError(f'report must be one of {", ".join(REPORTS)}, not {report!r}')
+    params = params or {}
+    key = report_key(report, params)
+    while True:
+        job = (ReportJob.objects
+               .filter(Q(status=Status.DONE, expires_at__gt=timezone.now())
+                       | Q(status__in=[Status.PENDING, Status.RUNNING]), key=key)
+               .order_by(F('finished_at').desc(nulls_last=True))
+               .first())
+        if job is not None:
+            return job
+        try:
+            with transaction.atomic():
+                return ReportJob.objects.create(report=report, params=params, key=key)
+        except IntegrityError:
+            # Another caller queued it first; look again
+            continue
+
+
+def get_job(job_id):
+    return ReportJob.objects.filter(id=job_id).first()
+
+
+##########################################
+# WORKERS
+##########################################
+def claim_job(worker):
+    """ Marks the oldest pending job as running on `worker` and returns it.
+    SKIP LOCKED lets concurrent workers claim different jobs without waiting
+    on each other's row locks.
+    """
+    with transaction.atomic():
+        job = (ReportJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(status=Status.PENDING)
+               .order_by('created_at')
+               .first())
+        if job is None:
+            return None
+        job.status = Status.RUNNING
+        job.worker = worker
+        job.started_at = timezone.now()
+        job.attempts += 1
+        job.save(update_fields=['status', 'worker', 'started_at', 'attempts'])
+    return job
+
+
+def _finish(job, **fields):
+    now = timezone.now()
+    finished = (ReportJob.objects
+                .filter(id=job.id, status=Status.RUNNING, worker=job.worker, attempts=job.attempts)
+                .update(finished_at=now, expires_at=now + timedelta(seconds=result_ttl()), **fields))
+    if not finished:
+        logger.warning('Job %s was requeued while %s ran it; its outcome is discarded', job.id, job.worker)
+    return bool(finished)
+
+
+def run_job(job):
+    """ Computes a claimed job's report and stores the result, or the error.
+    Returns whether it succeeded.
+    """
+    try:
+        result = REPORTS[job.report](**job.params)
+        # Storing the result fails too if it is not JSON serializable (or, say,
+        # contains a NUL character jsonb rejects); that fails the job, not the worker
+        with transaction.atomic():
+            return _finish(job, status=Status.DONE, result=result)
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.id, job.report)
+        error = traceback.format_exc()
+    try:
+        _finish(job, status=Status.FAILED, error=error)
+    except Exception:
+        logger.exception('Could not record the failure of job %s', job.id)
+    return False
+
+
+def requeue_stale_jobs(timeout=None, max_attempts=None):
+    """ Requeues jobs that have been running for longer than `timeout`
+    seconds, whose worker presumably died, and fails those already claimed
+    `max_attempts` times. Returns (requeued, failed).
+    """
+    timeout = timeout or getattr(settings, 'DEMO_JOB_TIMEOUT', DEFAULT_JOB_TIMEOUT)
+    max_attempts = max_attempts or getattr(settings, 'DEMO_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    now = timezone.now()
+    stale = ReportJob.objects.filter(status=Status.RUNNING, started_at__lt=now - timedelta(seconds=timeout))
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=Status.FAILED, finished_at=now, expires_at=now + timedelta(seconds=result_ttl()),
+        error=f'Timed out after {max_attempts} attempt(s)'
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(status=Status.PENDING, worker='')
+    return (requeued, failed)
+
+
+def purge_expired_jobs():
+    """ Deletes finished jobs whose result has expired. Returns how many. """
+    return ReportJob.objects.filter(expires_at__lt=timezone.now()).delete()[0]
+
+
+def default_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def work(worker=None, burst=False, poll_interval=POLL_INTERVAL):
+    """ Claims and runs jobs until interrupted or, with `burst`, until the
+    queue is empty. Returns the number of jobs run.
+    """
+    worker = worker or default_worker_name()
+    ran = 0
+    housekeeping_at = 0
+    while True:
+        # Like a request would: drop connections past CONN_MAX_AGE or broken
+        close_old_connections()
+        if monotonic() >= housekeeping_at:
+            requeue_stale_jobs()
+            purge_expired_jobs()
+            housekeeping_at = monotonic() + HOUSEKEEPING_INTERVAL
+
+        job = claim_job(worker)
+        if job is None:
+            if burst:
+                return ran
+            sleep(poll_interval)
+            continue
+        start = monotonic()
+        succeeded = run_job(job)
+        ran += 1
+        logger.info('%s ran job %s (%s) in %.2f s: %s', worker, job.id, job.report, monotonic() - start,
+                    'done' if succeeded else 'failed')
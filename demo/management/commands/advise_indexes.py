@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from demo.benchmark import get_query_set, run_benchmark
+from demo.index_advisor import analyze_plan, index_name, propose_indexes
+from demo.utils import maybe_populate
+
+
+class Command(BaseCommand):
+    help = 'Explains the benchmark query set and proposes Meta.indexes for seq scans and sorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1_000,
+                            help='Maximum number of ids/titles passed to the bulk functions')
+        parser.add_argument('--filter', default='',
+                            help='Only explain cases whose name contains this string')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('advise_indexes needs EXPLAIN output from PostgreSQL')
+        maybe_populate()
+
+        findings = []
+        for case in get_query_set(size=options['size']):
+            if options['filter'] not in case.name:
+                continue
+            result = run_benchmark(case.func, case.args, warmup=0, trials=1, explain=True, name=case.name)
+            for explain in result.explains:
+                for finding in analyze_plan(explain['plan']):
+                    findings.append(finding)
+                    print(f'{case.name}: {finding.kind} on {finding.relation} '
+                          f'({finding.rows:,} rows) {finding.detail[:120]}')
+
+        proposals = propose_indexes(findings)
+        if not proposals:
+            print('\nNo missing indexes found')
+            return
+
+        print('\nProposed Meta.indexes:')
+        for (model, field_lists) in proposals.items():
+            print(f'\n{model.__name__}:')
+            for fields in field_lists:
+                print(f'    models.Index(fields={list(fields)!r}, name={index_name(model, fields)!r}),')
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from demo.batching import STRATEGIES, fetch_in
+from demo.benchmark import DEFAULT_TRIALS, DEFAULT_WARMUP, export_json, positive_int, run_benchmark
+from demo.models import Book
+from demo.utils import maybe_populate
+
+
+class Command(BaseCommand):
+    help = 'Compares demo.batching.fetch_in strategies, chunk sizes and worker counts for large id lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keys', type=int, default=50_000, help='Number of book ids to look up')
+        parser.add_argument('--strategy', nargs='+', choices=STRATEGIES, default=STRATEGIES)
+        parser.add_argument('--chunk-size', type=int, nargs='+', default=[0, 1_000, 10_000],
+                            help='0 sends every key in a single query')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+        parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+        parser.add_argument('--trials', type=positive_int, default=DEFAULT_TRIALS)
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        maybe_populate()
+        book_ids = list(Book.objects.order_by('id').values_list('id', flat=True)[:options['keys']])
+        queryset = Book.objects.select_related('author')
+
+        def fetch(strategy, chunk_size, workers):
+            return list(fetch_in(queryset, 'id', book_ids, strategy=strategy,
+                                 chunk_size=chunk_size or None, workers=workers))
+
+        results = []
+        for strategy in options['strategy']:
+            for chunk_size in options['chunk_size']:
+                for workers in options['workers']:
+                    if workers > 1 and (not chunk_size or chunk_size >= len(book_ids)):
+                        continue
+                    name = f'{strategy} chunk_size={chunk_size or len(book_ids)} workers={workers}'
+                    result = run_benchmark(
+                        fetch, (strategy, chunk_size, workers),
+                        warmup=options['warmup'], trials=options['trials'], name=name
+                    )
+                    results.append(result)
+                    # Queries on worker threads run on other connections and are not counted
+                    print(f'{name:<45} min {result.min_ms:>9.2f} ms  median {result.median_ms:>9.2f} ms  '
+                          f'p95 {result.p95_ms:>9.2f} ms  {len(result.result):,} rows')
+
+        if options['output']:
+            export_json(results, options['output'], keys=len(book_ids), trials=options['trials'])
+            print(f'Wrote {len(results)} results to {options["output"]}')
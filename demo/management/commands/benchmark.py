@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from demo.benchmark import (
+    DEFAULT_TRIALS, DEFAULT_WARMUP, export_json, get_query_set, positive_int, run_benchmark
+)
+from demo.utils import maybe_populate
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the demo query functions over repeated trials'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+        parser.add_argument('--trials', type=positive_int, default=DEFAULT_TRIALS)
+        parser.add_argument('--size', type=int, default=50_000,
+                            help='Maximum number of ids/titles passed to the bulk functions')
+        parser.add_argument('--filter', default='',
+                            help='Only run cases whose name contains this string')
+        parser.add_argument('--explain', action='store_true',
+                            help='Capture EXPLAIN (ANALYZE, BUFFERS) plans (PostgreSQL only)')
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        maybe_populate()
+
+        results = []
+        for case in get_query_set(size=options['size']):
+            if options['filter'] not in case.name:
+                continue
+            result = run_benchmark(
+                case.func, case.args,
+                warmup=options['warmup'],
+                trials=options['trials'],
+                explain=options['explain'],
+                name=case.name
+            )
+            results.append(result)
+            print(f'{case.name:<75} min {result.min_ms:>10.2f} ms  '
+                  f'median {result.median_ms:>10.2f} ms  p95 {result.p95_ms:>10.2f} ms  '
+                  f'{result.queries:>7} queries')
+
+        if options['output']:
+            export_json(
+                results, options['output'],
+                warmup=options['warmup'], trials=options['trials'], size=options['size']
+            )
+            print(f'Wrote {len(results)} results to {options["output"]}')
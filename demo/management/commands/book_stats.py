@@ -0,0 +1,55 @@
+from time import perf_counter
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from demo.analytics import book_snapshot
+from demo.models import Author, Book
+from demo.utils import maybe_populate
+
+
+class Command(BaseCommand):
+    help = 'Prints a page-count and publication dashboard computed from a columnar snapshot of the book table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=5, help='Rows in each top-k table')
+        parser.add_argument('--bins', type=int, default=10, help='Histogram bins')
+
+    def handle(self, *args, **options):
+        maybe_populate()
+
+        start = perf_counter()
+        book_snapshot.load()
+        print(f'Loaded {len(book_snapshot):,} books in {(perf_counter() - start) * 1000:.1f} milliseconds')
+
+        start = perf_counter()
+        page_counts = book_snapshot.column('page_count')
+        per_author = book_snapshot.group_by('author_id', 'page_count', ['count', 'sum', 'max'])
+        by_books = book_snapshot.top_k('page_count', options['top'])
+        by_authors = np.argsort(-per_author['count'], kind='stable')[:options['top']]
+        (page_counts_hist, page_edges) = book_snapshot.histogram('page_count', options['bins'])
+        (dates_hist, date_edges) = book_snapshot.histogram('publication_date', options['bins'])
+        elapsed_ms = (perf_counter() - start) * 1000
+
+        # The only queries after loading: names for the handful of rows shown
+        titles = dict(Book.objects.filter(id__in=by_books[0].tolist()).values_list('id', 'title'))
+        author_ids = per_author['author_id'][by_authors].tolist()
+        names = dict(Author.objects.filter(id__in=author_ids).values_list('id', 'name'))
+
+        print(f'\nPage counts: mean {page_counts.mean():.1f}, median {np.median(page_counts):.0f}, max {page_counts.max()}')
+        print('\nLongest books')
+        for (book_id, page_count) in zip(*by_books):
+            print(f'  {titles.get(int(book_id), book_id):<40} {page_count:>8,} pages')
+        print('\nMost prolific authors')
+        for i in by_authors:
+            author_id = int(per_author['author_id'][i])
+            print(f'  {names.get(author_id, author_id):<40} {per_author["count"][i]:>8,} books '
+                  f'{int(per_author["sum"][i]):>10,} pages')
+        print('\nPage count histogram')
+        for (count, low, high) in zip(page_counts_hist, page_edges, page_edges[1:]):
+            print(f'  {low:>10.0f} - {high:<10.0f} {count:>8,}')
+        print('\nPublication date histogram')
+        for (count, low, high) in zip(dates_hist, date_edges, date_edges[1:]):
+            print(f'  {low} - {high} {count:>8,}')
+
+        print(f'\nComputed all aggregates in {elapsed_ms:.1f} milliseconds')
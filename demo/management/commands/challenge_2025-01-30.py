@@ -4,7 +4,9 @@ from django.core.management.base import BaseCommand
 from django.db import connection
 from django.db.models import OuterRef, Subquery
 
+from demo.genre_index import genre_index
 from demo.models import Book
+from demo.rows import BookRow
 from demo.utils import compare_runtimes_and_results, maybe_populate
 
 # select_related works by creating an SQL join and including the fields of the related object in
@@ -57,6 +59,15 @@ def get_list_of_titles_excluding_latest_books_by_author_2():
 
     return list(candidate_books)
 
+def get_list_of_titles_excluding_latest_books_by_author_SUMMARY_TABLE():
+    # LatestBook is maintained on write, so this is an anti-join against an
+    # indexed table instead of a sort of every book
+    candidate_books = Book.objects.filter(
+        latest_for__isnull=True
+    ).values_list('title', flat=True).distinct().order_by('title')
+
+    return list(candidate_books)
+
 # * Come up with a situation where using prefetch_related is better than select_related 
 # NOTE: I couldn't actually come up with a situation where select_related performance was worse
 def get_book_genres_PREFETCH_RELATED(book_titles):
@@ -67,6 +78,16 @@ def get_book_genres_SELECT_RELATED(book_titles):
     records = Book.objects.select_related('genres').values('genres__name').order_by('genres__name').filter(title__in=book_titles).all()
     return list(set([record['genres__name'] for record in records]))
 
+def get_book_genres_BITMAP_INDEX(book_titles):
+    # Only the title -> id lookup hits the database; which genres those books
+    # have is a vectorized check against the in-process genre index
+    book_ids = list(Book.objects.filter(title__in=book_titles).values_list('id', flat=True))
+    genres = genre_index.genres_of(book_ids)
+    # Match the LEFT JOIN above, which yields None for books without a genre
+    if len(genre_index.untagged_books(book_ids)):
+        genres.append(None)
+    return list(set(genres))
+
 # * Come up with a situation where select_related is better than prefetch_related
 def get_books_with_author_info_SELECT_RELATED():
     books = Book.objects.select_related('author').order_by('title', 'author__name').all()
@@ -74,6 +95,22 @@ def get_books_with_author_info_SELECT_RELATED():
         f'{book.title} is by {book.author.name}' for book in books
     ]
 
+def get_books_with_author_info_ROWS():
+    books = Book.objects.order_by('title', 'author__name').rows(BookRow, 'title', 'author__name')
+    return [
+        f'{book.title} is by {book.author_name}' for book in books
+    ]
+
+async def aget_books_with_author_info_SELECT_RELATED():
+    books = Book.objects.select_related('author').order_by('title', 'author__name')
+    return [
+        f'{book.title} is by {book.author.name}' async for book in books.aiterator()
+    ]
+
+async def aget_book_genres_SELECT_RELATED(book_titles):
+    records = Book.objects.values('genres__name').filter(title__in=book_titles)
+    return list(set([record['genres__name'] async for record in records.aiterator()]))
+
 def get_books_with_author_info_PREFETCH_RELATED():
     books = Book.objects.prefetch_related('author').order_by('title', 'author__name').all()
     return [
@@ -93,16 +130,37 @@ class Command(BaseCommand):
             book_titles
         )
 
+        compare_runtimes_and_results(
+            get_book_genres_SELECT_RELATED,
+            get_book_genres_BITMAP_INDEX,
+            book_titles
+        )
+
         compare_runtimes_and_results(
             get_list_of_titles_excluding_latest_books_by_author,
             get_list_of_titles_excluding_latest_books_by_author_2
         )
 
+        compare_runtimes_and_results(
+            get_list_of_titles_excluding_latest_books_by_author_2,
+            get_list_of_titles_excluding_latest_books_by_author_SUMMARY_TABLE
+        )
+
         compare_runtimes_and_results(
             get_books_with_author_info_SELECT_RELATED,
             get_books_with_author_info_PREFETCH_RELATED
         )
 
+        compare_runtimes_and_results(
+            get_books_with_author_info_SELECT_RELATED,
+            aget_books_with_author_info_SELECT_RELATED
+        )
+
+        compare_runtimes_and_results(
+            get_books_with_author_info_SELECT_RELATED,
+            get_books_with_author_info_ROWS
+        )
+
 
         
         
\ No newline at end of file
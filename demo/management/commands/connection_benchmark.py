@@ -0,0 +1,109 @@
+import json
+import threading
+from time import perf_counter, perf_counter_ns
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection, connections
+from django.test import RequestFactory
+from django.urls import resolve
+
+from demo.benchmark import current_commit, percentile
+from demo.utils import maybe_populate
+
+DEFAULT_PATHS = ['/demo/books/', '/demo/authors/']
+
+
+def _describe_settings():
+    settings_dict = connection.settings_dict
+    return {
+        'conn_max_age': settings_dict['CONN_MAX_AGE'],
+        'conn_health_checks': settings_dict['CONN_HEALTH_CHECKS'],
+        'pool': settings_dict['OPTIONS'].get('pool'),
+    }
+
+
+def _worker(path, deadline, acquire_ns, total_ns, lock):
+    """ Mimics Django's request cycle so CONN_MAX_AGE and pooling apply as
+    they would under a real server: request_started closes expired
+    connections and request_finished closes or returns the current one.
+    """
+    factory = RequestFactory()
+    view = resolve(path.split('?')[0]).func
+    acquires = []
+    totals = []
+    while perf_counter() < deadline:
+        request_started.send(sender=__name__)
+        start_ns = perf_counter_ns()
+        connection.ensure_connection()
+        acquired_ns = perf_counter_ns()
+        view(factory.get(path))
+        totals.append(perf_counter_ns() - start_ns)
+        acquires.append(acquired_ns - start_ns)
+        request_finished.send(sender=__name__)
+    connections.close_all()
+    with lock:
+        acquire_ns.extend(acquires)
+        total_ns.extend(totals)
+
+
+def run_level(path, concurrency, duration):
+    acquire_ns = []
+    total_ns = []
+    lock = threading.Lock()
+    start = perf_counter()
+    deadline = start + duration
+    threads = [
+        threading.Thread(target=_worker, args=(path, deadline, acquire_ns, total_ns, lock))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+    return {
+        'path': path,
+        'concurrency': concurrency,
+        'requests': len(total_ns),
+        'rps': len(total_ns) / elapsed,
+        'acquire_p50_ms': percentile(acquire_ns, 50) / 1_000_000,
+        'acquire_p99_ms': percentile(acquire_ns, 99) / 1_000_000,
+        'p50_ms': percentile(total_ns, 50) / 1_000_000,
+        'p99_ms': percentile(total_ns, 99) / 1_000_000,
+    }
+
+
+class Command(BaseCommand):
+    help = ('Measures connection-acquire latency and throughput of demo endpoints '
+            'under the current DB_CONN_MAX_AGE / DB_POOL settings')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', dest='paths',
+                            help=f'Endpoint to call in-process (default: {" ".join(DEFAULT_PATHS)})')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+        parser.add_argument('--duration', type=float, default=5, help='Seconds per level')
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        maybe_populate()
+        connections.close_all()
+
+        print(f'Connection settings: {_describe_settings()}')
+        results = []
+        for path in options['paths'] or DEFAULT_PATHS:
+            for concurrency in options['concurrency']:
+                result = run_level(path, concurrency, options['duration'])
+                results.append(result)
+                print(f'{path:<25} c={concurrency:<4} {result["rps"]:>9.1f} req/s  '
+                      f'acquire p50 {result["acquire_p50_ms"]:>7.3f} ms  p99 {result["acquire_p99_ms"]:>7.3f} ms  '
+                      f'request p50 {result["p50_ms"]:>8.2f} ms  p99 {result["p99_ms"]:>8.2f} ms')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'commit': current_commit(),
+                    'settings': _describe_settings(),
+                    'results': results,
+                }, f, indent=2)
+            print(f'Wrote {len(results)} results to {options["output"]}')
@@ -1,8 +1,15 @@
 
 
+import asyncio
+
 from django.core.management.base import BaseCommand
 
+from demo.analytics import book_snapshot
+from demo.batching import fetch_in
+from demo.cache import author_cache, book_cache
 from demo.models import Author, Book
+from demo.rows import BookRecord
+from demo.search import search_books
 from demo.utils import compare_function_runtimes, maybe_populate
 
 
@@ -17,27 +24,66 @@ def get_books_by_title(titles):
            books.append(book)
    return books
 
+async def aget_books_by_title(titles):
+   # Independent lookups fanned out with asyncio.gather
+   books = await asyncio.gather(*[aget_book_by_title(title) for title in titles])
+   return [book for book in books if book]
+
 def get_books_by_title_bulk(titles):
    books = Book.objects.filter(title__in=titles)
    return books
 
+def get_books_by_title_batched(titles):
+   return list(fetch_in(Book.objects.all(), 'title', titles, strategy='any'))
+
 
 ##########################################
 def count_books_by_author_db(author_id):
     return Book.objects.filter(author_id=author_id).count()
 
+async def acount_books_by_author_db(author_id):
+    return await Book.objects.filter(author_id=author_id).acount()
+
 def count_books_by_author(author_id):
     author = Author.objects.get(id=author_id)
     return len(author.books.all())
 
+def count_books_by_author_snapshot(author_id):
+    # Counted in memory; refresh() only re-reads books changed since the last call
+    book_snapshot.refresh()
+    return int((book_snapshot.column('author_id') == author_id).sum())
+
+def count_books_by_author_cached(author_id):
+    author = author_cache.get(author_id)
+    return author.book_count if author else 0
+
 ##########################################
 def get_book_by_title(title):
    book = Book.objects.filter(title=title).first()
    return book
 
+async def aget_book_by_title(title):
+   return await Book.objects.filter(title=title).afirst()
+
 def get_book_by_title_without_index(title):
    book = Book.objects.filter(title_without_index=title).first()
    return book
+
+def get_book_by_title_cached(title):
+   return book_cache.get_by(title)
+
+def search_books_by_title_icontains(text, limit=50):
+   # UPPER(title) LIKE UPPER('%text%') cannot use an index, so every title is scanned
+   books = Book.objects.filter(title__icontains=text).order_by('title', 'id')
+   return list(books.values_list('title', flat=True)[:limit])
+
+def search_books_by_title_prefix(text, limit=50):
+   books = search_books(text, mode='prefix').order_by('-rank', 'id')
+   return list(books.values_list('title', flat=True)[:limit])
+
+def search_books_by_title_fuzzy(text, limit=50):
+   books = search_books(text, mode='fuzzy').order_by('-rank', 'id')
+   return list(books.values_list('title', flat=True)[:limit])
 ##########################################
 
 def get_books_with_author_names():
@@ -52,6 +98,14 @@ def get_books_with_author_names_select_related():
     books = Book.objects.select_related('author')
     return [(book.title, book.author.name) for book in books]
 
+def get_books_with_author_names_rows():
+    # Straight from the cursor into tuple-backed records: no model instances
+    return [(book.title, book.author_name) for book in Book.objects.rows(BookRecord, 'title', 'author__name')]
+
+async def aget_books_with_author_names_select_related():
+    books = Book.objects.select_related('author')
+    return [(book.title, book.author.name) async for book in books.aiterator()]
+
 class Command(BaseCommand):
     help = 'Runs a custom demo command'
 
@@ -75,6 +129,22 @@ class Command(BaseCommand):
         )
 
 
+        print('\n\nFetching large number of titles in array-parameter batches')
+        compare_function_runtimes(
+            get_books_by_title_batched,
+            get_books_by_title_bulk,
+            [f'Book {i}' for i in range(5000)]
+        )
+
+
+        print('\n\nFetching large number of titles with async fan-out')
+        compare_function_runtimes(
+            aget_books_by_title,
+            get_books_by_title,
+            [f'Book {i}' for i in range(5000)]
+        )
+
+
         print('\n\nFetching single book')
         compare_function_runtimes(
             get_book_by_title,
@@ -82,6 +152,28 @@ class Command(BaseCommand):
             'Book 5001'
         )
 
+        print('\n\nFetching single book from a warm cache')
+        get_book_by_title_cached('Book 5001')
+        compare_function_runtimes(
+            get_book_by_title_cached,
+            get_book_by_title,
+            'Book 5001'
+        )
+
+        print('\n\nSearching titles by word prefix')
+        compare_function_runtimes(
+            search_books_by_title_prefix,
+            search_books_by_title_icontains,
+            'Banana'
+        )
+
+        print('\n\nSearching titles with typos')
+        compare_function_runtimes(
+            search_books_by_title_fuzzy,
+            search_books_by_title_icontains,
+            'Banana'
+        )
+
         print('\n\nCounting books by author')
         compare_function_runtimes(
             count_books_by_author,
@@ -89,8 +181,36 @@ class Command(BaseCommand):
             2
         )
 
+        print('\n\nCounting books by author from a columnar snapshot')
+        book_snapshot.load()
+        compare_function_runtimes(
+            count_books_by_author_snapshot,
+            count_books_by_author_db,
+            2
+        )
+
+        print('\n\nCounting books by author from a warm cache')
+        count_books_by_author_cached(2)
+        compare_function_runtimes(
+            count_books_by_author_cached,
+            count_books_by_author_db,
+            2
+        )
+
         print('\n\nGetting books with author names')
         compare_function_runtimes(
             get_books_with_author_names,
             get_books_with_author_names_select_related
         )
+
+        print('\n\nGetting books with author names, sync vs. async')
+        compare_function_runtimes(
+            aget_books_with_author_names_select_related,
+            get_books_with_author_names_select_related
+        )
+
+        print('\n\nGetting books with author names as compact rows')
+        compare_function_runtimes(
+            get_books_with_author_names_rows,
+            get_books_with_author_names_select_related
+        )
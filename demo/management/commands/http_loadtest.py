@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from demo.benchmark import current_commit
+from demo.http_load import run_http_load
+
+
+class Command(BaseCommand):
+    help = 'Load tests running demo endpoints over HTTP, e.g. a WSGI and an ASGI server side by side'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+',
+                            help='Endpoints to compare, e.g. http://127.0.0.1:8000/demo/books/ '
+                                 'http://127.0.0.1:8001/demo/async/books/')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per level')
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        results = []
+        for concurrency in options['concurrency']:
+            for url in options['urls']:
+                result = run_http_load(url, concurrency, duration=options['duration'])
+                results.append(result)
+                print(f'{url:<55} c={concurrency:<4} {result.rps:>9.1f} req/s  '
+                      f'p50 {result.latency_ms(50):>8.2f} ms  p99 {result.latency_ms(99):>8.2f} ms  '
+                      f'{result.errors} errors')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'commit': current_commit(),
+                    'duration': options['duration'],
+                    'results': [result.to_dict() for result in results],
+                }, f, indent=2)
+            print(f'Wrote {len(results)} results to {options["output"]}')
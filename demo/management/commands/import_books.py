@@ -0,0 +1,36 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from demo.ingest import DEFAULT_BATCH_SIZE, INGEST_FORMATS, InvalidRow, ingest_books
+
+
+class Command(BaseCommand):
+    help = 'Upserts books (with author and genre names) from a CSV or NDJSON file in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument('--format', choices=INGEST_FORMATS,
+                            help='Defaults to the file extension (.csv or .ndjson)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Rows per transaction')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if input_format not in INGEST_FORMATS:
+            raise CommandError(f'Pass --format ({" or ".join(INGEST_FORMATS)}) for {path}')
+
+        f = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            result = ingest_books(f, input_format, batch_size=options['batch_size'])
+        except InvalidRow as e:
+            raise CommandError(f'{e} (earlier batches were committed)')
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        print(f'Imported {result.rows:,} books in {result.batches} batches in {result.elapsed_s:.2f} seconds '
+              f'({result.rows_per_s:,.0f} rows/s), creating {result.authors_created:,} authors '
+              f'and {result.genres_created} genres')
@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from demo.benchmark import current_commit, get_query_set
+from demo.query_load import DEFAULT_SAMPLE_INTERVAL, default_levels, run_query_load
+from demo.utils import maybe_populate
+
+
+class Command(BaseCommand):
+    help = ('Runs the demo query functions from a ramping number of worker processes and reports '
+            'throughput, latency percentiles and pg_stat_activity waits')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filter', default='',
+                            help='Only run cases whose name contains this string')
+        parser.add_argument('--size', type=int, default=1_000,
+                            help='Maximum number of ids/titles passed to the bulk functions')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=default_levels(),
+                            help='Worker processes per level (default: powers of two up to the CPU count)')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds per level')
+        parser.add_argument('--sample-interval', type=float, default=DEFAULT_SAMPLE_INTERVAL,
+                            help='Seconds between pg_stat_activity samples')
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        maybe_populate()
+        cases = [case for case in get_query_set(size=options['size']) if options['filter'] in case.name]
+        if not cases:
+            raise CommandError(f'No cases match {options["filter"]!r}')
+
+        results = []
+        for case in cases:
+            for concurrency in options['concurrency']:
+                result = run_query_load(case, concurrency, options['duration'], options['sample_interval'])
+                results.append(result)
+                waits = ', '.join(f'{label} {share:.0%}' for (label, share) in result.top_waits())
+                print(f'{case.name:<75} c={concurrency:<3} {result.calls_per_s:>9.1f} calls/s  '
+                      f'p50 {result.latency_ms(50):>9.2f} ms  p95 {result.latency_ms(95):>9.2f} ms  '
+                      f'p99 {result.latency_ms(99):>9.2f} ms  {result.errors} errors  '
+                      f'{result.mean_active:.1f} active ({waits or "no waits sampled"})')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'commit': current_commit(),
+                    'duration': options['duration'],
+                    'size': options['size'],
+                    'results': [result.to_dict() for result in results],
+                }, f, indent=2)
+            print(f'Wrote {len(results)} results to {options["output"]}')
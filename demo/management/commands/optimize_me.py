@@ -3,6 +3,9 @@ from datetime import datetime
 from django.core.management.base import BaseCommand
 from django.db.models import Count, F
 
+from demo.analytics import book_snapshot
+from demo.batching import fetch_in
+from demo.cache import book_cache
 from demo.models import Author, Book
 from demo.utils import compare_runtimes_and_results, maybe_populate
 
@@ -29,22 +32,37 @@ def get_formatted_author_intros_OPTIMIZED_PREFETCH(author_ids):
 
 def get_formatted_author_intros_OPTIMIZED_ANNOTATE(author_ids):
     intros = []
-    authors = Author.objects.filter(id__in=author_ids).annotate(book_count=Count("books")).order_by('id')
+    authors = Author.objects.filter(id__in=author_ids).annotate(num_books=Count("books")).order_by('id')
     for author in authors:
         intros.append(
-            f'{author.name} is known for writing {author.book_count} book(s).'
+            f'{author.name} is known for writing {author.num_books} book(s).'
         )
     return intros
 
 def get_formatted_author_intros_OPTIMIZED_ANNOTATE_AND_VALUES(author_ids):
     intros = []
-    author_datas = Author.objects.values('name').filter(id__in=author_ids).annotate(book_count=Count("books")).order_by('id')
+    author_datas = Author.objects.values('name').filter(id__in=author_ids).annotate(num_books=Count("books")).order_by('id')
     for author_data in author_datas:
         intros.append(
-            f'{author_data['name']} is known for writing {author_data["book_count"]} book(s).'
+            f'{author_data['name']} is known for writing {author_data["num_books"]} book(s).'
         )
     return intros
 
+def get_formatted_author_intros_OPTIMIZED_DENORMALIZED(author_ids):
+    # Author.book_count is maintained on write, so no join or GROUP BY is needed
+    author_datas = Author.objects.values('name', 'book_count').filter(id__in=author_ids).order_by('id')
+    return [
+        f'{author_data["name"]} is known for writing {author_data["book_count"]} book(s).'
+        for author_data in author_datas
+    ]
+
+async def aget_formatted_author_intros_OPTIMIZED_DENORMALIZED(author_ids):
+    author_datas = Author.objects.values('name', 'book_count').filter(id__in=author_ids).order_by('id')
+    return [
+        f'{author_data["name"]} is known for writing {author_data["book_count"]} book(s).'
+        async for author_data in author_datas.aiterator()
+    ]
+
 def get_highest_page_count_book_title():
     highest_page_count_seen = 0
     title_of_highest_page_count_seen = None 
@@ -61,6 +79,16 @@ def get_highest_page_count_book_title_OPTIMIZED():
     book = Book.objects.all().order_by('-page_count').first()
     return book.title
 
+def get_highest_page_count_book_title_SNAPSHOT():
+    # The longest book is found in the in-memory snapshot; only its title is queried
+    book_snapshot.refresh()
+    (ids, _) = book_snapshot.top_k('page_count', k=1)
+    return Book.objects.values_list('title', flat=True).get(id=ids[0])
+
+async def aget_highest_page_count_book_title_OPTIMIZED():
+    book = await Book.objects.all().order_by('-page_count').afirst()
+    return book.title
+
 def get_book_intros(book_ids):
     intros = []
     for book_id in  book_ids:
@@ -93,6 +121,29 @@ def get_book_intros_OPTIMIZED_SELECT_RELATED(book_ids):
     ]
     return intros
 
+def get_book_intros_OPTIMIZED_BATCHED(book_ids):
+    # One array parameter per chunk instead of a 50,000-placeholder IN list
+    books = fetch_in(Book.objects.select_related('author'), 'id', book_ids, strategy='any')
+    return [
+        f'{book.title} is by {book.author.name} and has {book.page_count} pages'
+        for book in books
+    ]
+
+async def aget_book_intros_OPTIMIZED_SELECT_RELATED(book_ids):
+    books = Book.objects.filter(id__in=book_ids).select_related('author')
+    return [
+        f'{book.title} is by {book.author.name} and has {book.page_count} pages'
+        async for book in books.aiterator()
+    ]
+
+def get_book_intros_OPTIMIZED_CACHED(book_ids):
+    # Books are cached with their author (select_related), so a warm cache needs no queries
+    books = book_cache.get_many(book_ids)
+    return [
+        f'{book.title} is by {book.author.name} and has {book.page_count} pages'
+        for book in books.values()
+    ]
+
 class Command(BaseCommand):
     help = 'Runs a custom demo command'
 
@@ -103,7 +154,8 @@ class Command(BaseCommand):
         for optimized_func in [
             get_formatted_author_intros_OPTIMIZED_PREFETCH,
             get_formatted_author_intros_OPTIMIZED_ANNOTATE,
-            get_formatted_author_intros_OPTIMIZED_ANNOTATE_AND_VALUES
+            get_formatted_author_intros_OPTIMIZED_ANNOTATE_AND_VALUES,
+            get_formatted_author_intros_OPTIMIZED_DENORMALIZED
         ]:
             compare_runtimes_and_results(
                 get_formatted_author_intros,
@@ -116,10 +168,30 @@ class Command(BaseCommand):
             get_highest_page_count_book_title_OPTIMIZED,
         )
 
+        book_snapshot.load()
+        compare_runtimes_and_results(
+            get_highest_page_count_book_title_OPTIMIZED,
+            get_highest_page_count_book_title_SNAPSHOT,
+        )
+
         book_ids = list(range(3, 51_000))
-        for optimized_func in [get_book_intros_OPTIMIZED_ANNOTATE, get_book_intros_OPTIMIZED_PREFETCH_RELATED, get_book_intros_OPTIMIZED_SELECT_RELATED]:
+        for optimized_func in [get_book_intros_OPTIMIZED_ANNOTATE, get_book_intros_OPTIMIZED_PREFETCH_RELATED, get_book_intros_OPTIMIZED_SELECT_RELATED, get_book_intros_OPTIMIZED_BATCHED]:
             compare_runtimes_and_results(
                 get_book_intros,
                 optimized_func,
                 book_ids
-            )
\ No newline at end of file
+            )
+
+        compare_runtimes_and_results(
+            get_book_intros_OPTIMIZED_SELECT_RELATED,
+            aget_book_intros_OPTIMIZED_SELECT_RELATED,
+            book_ids
+        )
+
+        # Warm the cache, then compare against the fastest uncached variant
+        get_book_intros_OPTIMIZED_CACHED(book_ids)
+        compare_runtimes_and_results(
+            get_book_intros_OPTIMIZED_SELECT_RELATED,
+            get_book_intros_OPTIMIZED_CACHED,
+            book_ids
+        )
\ No newline at end of file
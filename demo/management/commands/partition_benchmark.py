@@ -0,0 +1,108 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from demo.benchmark import (
+    BenchmarkCase, DEFAULT_TRIALS, DEFAULT_WARMUP, command_module, export_json, positive_int, run_benchmark
+)
+from demo.index_advisor import walk_plan
+from demo.models import Author, Book
+from demo.partitioning import (
+    BENCHMARK_SCHEMES, DEFAULT_HASH_PARTITIONS, book_partitioning, book_partitions, partition_book_table,
+    unpartition_book_table
+)
+from demo.utils import maybe_populate
+
+
+def count_books_published_in(year):
+    return Book.objects.filter(publication_date__year=year).count()
+
+
+def get_books_published_since(since, limit=50):
+    return list(Book.objects.filter(publication_date__gte=since).order_by('-publication_date', 'id')
+                .values_list('title', flat=True)[:limit])
+
+
+def get_cases():
+    demo = command_module('demo')
+    optimize_me = command_module('optimize_me')
+    challenge = command_module('challenge_2025-01-30')
+    author_ids = list(Author.objects.filter(book_count__gt=0).order_by('id').values_list('id', flat=True)[:20])
+    latest = Book.objects.filter(publication_date__isnull=False).order_by('-publication_date').first()
+    year = latest.publication_date.year if latest else 2024
+    return [
+        BenchmarkCase('demo.count_books_by_author_db', demo.count_books_by_author_db, (author_ids[0],)),
+        BenchmarkCase(f'optimize_me.get_formatted_author_intros_OPTIMIZED_PREFETCH[{len(author_ids)}]',
+                      optimize_me.get_formatted_author_intros_OPTIMIZED_PREFETCH, (author_ids,)),
+        BenchmarkCase(f'count_books_published_in({year})', count_books_published_in, (year,)),
+        BenchmarkCase(f'get_books_published_since({year}-01-01)', get_books_published_since, (f'{year}-01-01',)),
+        # DISTINCT ON (author_id) over every book: nothing to prune
+        BenchmarkCase('challenge.get_list_of_titles_excluding_latest_books_by_author',
+                      challenge.get_list_of_titles_excluding_latest_books_by_author),
+    ]
+
+
+def scanned_tables(result):
+    """ (tables scanned, partitions pruned at run time) over a result's plans. """
+    tables = set()
+    removed = 0
+    for explain in result.explains:
+        for node in walk_plan(explain['plan'][0]['Plan']):
+            relation = node.get('Relation Name', '')
+            if relation == Book._meta.db_table or relation.startswith(f'{Book._meta.db_table}_'):
+                tables.add(relation)
+            removed += node.get('Subplans Removed', 0)
+    return (tables, removed)
+
+
+class Command(BaseCommand):
+    help = ('Runs the author and publication date queries against the book table unpartitioned and '
+            'under each partitioning scheme, reporting timings and how many partitions each query scans. '
+            'Each scheme is built in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scheme', nargs='+', choices=['none'] + BENCHMARK_SCHEMES,
+                            default=['none'] + BENCHMARK_SCHEMES)
+        parser.add_argument('--partitions', type=int, default=DEFAULT_HASH_PARTITIONS,
+                            help='Number of author_hash partitions')
+        parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+        parser.add_argument('--trials', type=positive_int, default=DEFAULT_TRIALS)
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL')
+        maybe_populate()
+        cases = get_cases()
+        with connection.cursor() as cursor:
+            current = book_partitioning(cursor)
+
+        results = []
+        pruning = {}
+        for scheme_name in options['scheme']:
+            scheme = None if scheme_name == 'none' else scheme_name
+            with transaction.atomic():
+                with connection.schema_editor(atomic=False) as schema_editor:
+                    if current is not None:
+                        unpartition_book_table(schema_editor)
+                    if scheme is not None:
+                        partition_book_table(schema_editor, scheme, options['partitions'], rolled_back=True)
+                with connection.cursor() as cursor:
+                    cursor.execute(f'ANALYZE {Book._meta.db_table}')
+                    partitions = len(book_partitions(cursor))
+
+                print(f'{scheme_name} ({partitions or "no"} partitions)')
+                for case in cases:
+                    result = run_benchmark(case.func, case.args, warmup=options['warmup'],
+                                           trials=options['trials'], explain=True,
+                                           name=f'{scheme_name}:{case.name}')
+                    (tables, removed) = scanned_tables(result)
+                    scanned = len(tables) - removed if partitions else len(tables)
+                    pruning[result.name] = {'partitions': partitions, 'scanned': scanned}
+                    results.append(result)
+                    print(f'  {case.name:<65} median {result.median_ms:>9.2f} ms  '
+                          + (f'scans {scanned:>2} of {partitions} partitions' if partitions else ''))
+                transaction.set_rollback(True)
+
+        if options['output']:
+            export_json(results, options['output'], partitioning=pruning)
+            print(f'Wrote {len(results)} results to {options["output"]}')
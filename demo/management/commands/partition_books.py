@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from demo.models import Book
+from demo.partitioning import (
+    DEFAULT_HASH_PARTITIONS, PARTITION_SCHEMES, book_partitioning, book_partitions, partition_book_table,
+    unpartition_book_table
+)
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the book table as a partitioned table, or back into a single table with "none"'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scheme', choices=PARTITION_SCHEMES + ['none'])
+        parser.add_argument('--partitions', type=int, default=DEFAULT_HASH_PARTITIONS,
+                            help='Number of author_hash partitions')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL')
+        scheme = None if options['scheme'] == 'none' else options['scheme']
+        with connection.cursor() as cursor:
+            current = book_partitioning(cursor)
+
+        if current is None and scheme is None:
+            print(f'{Book._meta.db_table} is not partitioned')
+            return
+        # Repartitioning by the current scheme changes the number of hash partitions.
+        # One transaction: readers and writers wait on the table lock until it commits
+        with connection.schema_editor() as schema_editor:
+            if current is not None:
+                unpartition_book_table(schema_editor)
+            if scheme is not None:
+                partition_book_table(schema_editor, scheme, options['partitions'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Book._meta.db_table}')
+            partitions = book_partitions(cursor)
+            cursor.execute(f'SELECT tableoid::regclass::text, count(*) FROM {Book._meta.db_table} GROUP BY 1')
+            counts = dict(cursor.fetchall())
+
+        if scheme is None:
+            print(f'Rebuilt {Book._meta.db_table} as a single table')
+            return
+        print(f'Partitioned {Book._meta.db_table} by {scheme} into {len(partitions)} partitions:')
+        for (name, bound) in partitions:
+            print(f'  {name:<24} {counts.get(name, 0):>10,} books  {bound}')
@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from demo.benchmark import DEFAULT_TRIALS, DEFAULT_WARMUP, command_module, export_json, positive_int, run_benchmark
+from demo.models import Author, Book
+from demo.prepared import prepared_statements
+from demo.utils import maybe_populate
+
+
+def get_cases(calls):
+    """ (name, function, args) for functions running one statement shape many times. """
+    demo = command_module('demo')
+    optimize_me = command_module('optimize_me')
+    titles = list(Book.objects.order_by('id').values_list('title', flat=True)[:calls])
+    author_ids = list(Author.objects.order_by('id').values_list('id', flat=True)[:calls])
+    book_ids = list(Book.objects.order_by('id').values_list('id', flat=True)[:calls // 2])
+    return [
+        (f'demo.get_book_by_title x{len(titles)}',
+         lambda titles: [demo.get_book_by_title(title) for title in titles], (titles,)),
+        (f'demo.count_books_by_author_db x{len(author_ids)}',
+         lambda author_ids: [demo.count_books_by_author_db(author_id) for author_id in author_ids], (author_ids,)),
+        (f'optimize_me.get_book_intros[{len(book_ids)}]', optimize_me.get_book_intros, (book_ids,)),
+    ]
+
+
+def planning_ms(result):
+    """ Planning time of the first statement EXPLAIN ANALYZE captured. """
+    return result.explains[0]['plan'][0]['Planning Time'] if result.explains else None
+
+
+class Command(BaseCommand):
+    help = ('Compares single-row lookups run as ordinary statements and as server-side prepared statements '
+            '(demo.prepared), reporting the latency per query')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=1_000, help='Lookups per trial')
+        parser.add_argument('--threshold', type=int, default=1,
+                            help='Executions before a statement is prepared')
+        parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+        parser.add_argument('--trials', type=positive_int, default=DEFAULT_TRIALS)
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Prepared statements need PostgreSQL')
+        if settings.DB_PREPARE_THRESHOLD is not None:
+            raise CommandError('Unset DB_PREPARE_THRESHOLD so the plain runs are not prepared too')
+        maybe_populate()
+
+        results = []
+        for (name, func, args) in get_cases(options['calls']):
+            plain = run_benchmark(func, args, warmup=options['warmup'], trials=options['trials'],
+                                  explain=True, name=name)
+            # The warmup run prepares the statements
+            with prepared_statements(threshold=options['threshold']):
+                prepared = run_benchmark(func, args, warmup=options['warmup'], trials=options['trials'],
+                                         name=f'{name} (prepared)')
+            results += [plain, prepared]
+
+            queries = plain.queries or 1
+            plain_us = plain.median_ms * 1000 / queries
+            prepared_us = prepared.median_ms * 1000 / queries
+            print(f'{name:<45} {queries:>6} queries  plain {plain_us:>7.1f} us/query  '
+                  f'prepared {prepared_us:>7.1f} us/query  saved {plain_us - prepared_us:>6.1f} us '
+                  f'({1 - prepared_us / plain_us:.0%})  EXPLAIN planning time {planning_ms(plain) or 0:.3f} ms')
+
+        if options['output']:
+            export_json(results, options['output'], threshold=options['threshold'])
+            print(f'Wrote {len(results)} results to {options["output"]}')
@@ -0,0 +1,14 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from demo.models import LatestBook
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the LatestBook summary table of each author's latest book"
+
+    def handle(self, *args, **kwargs):
+        start = perf_counter()
+        LatestBook.rebuild()
+        print(f'Rebuilt {LatestBook.objects.count():,} rows in {perf_counter() - start:.2f} seconds')
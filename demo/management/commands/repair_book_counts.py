@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from demo.models import Author
+
+
+class Command(BaseCommand):
+    help = 'Backfills or repairs the denormalized Author.book_count column'
+
+    def handle(self, *args, **kwargs):
+        repaired = Author.refresh_book_counts()
+        print(f'Repaired book_count for {repaired:,} author(s)')
@@ -0,0 +1,30 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from demo.models import Book
+from demo.routers import lag_monitor
+
+
+class Command(BaseCommand):
+    help = 'Prints the lag of each replica in DB_REPLICAS and where Book reads are routed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reads', type=int, default=1_000, help='Reads to route')
+
+    def handle(self, *args, **options):
+        if not settings.DB_REPLICAS:
+            raise CommandError('No replicas configured; set DB_REPLICAS (see mysite/settings.py)')
+
+        for alias in settings.DB_REPLICAS:
+            settings_dict = connections[alias].settings_dict
+            lag = lag_monitor.measure(alias)
+            print(f'{alias:<12} {settings_dict["HOST"] or "(libpq default host)"}'
+                  f'{":" + settings_dict["PORT"] if settings_dict["PORT"] else ""}/{settings_dict["NAME"]:<20} '
+                  f'lag {lag:.3f} s{"  (too far behind, reads go to the primary)" if lag > settings.DB_REPLICA_MAX_LAG else ""}')
+
+        routed = Counter(router.db_for_read(Book) for _ in range(options['reads']))
+        print(f'{options["reads"]:,} Book reads routed to: '
+              + ', '.join(f'{alias} {count:,}' for (alias, count) in routed.most_common()))
@@ -0,0 +1,35 @@
+from time import monotonic, sleep
+
+from django.core.management.base import BaseCommand, CommandError
+
+from demo.jobs import REPORTS, get_job, request_report
+from demo.models import ReportJob
+
+ACTIVE_STATUSES = (ReportJob.Status.PENDING, ReportJob.Status.RUNNING)
+
+
+class Command(BaseCommand):
+    help = 'Requests a background report and prints its status, waiting for the run_jobs workers if asked'
+
+    def add_arguments(self, parser):
+        parser.add_argument('report', choices=list(REPORTS))
+        parser.add_argument('--wait', type=float, default=0, help='Seconds to wait for the result')
+
+    def handle(self, *args, **options):
+        start = monotonic()
+        job = request_report(options['report'])
+        while job.status in ACTIVE_STATUSES and monotonic() - start < options['wait']:
+            sleep(0.5)
+            job = get_job(job.id)
+            if job is None:
+                raise CommandError('The job was deleted while waiting')
+
+        print(f'Job {job.id} ({job.report}): {job.status} after {monotonic() - start:.2f} seconds')
+        if job.status == ReportJob.Status.DONE:
+            print(f'{len(job.result):,} rows, kept until {job.expires_at:%Y-%m-%d %H:%M:%S %Z}')
+            for row in job.result[:5]:
+                print(f'  {row}')
+        elif job.status == ReportJob.Status.FAILED:
+            raise CommandError(job.error)
+        else:
+            print('Start a worker with `python manage.py run_jobs` if none is running')
@@ -0,0 +1,65 @@
+import gc
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from demo.benchmark import DEFAULT_TRIALS, DEFAULT_WARMUP, export_json, positive_int, run_benchmark
+from demo.models import Book
+from demo.rows import BookRecord, BookRow
+from demo.utils import maybe_populate
+
+FIELDS = ('title', 'author__name')
+LOADERS = {
+    'instances': lambda queryset: list(queryset.select_related('author')),
+    'values': lambda queryset: list(queryset.values(*FIELDS)),
+    'values_list': lambda queryset: list(queryset.values_list(*FIELDS)),
+    'values_list(named=True)': lambda queryset: list(queryset.values_list(*FIELDS, named=True)),
+    'rows(BookRow)': lambda queryset: list(queryset.rows(BookRow, *FIELDS)),
+    'rows(BookRecord)': lambda queryset: list(queryset.rows(BookRecord, *FIELDS)),
+}
+
+
+def measure_memory(load, queryset):
+    """ Returns (retained, peak) bytes allocated while loading the rows. """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        rows = load(queryset)
+        (retained, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del rows
+    return (retained, peak)
+
+
+class Command(BaseCommand):
+    help = 'Compares time and memory of loading books as model instances, values() and compact rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100_000, help='Number of books to load')
+        parser.add_argument('--loader', nargs='+', choices=list(LOADERS), default=list(LOADERS))
+        parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+        parser.add_argument('--trials', type=positive_int, default=DEFAULT_TRIALS)
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        maybe_populate()
+        queryset = Book.objects.order_by('id')[:options['limit']]
+
+        results = []
+        memory = {}
+        for name in options['loader']:
+            load = LOADERS[name]
+            (retained, peak) = measure_memory(load, queryset)
+            result = run_benchmark(load, (queryset,), warmup=options['warmup'], trials=options['trials'], name=name)
+            rows = len(result.result)
+            memory[name] = {'rows': rows, 'retained_bytes': retained, 'peak_bytes': peak}
+            results.append(result)
+            print(f'{name:<25} median {result.median_ms:>9.2f} ms  '
+                  f'retained {retained / 1_048_576:>7.1f} MiB ({retained / max(rows, 1):>5.0f} B/row)  '
+                  f'peak {peak / 1_048_576:>7.1f} MiB')
+
+        if options['output']:
+            export_json(results, options['output'], limit=options['limit'], trials=options['trials'],
+                        memory=memory)
+            print(f'Wrote {len(results)} results to {options["output"]}')
@@ -0,0 +1,47 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from demo.jobs import POLL_INTERVAL, default_worker_name, work
+
+
+def _work(burst, poll_interval):
+    try:
+        work(default_worker_name(), burst=burst, poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Runs report jobs queued through demo.jobs.request_report (e.g. POST /demo/reports/<name>/)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to fork')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                            help='Seconds an idle worker waits before looking for jobs again')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            _work(options['burst'], options['poll_interval'])
+            return
+
+        # Forked after the parent's connections are closed, so each worker opens its own
+        context = multiprocessing.get_context('fork')
+        connections.close_all()
+        processes = [
+            context.Process(target=_work, args=(options['burst'], options['poll_interval']))
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # The workers got the same SIGINT and stop after their current job
+            for process in processes:
+                process.join()
@@ -0,0 +1,25 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from demo.seeding import DEFAULT_BATCH_SIZE, DEFAULT_ROWS, seed
+
+
+class Command(BaseCommand):
+    help = 'Clears and re-seeds the demo tables with generated authors and books'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=DEFAULT_ROWS,
+                            help='Number of generated authors (each with one book)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Use bulk_create even on PostgreSQL')
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        seed(
+            rows=options['rows'],
+            batch_size=options['batch_size'],
+            use_copy=False if options['no_copy'] else None
+        )
+        print(f'Seeded {options["rows"]:,} rows in {perf_counter() - start:.2f} seconds')
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demo', '0002_genre_book_genres'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', '-publication_date'], name='book_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-page_count'], name='book_page_count_desc_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:58
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_book_counts(apps, schema_editor):
+    Author = apps.get_model('demo', 'Author')
+    Book = apps.get_model('demo', 'Book')
+    Author.objects.update(book_count=Coalesce(Subquery(
+        Book.objects.filter(author=OuterRef('pk'))
+            .order_by()
+            .values('author')
+            .annotate(count=Count('id'))
+            .values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demo', '0003_book_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='book_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_book_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_latest_books(apps, schema_editor):
+    Author = apps.get_model('demo', 'Author')
+    Book = apps.get_model('demo', 'Book')
+    LatestBook = apps.get_model('demo', 'LatestBook')
+    latest_book_id = Subquery(
+        Book.objects.filter(author=OuterRef('pk'))
+            .order_by('-publication_date', '-id')
+            .values('id')[:1]
+    )
+    rows = (Author.objects
+            .annotate(latest_book_id=latest_book_id)
+            .filter(latest_book_id__isnull=False)
+            .values_list('id', 'latest_book_id'))
+    LatestBook.objects.bulk_create(
+        [LatestBook(author_id=author_id, book_id=book_id) for (author_id, book_id) in rows],
+        batch_size=5_000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demo', '0005_book_title_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestBook',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_book', serialize=False, to='demo.author')),
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='latest_for', to='demo.book')),
+            ],
+        ),
+        migrations.RunPython(populate_latest_books, migrations.RunPython.noop),
+    ]
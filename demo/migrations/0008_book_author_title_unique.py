@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demo', '0007_book_search'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(fields=('author', 'title'), name='book_author_title_uniq'),
+        ),
+    ]
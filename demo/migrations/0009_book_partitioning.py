@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.db import migrations
+
+from demo.partitioning import book_partitioning, partition_book_table, unpartition_book_table
+
+
+def partition_books(apps, schema_editor):
+    """ Partitions demo_book by settings.DB_BOOK_PARTITIONING, if set. Use
+    `python manage.py partition_books` to change the scheme afterwards.
+    """
+    if settings.DB_BOOK_PARTITIONING and schema_editor.connection.vendor == 'postgresql':
+        partition_book_table(schema_editor, settings.DB_BOOK_PARTITIONING, settings.DB_BOOK_PARTITIONS,
+                             model=apps.get_model('demo', 'Book'))
+
+
+def unpartition_books(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Book = apps.get_model('demo', 'Book')
+    with schema_editor.connection.cursor() as cursor:
+        partitioned = book_partitioning(cursor, Book) is not None
+    if partitioned:
+        unpartition_book_table(schema_editor, model=Book)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demo', '0008_book_author_title_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_books, unpartition_books),
+    ]
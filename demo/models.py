@@ -1,14 +1,52 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Now
+
+from demo.page_cache import ALL, bump_versions, version_key
+from demo.rows import RowQuerySet
 
 
 class Author(models.Model):
     name = models.CharField(max_length=255)
     bio = models.TextField(null=True, blank=True)
     birth_date = models.DateField(null=True, blank=True)
+    # Denormalized count of this author's books, kept up to date by the signal
+    # handlers in demo/signals.py. Run `python manage.py repair_book_counts`
+    # after writes that bypass signals (bulk_create, COPY, queryset.update).
+    book_count = models.PositiveIntegerField(default=0)
+    # The Last-Modified and ETag of the catalogue pages in demo/views.py. The
+    # database default covers COPY and raw inserts.
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+
+    objects = RowQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def refresh_book_counts(cls, author_ids=None):
+        """ Recomputes book_count for every author (or only `author_ids`) whose
+        stored value has drifted. Returns the number of authors repaired.
+        """
+        actual_book_count = Coalesce(Subquery(
+            Book.objects.filter(author=OuterRef('pk'))
+                .order_by()
+                .values('author')
+                .annotate(count=Count('id'))
+                .values('count')
+        ), 0)
+        authors = cls.objects.all() if author_ids is None else cls.objects.filter(id__in=author_ids)
+        repaired = (authors
+                    .annotate(actual_book_count=actual_book_count)
+                    .exclude(book_count=F('actual_book_count'))
+                    .update(book_count=actual_book_count, updated_at=Now()))
+        if repaired:
+            bump_versions([version_key(ALL)] if author_ids is None
+                          else [version_key('author', author_id) for author_id in author_ids])
+        return repaired
+
 class Genre(models.Model):
     name = models.CharField(max_length=255)
 
@@ -23,8 +61,162 @@ class Book(models.Model):
     publication_date = models.DateField(null=True, blank=True)
     author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='books')
     genres = models.ManyToManyField(Genre)
+    # Maintained by PostgreSQL on every write, including COPY and bulk_create
+    search_vector = models.GeneratedField(
+        expression=SearchVector('title', config='english'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+
+    objects = RowQuerySet.as_manager()
+
+    class Meta:
+        # Proposed by `python manage.py advise_indexes`
+        indexes = [
+            # DISTINCT ON (author_id) ... ORDER BY author_id, publication_date DESC
+            models.Index(fields=['author', '-publication_date'], name='book_author_pub_date_idx'),
+            # ORDER BY page_count DESC LIMIT 1
+            models.Index(fields=['-page_count'], name='book_page_count_desc_idx'),
+            # Keyset pagination of /demo/books/ on (title, id)
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            # Full-text and prefix search (demo.search)
+            GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+            # Fuzzy title search with pg_trgm
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='book_title_trgm_idx'),
+        ]
+        constraints = [
+            # The natural key demo.ingest upserts on
+            models.UniqueConstraint(fields=['author', 'title'], name='book_author_title_uniq'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded author, title and publication date so a
+        # reassignment, retitling or new date can be detected on save.
+        instance._loaded_author_id = instance.__dict__.get('author_id')
+        instance._loaded_title = instance.__dict__.get('title')
+        instance._loaded_publication_date = instance.__dict__.get('publication_date')
+        return instance
 
     def __str__(self):
         return self.title
 
 
+
+
+class LatestBook(models.Model):
+    """ Each author's latest book (by publication_date, matching the
+    DISTINCT ON query in challenge_2025-01-30), maintained incrementally by
+    the signal handlers in demo/signals.py.
+    """
+    author = models.OneToOneField(Author, on_delete=models.CASCADE, primary_key=True, related_name='latest_book')
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, related_name='latest_for')
+
+    @staticmethod
+    def latest_book_ids():
+        """ Subquery of the latest book id for OuterRef('pk') author. """
+        return Subquery(
+            Book.objects.filter(author=OuterRef('pk'))
+                .order_by('-publication_date', '-id')
+                .values('id')[:1]
+        )
+
+    @classmethod
+    def refresh_authors(cls, author_ids):
+        """ Recomputes the latest book of the given authors. """
+        author_ids = set(author_ids) - {None}
+        if not author_ids:
+            return
+        latest = dict(
+            Author.objects.filter(id__in=author_ids)
+                .annotate(latest_book_id=cls.latest_book_ids())
+                .values_list('id', 'latest_book_id')
+        )
+        # Delete before inserting: a reassigned book may still be held by its previous author's row.
+        cls.objects.filter(author_id__in=author_ids).delete()
+        cls.objects.bulk_create(
+            [cls(author_id=author_id, book_id=book_id) for (author_id, book_id) in latest.items() if book_id]
+        )
+
+    @classmethod
+    def rebuild(cls, batch_size=5_000):
+        """ Recomputes the whole table, e.g. after bulk loads that bypass signals. """
+        if connection.vendor == 'postgresql':
+            # One INSERT ... SELECT DISTINCT ON pass instead of a subquery per author
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {cls._meta.db_table}')
+                cursor.execute(f'''
+                    INSERT INTO {cls._meta.db_table} (author_id, book_id)
+                    SELECT DISTINCT ON (author_id) author_id, id
+                    FROM {Book._meta.db_table}
+                    ORDER BY author_id, publication_date DESC, id DESC
+                ''')
+            return
+
+        rows = (Author.objects
+                .annotate(latest_book_id=cls.latest_book_ids())
+                .filter(latest_book_id__isnull=False)
+                .values_list('id', 'latest_book_id'))
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                [cls(author_id=author_id, book_id=book_id) for (author_id, book_id) in rows],
+                batch_size=batch_size
+            )
+
+
+class ReportJob(models.Model):
+    """ A report computed in the background by `python manage.py run_jobs`
+    (see demo/jobs.py). The result is kept on the row until expires_at, and
+    requests for the same report and params share one job.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    report = models.CharField(max_length=64)
+    params = models.JSONField(default=dict)
+    # Hash of report and params: jobs with the same key compute the same result
+    key = models.CharField(max_length=32)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    # Incremented on every claim; a worker only stores its result if the job
+    # was not requeued (and claimed again) while it ran
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Coalesces duplicate requests: one queued or running job per key
+            models.UniqueConstraint(
+                fields=['key'], condition=Q(status__in=['pending', 'running']), name='reportjob_active_key_uniq'
+            ),
+        ]
+        indexes = [
+            # The queue, oldest first
+            models.Index(fields=['created_at'], condition=Q(status='pending'), name='reportjob_pending_idx'),
+            # The latest result of each key
+            models.Index(fields=['key', '-finished_at'], condition=Q(status='done'), name='reportjob_done_key_idx'),
+        ]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'report': self.report,
+            'params': self.params,
+            'status': self.status,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'expires_at': self.expires_at,
+            'error': self.error or None,
+            'result': self.result,
+        }
@@ -0,0 +1,226 @@
+import hashlib
+from time import time_ns
+
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import http_date, parse_http_date_safe
+
+from demo.routers import read_from_primary
+
+CACHE_ALIAS = 'default'
+DEFAULT_TIMEOUT = 24 * 60 * 60
+VERSION_PREFIX = 'demo:version:'
+FRAGMENT_PREFIX = 'demo:fragment:'
+PAGE_PREFIX = 'demo:page:'
+
+# Version keys of collections rather than single objects
+BOOKS = 'books'      # which books exist and their titles (list membership and order)
+AUTHORS = 'authors'  # which authors exist
+GENRES = 'genres'    # genre names, shown with every book
+# Bumped after writes that bypass the signals; every page and fragment depends on it
+ALL = 'all'
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+##########################################
+# VERSIONS
+##########################################
+def version_key(*parts):
+    """ version_key('book', 7) -> 'demo:version:book:7' """
+    return VERSION_PREFIX + ':'.join(str(part) for part in parts)
+
+
+def book_keys(book_id, author_id):
+    """ What a rendered book shows: the book, its author's name and its genres' names. """
+    return [version_key('book', book_id), version_key('author', author_id), version_key(GENRES), version_key(ALL)]
+
+
+def author_keys(author_id):
+    return [version_key('author', author_id), version_key(ALL)]
+
+
+def get_versions(keys):
+    """ {key: version} for version keys. A key that was never bumped or has
+    been evicted gets the clock in nanoseconds, which is newer than any
+    version handed out before, so nothing cached under an older one is served.
+    """
+    cache = _cache()
+    keys = list(keys)
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            # Another process may have set it first; its version wins
+            cache.add(key, time_ns(), None)
+        versions.update(cache.get_many(missing))
+        for key in missing:
+            versions.setdefault(key, time_ns())
+    return versions
+
+
+def bump_versions(keys):
+    """ Gives `keys` new versions once the current transaction commits, so
+    pages and fragments rendered from the old data are re-rendered. Bumping
+    after the commit means a version is never newer than the data readers see.
+    """
+    keys = set(keys)
+    if keys:
+        transaction.on_commit(lambda: _cache().set_many({key: time_ns() for key in keys}, None))
+
+
+def skip_page_cache(request):
+    """ Keeps the page being rendered for `request` out of the page cache,
+    e.g. because the data changed while it was rendered.
+    """
+    request.page_cacheable = False
+
+
+def depend_on(request, keys):
+    """ The current versions of `keys`, recorded as dependencies of the page
+    being rendered for `request`. Read the versions before the data they cover.
+    """
+    versions = get_versions(keys)
+    dependencies = getattr(request, 'page_dependencies', None)
+    if dependencies is not None:
+        dependencies.update(versions)
+    return versions
+
+
+##########################################
+# FRAGMENTS
+##########################################
+def render_fragments(request, template_name, dependencies, load):
+    """ Renders `template_name` once per object, reusing the fragments cached
+    under the current versions of each object's version keys.
+
+    `dependencies` maps each object's pk to its version keys, e.g. book_keys(),
+    and `load(pks)` returns {pk: context} for the objects whose fragments are
+    missing, with the time the data shown was last changed as 'updated_at'.
+    A context may also give the version keys of the data actually loaded as
+    'version_keys'; if they differ (say a book changed author since its
+    dependencies were read), neither the fragment nor the page is cached.
+    Returns {pk: (html, updated_at)}; deleted objects are left out.
+    """
+    versions = depend_on(request, {key for keys in dependencies.values() for key in keys})
+    fragment_keys = {
+        pk: f'{FRAGMENT_PREFIX}{template_name}:{pk}:' + '.'.join(str(versions[key]) for key in keys)
+        for (pk, keys) in dependencies.items()
+    }
+    cache = _cache()
+    cached = cache.get_many(fragment_keys.values())
+    fragments = {pk: cached[key] for (pk, key) in fragment_keys.items() if key in cached}
+
+    missing = [pk for pk in dependencies if pk not in fragments]
+    if missing:
+        rendered = {}
+        for (pk, context) in load(missing).items():
+            rendered[pk] = (render_to_string(template_name, context), context['updated_at'])
+            if context.get('version_keys', dependencies[pk]) != dependencies[pk]:
+                skip_page_cache(request)
+                fragment_keys.pop(pk)
+        cache.set_many({fragment_keys[pk]: fragment for (pk, fragment) in rendered.items() if pk in fragment_keys},
+                       DEFAULT_TIMEOUT)
+        fragments.update(rendered)
+    return fragments
+
+
+##########################################
+# PAGES
+##########################################
+def set_validators(response, updated_ats, ids):
+    """ Sets Last-Modified to the newest of `updated_ats` (the data shown on
+    the page) and an ETag over it and the `ids` shown, which also changes when
+    a row drops off the page without anything on it being modified.
+    """
+    if not updated_ats:
+        return response
+    last_modified = max(updated_ats)
+    digest = hashlib.md5(f'{last_modified.isoformat()}:{",".join(map(str, ids))}'.encode()).hexdigest()
+    response['ETag'] = f'"{digest}"'
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def _add_versions(response, versions):
+    """ Folds the versions a page was rendered from into its validators, so
+    that changes to data outside the rows it shows (say a genre rename) also
+    change its ETag and Last-Modified. Versions are bumped after the commit,
+    which only ever makes Last-Modified later than the change.
+    """
+    if not versions or not response.has_header('ETag'):
+        return response
+    stamp = ','.join(f'{key}={versions[key]}' for key in sorted(versions))
+    response['ETag'] = '"%s"' % hashlib.md5(f'{response["ETag"]}:{stamp}'.encode()).hexdigest()
+    last_modified = parse_http_date_safe(response.get('Last-Modified', '')) or 0
+    response['Last-Modified'] = http_date(max(last_modified, max(versions.values()) // 10 ** 9))
+    return response
+
+
+def cache_versioned(view):
+    """ Lets VersionedPageCacheMiddleware cache the view's GET responses. The
+    view must declare everything its output depends on through depend_on() or
+    render_fragments().
+    """
+    view.versioned_page_cache = True
+    return view
+
+
+def _conditional(request, response):
+    last_modified = parse_http_date_safe(response['Last-Modified']) if response.has_header('Last-Modified') else None
+    return get_conditional_response(request, etag=response.get('ETag'), last_modified=last_modified,
+                                    response=response)
+
+
+class VersionedPageCacheMiddleware(MiddlewareMixin):
+    """ Caches whole responses of @cache_versioned views per URL together with
+    the versions they were rendered from. A request is served from the cache,
+    without touching the database, while all of those versions are unchanged,
+    so a write only invalidates the pages that showed what it changed.
+    Answers If-None-Match / If-Modified-Since with 304 Not Modified.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD') or not getattr(view_func, 'versioned_page_cache', False):
+            return None
+        key = PAGE_PREFIX + hashlib.md5(request.get_full_path().encode()).hexdigest()
+        entry = _cache().get(key)
+        if entry is not None and get_versions(entry['versions']) == entry['versions']:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+            for header in ('ETag', 'Last-Modified'):
+                if entry.get(header):
+                    response[header] = entry[header]
+            response['X-Page-Cache'] = 'hit'
+            return _conditional(request, response)
+
+        request.page_cache_key = key
+        request.page_cacheable = True
+        request.page_dependencies = {}
+        depend_on(request, [version_key(ALL)])
+        # Versions are bumped when the primary commits, so a replica that is
+        # behind would get its old rows cached under the new versions
+        read_from_primary()
+        return None
+
+    def process_response(self, request, response):
+        key = getattr(request, 'page_cache_key', None)
+        if key is None:
+            return response
+        if response.status_code == 200:
+            _add_versions(response, request.page_dependencies)
+        if (request.page_cacheable and response.status_code == 200 and not response.streaming
+                and not response.cookies):
+            _cache().set(key, {
+                'versions': request.page_dependencies,
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'ETag': response.get('ETag'),
+                'Last-Modified': response.get('Last-Modified'),
+            }, DEFAULT_TIMEOUT)
+            response['X-Page-Cache'] = 'miss'
+        return _conditional(request, response)
@@ -0,0 +1,283 @@
+from datetime import date
+
+from django.core.management.base import CommandError
+from django.db import connections
+from django.db.models import ForeignKey, UniqueConstraint
+
+from demo.models import Book
+
+# Schemes the book table can be left partitioned by: they keep the primary key
+# and the (author, title) unique constraint demo.ingest upserts on
+PARTITION_SCHEMES = ['author_hash']
+# date_range keeps neither, so it is only built by partition_benchmark, in a
+# transaction that is rolled back
+BENCHMARK_SCHEMES = PARTITION_SCHEMES + ['date_range']
+DEFAULT_HASH_PARTITIONS = 16
+# Yearly partitions are created up to this many years past the latest
+# publication date (or this year); later dates land in the default partition.
+FUTURE_YEARS = 2
+# Stands in for the primary key under date_range, see partition_book_table
+ID_INDEX_NAME = 'demo_book_id_idx'
+
+_STRATEGIES = {'h': 'author_hash', 'r': 'date_range'}
+
+
+def book_partitioning(cursor, model=Book):
+    """ The scheme the book table is partitioned by, or None. """
+    cursor.execute(
+        'SELECT partstrat FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)',
+        [model._meta.db_table]
+    )
+    row = cursor.fetchone()
+    return _STRATEGIES[row[0]] if row else None
+
+
+def book_partitions(cursor, model=Book):
+    """ [(partition name, bound expression)] of the book table. """
+    cursor.execute('''
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    ''', [model._meta.db_table])
+    return cursor.fetchall()
+
+
+def _year_range(cursor, table):
+    cursor.execute(f'SELECT extract(year FROM min(publication_date)), extract(year FROM max(publication_date)) FROM {table}')
+    (first, last) = cursor.fetchone()
+    this_year = date.today().year
+    return range(int(first or this_year), max(int(last or this_year), this_year) + FUTURE_YEARS + 1)
+
+
+def _partition_statements(cursor, scheme, table, partitions):
+    """ (PARTITION BY clause, partition key column, CREATE TABLE ... PARTITION OF statements) """
+    if scheme == 'author_hash':
+        return (
+            'PARTITION BY HASH (author_id)',
+            'author_id',
+            [f'CREATE TABLE {table}_p{i:02} PARTITION OF {{table}} FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})'
+             for i in range(partitions)],
+        )
+    if scheme == 'date_range':
+        return (
+            'PARTITION BY RANGE (publication_date)',
+            'publication_date',
+            [f"CREATE TABLE {table}_y{year} PARTITION OF {{table}} FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+             for year in _year_range(cursor, table)]
+            # Books without a publication date, and dates beyond the yearly partitions
+            + [f'CREATE TABLE {table}_default PARTITION OF {{table}} DEFAULT'],
+        )
+    raise ValueError(f'scheme must be one of {", ".join(BENCHMARK_SCHEMES)}, not {scheme!r}')
+
+
+def _references(model):
+    """ [(model, ForeignKey)] of the foreign keys to `model`. """
+    return [
+        (relation.related_model, relation.field) for relation in model._meta.get_fields(include_hidden=True)
+        if relation.auto_created and not relation.concrete and isinstance(relation.field, ForeignKey)
+    ]
+
+
+# Stand in for the foreign keys to a partitioned book table, which PostgreSQL
+# cannot have: a partitioned table can only have unique constraints on columns
+# including the partition key. Like Django's foreign keys they are deferred to
+# the commit. demo_book_referenced fires on the referencing table with
+# (column, book table); demo_book_unreferenced on the book table with
+# (referencing table, column).
+REFERENCE_FUNCTIONS_SQL = '''
+    CREATE OR REPLACE FUNCTION demo_book_referenced() RETURNS trigger LANGUAGE plpgsql AS $$
+    DECLARE
+        book_id bigint;
+        exists boolean;
+    BEGIN
+        EXECUTE format('SELECT ($1).%I', TG_ARGV[0]) INTO book_id USING NEW;
+        IF book_id IS NULL THEN
+            RETURN NULL;
+        END IF;
+        EXECUTE format('SELECT EXISTS (SELECT FROM %I WHERE id = $1)', TG_ARGV[1]) INTO exists USING book_id;
+        IF NOT exists THEN
+            RAISE foreign_key_violation USING MESSAGE = format(
+                'insert or update on table "%s" violates the reference to "%s": id %s does not exist',
+                TG_TABLE_NAME, TG_ARGV[1], book_id);
+        END IF;
+        RETURN NULL;
+    END $$;
+
+    CREATE OR REPLACE FUNCTION demo_book_unreferenced() RETURNS trigger LANGUAGE plpgsql AS $$
+    DECLARE
+        referenced boolean;
+    BEGIN
+        EXECUTE format(
+            'SELECT EXISTS (SELECT FROM %I WHERE %I = $1) AND NOT EXISTS (SELECT FROM %I WHERE id = $1)',
+            TG_ARGV[0], TG_ARGV[1], TG_TABLE_NAME
+        ) INTO referenced USING OLD.id;
+        IF referenced THEN
+            RAISE foreign_key_violation USING MESSAGE = format(
+                'update or delete on table "%s" violates the reference from "%s": id %s is still referenced',
+                TG_TABLE_NAME, TG_ARGV[0], OLD.id);
+        END IF;
+        RETURN NULL;
+    END $$;
+'''
+DROP_REFERENCE_FUNCTIONS_SQL = 'DROP FUNCTION IF EXISTS demo_book_referenced(), demo_book_unreferenced()'
+
+
+def _reference_trigger_name(field):
+    return f'{field.model._meta.db_table}_{field.column}_ref'
+
+
+def _add_reference_triggers(schema_editor, model):
+    table = model._meta.db_table
+    # None: the function bodies' format() placeholders are not parameters
+    schema_editor.execute(REFERENCE_FUNCTIONS_SQL, params=None)
+    for (related_model, field) in _references(model):
+        (name, related_table) = (_reference_trigger_name(field), related_model._meta.db_table)
+        schema_editor.execute(
+            f'CREATE CONSTRAINT TRIGGER {name} AFTER INSERT OR UPDATE OF {field.column} ON {related_table} '
+            'DEFERRABLE INITIALLY DEFERRED FOR EACH ROW '
+            f"EXECUTE FUNCTION demo_book_referenced('{field.column}', '{table}')"
+        )
+        schema_editor.execute(
+            f'CREATE CONSTRAINT TRIGGER {name} AFTER DELETE OR UPDATE OF id ON {table} '
+            'DEFERRABLE INITIALLY DEFERRED FOR EACH ROW '
+            f"EXECUTE FUNCTION demo_book_unreferenced('{related_table}', '{field.column}')"
+        )
+
+
+def _drop_reference_triggers(schema_editor, model):
+    # The book table's own triggers went with it
+    for (related_model, field) in _references(model):
+        name = _reference_trigger_name(field)
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name} ON {related_model._meta.db_table}')
+    schema_editor.execute(DROP_REFERENCE_FUNCTIONS_SQL)
+
+
+def _rebuild(schema_editor, model, scheme, partitions):
+    table = model._meta.db_table
+    new_table = f'{table}_new'
+    execute = schema_editor.execute
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+            ORDER BY attnum
+        ''', [table])
+        columns = ', '.join(schema_editor.quote_name(column) for (column,) in cursor.fetchall())
+        # Secondary indexes (not backing a constraint), recreated as they are
+        cursor.execute('''
+            SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = %s::regclass AND c.relname <> %s
+              AND i.indexrelid NOT IN (SELECT conindid FROM pg_constraint WHERE conrelid = %s::regclass)
+        ''', [table, ID_INDEX_NAME, table])
+        indexes = [definition.replace(' ON ONLY ', ' ON ') for (definition,) in cursor.fetchall()]
+        cursor.execute('''
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f'
+        ''', [table])
+        foreign_keys = cursor.fetchall()
+
+        if scheme is None:
+            (partition_by, key, partition_sql) = ('', None, [])
+        else:
+            (partition_by, key, partition_sql) = _partition_statements(cursor, scheme, table, partitions)
+
+    execute(f'CREATE TABLE {new_table} (LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY) {partition_by}')
+    for sql in partition_sql:
+        execute(sql.format(table=new_table))
+    execute(f'INSERT INTO {new_table} ({columns}) SELECT {columns} FROM {table}')
+    # Also drops the foreign keys referencing the old table
+    execute(f'DROP TABLE {table} CASCADE')
+    execute(f'ALTER TABLE {new_table} RENAME TO {table}')
+    with schema_editor.connection.cursor() as cursor:
+        # The identity sequence LIKE created for the new table keeps its name
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        (sequence,) = cursor.fetchone()
+    execute(f'ALTER SEQUENCE {sequence} RENAME TO {table}_id_seq')
+    execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false) FROM {table}")
+
+    # A primary key or unique constraint on a partitioned table must include
+    # the partition key, and a primary key makes its columns NOT NULL.
+    if key is None:
+        execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)')
+    elif key == 'author_id':
+        execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, author_id)')
+    else:
+        execute(f'CREATE INDEX {ID_INDEX_NAME} ON {table} (id)')
+    for constraint in model._meta.constraints:
+        if not isinstance(constraint, UniqueConstraint):
+            schema_editor.add_constraint(model, constraint)
+        elif key is None or key in [model._meta.get_field(name).column for name in constraint.fields]:
+            schema_editor.add_constraint(model, constraint)
+    for definition in indexes:
+        execute(definition)
+    for (name, definition) in foreign_keys:
+        execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+
+    # Foreign keys must reference a unique constraint, which a partitioned
+    # table can only have on columns including the partition key.
+    if key is None:
+        _drop_reference_triggers(schema_editor, model)
+        for (related_model, field) in _references(model):
+            execute(schema_editor._create_fk_sql(related_model, field, '_fk_%(to_table)s_%(to_column)s'))
+    else:
+        _add_reference_triggers(schema_editor, model)
+
+
+def partition_book_table(schema_editor, scheme, partitions=DEFAULT_HASH_PARTITIONS, model=Book,
+                         rolled_back=False):
+    """ Rebuilds the book table as a partitioned table, copying its rows,
+    indexes and constraints. `scheme` is
+      'author_hash'  PARTITION BY HASH (author_id) into `partitions` tables
+      'date_range'   PARTITION BY RANGE (publication_date), one table per year
+                     plus a default one for NULL and later dates; only with
+                     `rolled_back`, for callers that roll the transaction back
+    The Book model is unchanged, but PostgreSQL limits what the table can enforce:
+      - the primary key becomes (id, author_id) under author_hash, and under
+        date_range there is none (publication_date is nullable), only an index on id
+      - under date_range, (author, title) is no longer unique, so the upserts in
+        demo.ingest fail
+      - the foreign keys from book_genres and latestbook become constraint
+        triggers doing the same checks
+    Django's migrations still describe the unpartitioned table, so migrating
+    the demo app is refused while it is partitioned (see refuse_partitioned_migrate).
+    Run it inside a transaction (schema_editor's default): it copies the
+    whole table under an exclusive lock.
+    """
+    if scheme not in (BENCHMARK_SCHEMES if rolled_back else PARTITION_SCHEMES):
+        raise ValueError(f'scheme must be one of {", ".join(PARTITION_SCHEMES)}, not {scheme!r}')
+    with schema_editor.connection.cursor() as cursor:
+        current = book_partitioning(cursor, model)
+    if current is not None:
+        raise ValueError(f'{model._meta.db_table} is already partitioned by {current}')
+    _rebuild(schema_editor, model, scheme, partitions)
+
+
+def unpartition_book_table(schema_editor, model=Book):
+    """ Rebuilds a partitioned book table as a regular table with the
+    constraints and foreign keys Django's migrations created.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        if book_partitioning(cursor, model) is None:
+            raise ValueError(f'{model._meta.db_table} is not partitioned')
+    _rebuild(schema_editor, model, None, None)
+
+
+def refuse_partitioned_migrate(app_config, using, plan=None, **kwargs):
+    """ pre_migrate receiver. Migrations would alter the book table's primary
+    key and foreign keys as Django's migration state describes them, which a
+    partitioned table does not have, so they are refused until it is rebuilt
+    as a single table.
+    """
+    if not any(migration.app_label == app_config.label for (migration, _) in plan or []):
+        return
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        scheme = book_partitioning(cursor)
+    if scheme is not None:
+        raise CommandError(
+            f'{Book._meta.db_table} is partitioned by {scheme}. Run `python manage.py partition_books none` '
+            f'before migrating {app_config.label}, and partition it again afterwards.'
+        )
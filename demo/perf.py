@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import random
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from functools import lru_cache
+from time import monotonic, perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from demo.instrumentation import fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in milliseconds; slower requests land in a final overflow bucket
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1_000, 2_000, 5_000, 10_000)
+SLOT_SECONDS = 60
+SLOTS = 5
+DEFAULT_LOG_SAMPLE_RATE = 0.01
+DEFAULT_SLOW_MS = 500
+SLOWEST_SQL_MAX_LENGTH = 500
+UNRESOLVED = '(unresolved)'
+# Requests to these URL names are not recorded, so polling the stats doesn't skew them
+IGNORED_URL_NAMES = {'perf_stats'}
+
+# The RequestProfile of the request being handled. asgiref copies the context
+# into sync_to_async threads, so async views' queries are recorded too.
+_current_profile = ContextVar('demo_perf_profile', default=None)
+
+
+##########################################
+# PER-REQUEST PROFILE
+##########################################
+class RequestProfile:
+    """ Database time, query count, duplicates and the slowest statement of one request. """
+    def __init__(self):
+        self.start = perf_counter()
+        self.total_ms = 0
+        self.db_ms = 0
+        self.queries = 0
+        # Executions of a statement shape (see instrumentation.fingerprint)
+        # already run earlier in the request; an N+1 shows up here.
+        self.duplicates = 0
+        self.slowest_ms = 0
+        self.slowest_sql = None
+        self._seen = set()
+
+    def record(self, sql, elapsed_ms):
+        self.queries += 1
+        self.db_ms += elapsed_ms
+        fp = _fingerprint(sql)
+        if fp in self._seen:
+            self.duplicates += 1
+        else:
+            self._seen.add(fp)
+        if elapsed_ms > self.slowest_ms:
+            self.slowest_ms = elapsed_ms
+            self.slowest_sql = fp
+
+    def finish(self):
+        self.total_ms = (perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        """ The Server-Timing header value, shown in the browser's network panel. """
+        metrics = [
+            f'total;dur={self.total_ms:.2f}',
+            f'db;dur={self.db_ms:.2f};desc="{self.queries} queries, {self.duplicates} duplicates"',
+        ]
+        if self.queries:
+            metrics.append(f'db-slowest;dur={self.slowest_ms:.2f}')
+        return ', '.join(metrics)
+
+
+@lru_cache(maxsize=1_024)
+def _fingerprint(sql):
+    # The ORM sends the same SQL text (with %s placeholders) for every
+    # execution of a shape, so the regexes run once per shape.
+    return fingerprint(sql)
+
+
+def record_query(execute, sql, params, many, context):
+    """ Execute wrapper timing statements into the current request's profile. """
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record(sql, (perf_counter() - start) * 1000)
+
+
+def install(connection):
+    """ Adds record_query to a connection's execute wrappers (once). """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+##########################################
+# ROLLING HISTOGRAMS
+##########################################
+class RollingHistogram:
+    """ Request latencies over the last SLOTS * SLOT_SECONDS seconds, kept as
+    one bucket-count array per SLOT_SECONDS slot so old slots simply fall off.
+    """
+    def __init__(self, bounds=BUCKET_BOUNDS_MS, slot_seconds=SLOT_SECONDS, slots=SLOTS):
+        self.bounds = bounds
+        self.slot_seconds = slot_seconds
+        self.slots = slots
+        # [slot number, bucket counts, requests, total ms, db ms, queries, duplicates]
+        self._slots = deque(maxlen=slots)
+        self._lock = threading.Lock()
+
+    def add(self, profile, now=None):
+        slot = int((monotonic() if now is None else now) // self.slot_seconds)
+        bucket = bisect_left(self.bounds, profile.total_ms)
+        with self._lock:
+            if not self._slots or self._slots[-1][0] != slot:
+                self._slots.append([slot, [0] * (len(self.bounds) + 1), 0, 0, 0, 0, 0])
+            entry = self._slots[-1]
+            entry[1][bucket] += 1
+            entry[2] += 1
+            entry[3] += profile.total_ms
+            entry[4] += profile.db_ms
+            entry[5] += profile.queries
+            entry[6] += profile.duplicates
+
+    def percentile(self, counts, pct):
+        """ Upper bound (ms) of the bucket holding the pct-th percentile;
+        None for the overflow bucket.
+        """
+        rank = sum(counts) * pct / 100
+        seen = 0
+        for (bound, count) in zip(self.bounds, counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self, now=None):
+        oldest = int((monotonic() if now is None else now) // self.slot_seconds) - self.slots + 1
+        counts = [0] * (len(self.bounds) + 1)
+        (requests, total_ms, db_ms, queries, duplicates) = (0, 0, 0, 0, 0)
+        with self._lock:
+            for (slot, slot_counts, *sums) in self._slots:
+                if slot < oldest:
+                    continue
+                counts = [a + b for (a, b) in zip(counts, slot_counts)]
+                requests += sums[0]
+                total_ms += sums[1]
+                db_ms += sums[2]
+                queries += sums[3]
+                duplicates += sums[4]
+        if not requests:
+            return None
+        return {
+            'requests': requests,
+            'mean_ms': total_ms / requests,
+            'mean_db_ms': db_ms / requests,
+            'mean_queries': queries / requests,
+            'mean_duplicates': duplicates / requests,
+            'p50_ms': self.percentile(counts, 50),
+            'p95_ms': self.percentile(counts, 95),
+            'p99_ms': self.percentile(counts, 99),
+            'buckets': {f'le_{bound}': count for (bound, count) in zip(self.bounds, counts)} | {'overflow': counts[-1]},
+        }
+
+
+class PerfRegistry:
+    """ A RollingHistogram per URL name. Each server process keeps its own. """
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def add(self, url_name, profile):
+        histogram = self._histograms.get(url_name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(url_name, RollingHistogram())
+        histogram.add(profile)
+
+    def snapshot(self):
+        stats = {}
+        for (url_name, histogram) in sorted(self._histograms.items()):
+            histogram_stats = histogram.snapshot()
+            if histogram_stats is not None:
+                stats[url_name] = histogram_stats
+        return {
+            'pid': os.getpid(),
+            'window_seconds': SLOT_SECONDS * SLOTS,
+            'urls': stats,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+perf_registry = PerfRegistry()
+
+
+##########################################
+# MIDDLEWARE
+##########################################
+def _url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else UNRESOLVED
+
+
+class PerformanceMiddleware:
+    """ Times each request and its database queries, then
+      - adds a Server-Timing header (total, db and slowest query times)
+      - adds the request to perf_registry's histogram for its URL name
+      - logs it as JSON to the demo.perf logger, for a DEMO_PERF_LOG_SAMPLE_RATE
+        share of requests and for every request slower than DEMO_PERF_SLOW_MS
+    Put it first in MIDDLEWARE so the other middleware is timed too. A
+    streaming response is only timed until its headers are ready.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'DEMO_PERF_LOG_SAMPLE_RATE', DEFAULT_LOG_SAMPLE_RATE)
+        self.slow_ms = getattr(settings, 'DEMO_PERF_SLOW_MS', DEFAULT_SLOW_MS)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        self.finish(request, response, profile)
+        return response
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        self.finish(request, response, profile)
+        return response
+
+    def finish(self, request, response, profile):
+        profile.finish()
+        response['Server-Timing'] = profile.server_timing()
+        url_name = _url_name(request)
+        if url_name in IGNORED_URL_NAMES:
+            return
+        perf_registry.add(url_name, profile)
+        if profile.total_ms >= self.slow_ms or random.random() < self.sample_rate:
+            logger.info(json.dumps({
+                'url_name': url_name,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(profile.total_ms, 2),
+                'db_ms': round(profile.db_ms, 2),
+                'queries': profile.queries,
+                'duplicates': profile.duplicates,
+                'slowest_ms': round(profile.slowest_ms, 2),
+                'slowest_sql': (profile.slowest_sql or '')[:SLOWEST_SQL_MAX_LENGTH] or None,
+            }))
@@ -0,0 +1,148 @@
+import hashlib
+import re
+from collections import Counter, OrderedDict
+from contextlib import ContextDecorator
+from weakref import WeakKeyDictionary
+
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+
+# Like psycopg 3's prepare_threshold: a statement is prepared on its fifth execution
+DEFAULT_PREPARE_THRESHOLD = 5
+DEFAULT_MAX_PREPARED = 100
+# Statements counted towards the threshold per connection before the counts reset
+MAX_TRACKED = 10_000
+
+_PLACEHOLDER = re.compile(r'%(s|%)')
+
+
+def to_server_placeholders(sql):
+    """ Rewrites the DB-API placeholders of `sql` as PREPARE parameters and
+    returns (sql, number of parameters):
+
+        WHERE "title" = %s AND "title" LIKE 'a%%'  ->  WHERE "title" = $1 AND "title" LIKE 'a%'
+    """
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(1) == '%':
+            return '%'
+        count += 1
+        return f'${count}'
+
+    return (_PLACEHOLDER.sub(replace, sql), count)
+
+
+class PreparedState:
+    """ The statements prepared on one database session. """
+    def __init__(self):
+        self.counts = Counter()
+        # SQL -> prepared statement name, least recently used first
+        self.prepared = OrderedDict()
+        self.unpreparable = set()
+
+
+# Keyed by the DB-API connection, so a reconnect starts from scratch
+_states = WeakKeyDictionary()
+
+
+class StatementPreparer:
+    """ Execute wrapper that runs hot SELECTs as server-side prepared
+    statements, so PostgreSQL parses and plans them once per connection
+    instead of on every execution.
+
+    Once the same SQL text (the ORM sends identical text, with %s
+    placeholders, for every execution of a query shape) has run `threshold`
+    times on a connection, it is sent once as PREPARE and from then on as
+    EXECUTE name(params). At most `max_prepared` statements are kept per
+    connection, deallocating the least recently used.
+
+    After five executions PostgreSQL may switch a prepared statement to a
+    generic plan that ignores the parameter values; set plan_cache_mode if
+    skewed columns need custom plans. Session-level prepared statements do
+    not survive transaction-mode connection poolers such as PgBouncer's.
+    """
+    def __init__(self, threshold=DEFAULT_PREPARE_THRESHOLD, max_prepared=DEFAULT_MAX_PREPARED):
+        self.threshold = threshold
+        self.max_prepared = max_prepared
+
+    def __call__(self, execute, sql, params, many, context):
+        connection = context['connection']
+        if (many or not params or not isinstance(params, (list, tuple)) or connection.vendor != 'postgresql'
+                or not sql.lstrip()[:6].upper() == 'SELECT'
+                # Named (server-side) cursors wrap the statement in DECLARE ... CURSOR FOR,
+                # which cannot take an EXECUTE
+                or getattr(context['cursor'].cursor, 'name', None)):
+            return execute(sql, params, many, context)
+
+        state = _states.get(connection.connection)
+        if state is None:
+            state = _states[connection.connection] = PreparedState()
+        name = state.prepared.get(sql)
+        if name is not None:
+            state.prepared.move_to_end(sql)
+        elif sql in state.unpreparable:
+            return execute(sql, params, many, context)
+        else:
+            if len(state.counts) >= MAX_TRACKED:
+                state.counts.clear()
+            state.counts[sql] += 1
+            if state.counts[sql] < self.threshold:
+                return execute(sql, params, many, context)
+            name = self._prepare(execute, sql, len(params), context, state)
+            if name is None:
+                return execute(sql, params, many, context)
+        return execute(f'EXECUTE {name}({", ".join(["%s"] * len(params))})', params, many, context)
+
+    def _prepare(self, execute, sql, param_count, context, state):
+        del state.counts[sql]
+        (server_sql, count) = to_server_placeholders(sql)
+        if count != param_count:
+            state.unpreparable.add(sql)
+            return None
+        name = 'demo_' + hashlib.md5(sql.encode()).hexdigest()[:16]
+        while len(state.prepared) >= self.max_prepared:
+            (_, evicted) = state.prepared.popitem(last=False)
+            execute(f'DEALLOCATE {evicted}', None, False, context)
+        try:
+            # A failed PREPARE (e.g. a parameter whose type cannot be inferred)
+            # must not abort the caller's transaction
+            with transaction.atomic(using=context['connection'].alias):
+                execute(f'PREPARE {name} AS {server_sql}', None, False, context)
+        except DatabaseError:
+            state.unpreparable.add(sql)
+            return None
+        state.prepared[sql] = name
+        return name
+
+
+def install(connection, threshold=DEFAULT_PREPARE_THRESHOLD, max_prepared=DEFAULT_MAX_PREPARED):
+    """ Adds a StatementPreparer to a connection's execute wrappers (once). """
+    if not any(isinstance(wrapper, StatementPreparer) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(StatementPreparer(threshold, max_prepared))
+
+
+class prepared_statements(ContextDecorator):
+    """ Runs the block's hot SELECTs as prepared statements (see StatementPreparer).
+
+        with prepared_statements():
+            get_book_intros(book_ids)
+
+    Statements prepared inside the block stay prepared on the connection for
+    later blocks.
+    """
+    def __init__(self, threshold=DEFAULT_PREPARE_THRESHOLD, max_prepared=DEFAULT_MAX_PREPARED,
+                 using=DEFAULT_DB_ALIAS):
+        self.preparer = StatementPreparer(threshold, max_prepared)
+        self.using = using
+        self._wrapper_cm = None
+
+    def __enter__(self):
+        self._wrapper_cm = connections[self.using].execute_wrapper(self.preparer)
+        self._wrapper_cm.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._wrapper_cm.__exit__(exc_type, exc_value, tb)
+        self._wrapper_cm = None
+        return False
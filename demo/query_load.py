@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+import statistics
+from collections import Counter
+from dataclasses import dataclass, field
+from threading import BrokenBarrierError
+from time import perf_counter_ns, sleep, time
+
+from django.db import DatabaseError, connection, connections
+
+from demo.benchmark import percentile, run_once
+
+DEFAULT_SAMPLE_INTERVAL = 0.1
+# Backends of this database other than the sampler's own
+ACTIVITY_SQL = '''
+    SELECT coalesce(wait_event_type, 'CPU'), coalesce(wait_event, 'running')
+    FROM pg_stat_activity
+    WHERE datname = current_database()
+      AND pid <> pg_backend_pid()
+      AND backend_type = 'client backend'
+      AND state = 'active'
+'''
+
+
+@dataclass
+class QueryLoadResult:
+    name: str
+    concurrency: int
+    elapsed_s: float = 0
+    latencies_ns: list = field(default_factory=list)
+    errors: int = 0
+    # (wait_event_type, wait_event) -> number of times an active backend was seen in it
+    waits: Counter = field(default_factory=Counter)
+    samples: int = 0
+
+    @property
+    def calls(self):
+        return len(self.latencies_ns)
+
+    @property
+    def calls_per_s(self):
+        return self.calls / self.elapsed_s if self.elapsed_s else 0
+
+    def latency_ms(self, pct):
+        return percentile(self.latencies_ns, pct) / 1_000_000 if self.latencies_ns else 0
+
+    @property
+    def mean_active(self):
+        """ Average number of backends seen running a query. """
+        return sum(self.waits.values()) / self.samples if self.samples else 0
+
+    def top_waits(self, n=3):
+        """ The most common waits as (label, share of active backend samples). """
+        total = sum(self.waits.values())
+        return [(f'{wait_type}:{wait}', count / total) for ((wait_type, wait), count) in self.waits.most_common(n)]
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'concurrency': self.concurrency,
+            'calls': self.calls,
+            'errors': self.errors,
+            'calls_per_s': self.calls_per_s,
+            'mean_ms': statistics.mean(self.latencies_ns) / 1_000_000 if self.latencies_ns else 0,
+            'p50_ms': self.latency_ms(50),
+            'p95_ms': self.latency_ms(95),
+            'p99_ms': self.latency_ms(99),
+            'mean_active_backends': self.mean_active,
+            'lock_wait_share': (sum(count for ((wait_type, _), count) in self.waits.items() if wait_type == 'Lock')
+                                / max(sum(self.waits.values()), 1)),
+            'waits': {f'{wait_type}:{wait}': count for ((wait_type, wait), count) in self.waits.items()},
+        }
+
+
+def default_levels():
+    """ 1, 2, 4, ... up to the number of CPUs. """
+    levels = [1]
+    while levels[-1] * 2 <= (os.cpu_count() or 1):
+        levels.append(levels[-1] * 2)
+    return levels
+
+
+def _worker(func, args, duration, barrier, results):
+    """ Runs in a forked process, which opens its own database connection. """
+    latencies = []
+    errors = 0
+    try:
+        # Warm up (and connect) before the clock starts
+        run_once(func, args, {})
+        barrier.wait()
+        deadline = time() + duration
+        while time() < deadline:
+            start_ns = perf_counter_ns()
+            try:
+                run_once(func, args, {})
+            except DatabaseError:
+                errors += 1
+                continue
+            latencies.append(perf_counter_ns() - start_ns)
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        results.put((latencies, errors, time()))
+        connections.close_all()
+
+
+def _sample_activity(result):
+    with connection.cursor() as cursor:
+        cursor.execute(ACTIVITY_SQL)
+        result.waits.update(cursor.fetchall())
+    result.samples += 1
+
+
+def run_query_load(case, concurrency, duration=5, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+    """ Calls `case.func(*case.args)` in a loop from `concurrency` worker
+    processes for `duration` seconds, sampling pg_stat_activity every
+    `sample_interval` seconds meanwhile.
+
+    Workers are forked (so this needs a POSIX system) after the parent's
+    connections are closed, so each one opens a connection of its own.
+    """
+    result = QueryLoadResult(name=case.name, concurrency=concurrency)
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(concurrency + 1)
+    results = context.Queue()
+
+    connections.close_all()
+    processes = [
+        context.Process(target=_worker, args=(case.func, case.args, duration, barrier, results))
+        for _ in range(concurrency)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        barrier.wait()
+    except BrokenBarrierError:
+        for process in processes:
+            process.terminate()
+        raise RuntimeError(f'A worker failed while warming up {case.name}')
+
+    start = time()
+    if connection.vendor == 'postgresql':
+        while time() < start + duration:
+            _sample_activity(result)
+            sleep(sample_interval)
+
+    finished_at = []
+    for _ in processes:
+        (latencies, errors, finished) = results.get()
+        result.latencies_ns.extend(latencies)
+        result.errors += errors
+        finished_at.append(finished)
+    for process in processes:
+        process.join()
+    # The last call of each worker may overrun the deadline
+    result.elapsed_s = max(finished_at) - start
+    return result
@@ -0,0 +1,202 @@
+import logging
+import random
+import threading
+from contextvars import ContextVar
+from time import monotonic
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Reads of these models (label_lower) may go to a replica
+REPLICATED_MODELS = {'demo.author', 'demo.book', 'demo.genre', 'demo.book_genres'}
+DEFAULT_MAX_LAG = 5
+DEFAULT_PIN_SECONDS = 5
+LAG_CHECK_INTERVAL = 1
+PIN_COOKIE = 'demo_primary_pin'
+# The primary's current WAL position, read at the start of each lag check
+PRIMARY_LSN_SQL = 'SELECT pg_current_wal_lsn()'
+# Seconds the replica is behind the primary: 0 once it has replayed the WAL the
+# primary had written when the check started (an idle replica's last replayed
+# transaction can be old without it being behind), and 0 on a database that is
+# not a standby at all, such as a second local database standing in for a
+# replica. Comparing against the primary rather than the WAL the replica has
+# received means a replica whose WAL receiver disconnected falls behind too.
+LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_replay_lsn() >= %s::pg_lsn THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+    END
+'''
+
+
+def replica_aliases():
+    return getattr(settings, 'DB_REPLICAS', [])
+
+
+##########################################
+# REPLICA LAG
+##########################################
+class ReplicaLagMonitor:
+    """ Measures each replica's lag at most every `interval` seconds per
+    process. A replica that cannot be reached counts as infinitely behind.
+    """
+    def __init__(self, interval=LAG_CHECK_INTERVAL):
+        self.interval = interval
+        # alias -> (lag in seconds, monotonic time measured)
+        self._lags = {}
+        self._lock = threading.Lock()
+
+    def measure(self, alias):
+        try:
+            with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+                cursor.execute(PRIMARY_LSN_SQL)
+                primary_lsn = cursor.fetchone()[0]
+            with connections[alias].cursor() as cursor:
+                cursor.execute(LAG_SQL, [primary_lsn])
+                lag = float(cursor.fetchone()[0])
+        except DatabaseError as e:
+            logger.warning('Replica %s is unavailable: %s', alias, e)
+            lag = float('inf')
+        with self._lock:
+            self._lags[alias] = (lag, monotonic())
+        return lag
+
+    def lag(self, alias):
+        (lag, measured_at) = self._lags.get(alias, (None, None))
+        if lag is None or monotonic() - measured_at >= self.interval:
+            lag = self.measure(alias)
+        return lag
+
+    def clear(self):
+        with self._lock:
+            self._lags.clear()
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+##########################################
+# PINNING
+##########################################
+class RoutingState:
+    def __init__(self, pinned=False):
+        # Whether reads must go to the primary: set by a write, and by the pin
+        # cookie for a few seconds after a client's previous write
+        self.pinned = pinned
+        self.wrote = False
+
+
+# The current request's RoutingState. Outside a request (management commands,
+# shells) it is created on the first write and pins the rest of the process.
+_routing_state = ContextVar('demo_routing_state', default=None)
+
+
+def _state():
+    state = _routing_state.get()
+    if state is None:
+        state = RoutingState()
+        _routing_state.set(state)
+    return state
+
+
+def pin_to_primary():
+    state = _state()
+    state.pinned = state.wrote = True
+
+
+def read_from_primary():
+    """ Sends the rest of the current request's reads to the primary, without
+    pinning the client's later requests the way a write does.
+    """
+    _state().pinned = True
+
+
+def is_pinned():
+    state = _routing_state.get()
+    return state is not None and state.pinned
+
+
+class ReplicaPinMiddleware:
+    """ Gives each request its own RoutingState and keeps a client's reads on
+    the primary for DB_REPLICA_PIN_SECONDS after a request of theirs writes, so
+    they read their own writes (e.g. after a redirect).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'DB_REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing_state.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing_state.reset(token)
+        return self.finish(response, state)
+
+    def finish(self, response, state):
+        if state.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
+
+
+##########################################
+# ROUTER
+##########################################
+class ReplicaRouter:
+    """ Sends reads of REPLICATED_MODELS to a random replica from
+    settings.DB_REPLICAS that is at most DB_REPLICA_MAX_LAG seconds behind,
+    and everything else to the primary. Reads stay on the primary
+      - once the request (or, outside requests, the process) has written
+      - inside a transaction on the primary, which must see its own writes
+      - when every replica is too far behind or down
+    Migrations only run on the primary; the replicas get the schema through replication.
+    """
+    def db_for_read(self, model, **hints):
+        # Related objects come from the database their instance was read from,
+        # e.g. the genres prefetched for books read from the primary
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if model._meta.label_lower not in REPLICATED_MODELS or is_pinned():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        max_lag = getattr(settings, 'DB_REPLICA_MAX_LAG', DEFAULT_MAX_LAG)
+        fresh = [alias for alias in replica_aliases() if lag_monitor.lag(alias) <= max_lag]
+        return random.choice(fresh) if fresh else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
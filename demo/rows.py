@@ -0,0 +1,60 @@
+from itertools import starmap
+from typing import NamedTuple
+
+from django.db import models
+from django.db.models.query import BaseIterable, ValuesListIterable
+
+
+class RowIterable(BaseIterable):
+    """ Builds one `row_class` record per values_list() tuple. """
+    def __iter__(self):
+        row_class = self.queryset._row_class
+        values = ValuesListIterable(self.queryset, self.chunked_fetch, self.chunk_size)
+        # namedtuples build straight from the value tuple; other classes take
+        # the values as positional arguments.
+        if hasattr(row_class, '_make'):
+            return map(row_class._make, values)
+        return starmap(row_class, values)
+
+
+class RowQuerySet(models.QuerySet):
+    def rows(self, row_class, *fields):
+        """ Projects each row onto `row_class`, e.g.
+        Book.objects.rows(BookRow, 'title', 'author__name'), skipping model
+        instances entirely. `fields` are passed to values_list() in the order
+        of the row class's constructor arguments and default to a namedtuple's
+        _fields.
+        """
+        clone = self.values_list(*(fields or row_class._fields))
+        clone._row_class = row_class
+        clone._iterable_class = RowIterable
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._row_class = getattr(self, '_row_class', None)
+        return clone
+
+
+##########################################
+# ROW CLASSES
+##########################################
+class BookRow:
+    """ A book title and its author's name without per-instance __dict__. """
+    __slots__ = ('title', 'author_name')
+
+    def __init__(self, title, author_name):
+        self.title = title
+        self.author_name = author_name
+
+    def __eq__(self, other):
+        return isinstance(other, BookRow) and (self.title, self.author_name) == (other.title, other.author_name)
+
+    def __repr__(self):
+        return f'BookRow(title={self.title!r}, author_name={self.author_name!r})'
+
+
+class BookRecord(NamedTuple):
+    """ Tuple-backed counterpart of BookRow; cheaper to build. """
+    title: str
+    author_name: str
@@ -0,0 +1,52 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+from demo.models import Book
+
+SEARCH_CONFIG = 'english'
+SEARCH_MODES = ['text', 'prefix', 'fuzzy']
+
+
+def _rank(expression):
+    # Ranks are `real`; as double precision they survive the JSON round trip
+    # through a pagination cursor exactly and compare equal again.
+    return Cast(expression, FloatField())
+
+
+def prefix_query(text):
+    """ A tsquery matching titles with words starting with each word of
+    `text`, e.g. 'ban boo' -> 'ban:* & boo:*'. Returns None if `text` has no words.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=SEARCH_CONFIG)
+
+
+def search_books(text, mode='text'):
+    """ Books whose title matches `text`, annotated with a relevance `rank`
+    (higher is better). Modes:
+      'text'    web-search syntax over Book.search_vector ("quoted phrases", -excluded)
+      'prefix'  every word of `text` as a word prefix, for type-ahead
+      'fuzzy'   pg_trgm similarity to the whole title, tolerating typos
+    The first two use the GIN index on search_vector, 'fuzzy' the trigram
+    index on title.
+    """
+    if mode == 'fuzzy':
+        return (Book.objects
+                .filter(title__trigram_similar=text)
+                .annotate(rank=_rank(TrigramSimilarity('title', text))))
+    if mode == 'prefix':
+        query = prefix_query(text)
+        if query is None:
+            return Book.objects.none()
+    elif mode == 'text':
+        query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+    else:
+        raise ValueError(f'mode must be one of {", ".join(SEARCH_MODES)}, not {mode!r}')
+    return (Book.objects
+            .filter(search_vector=query)
+            .annotate(rank=_rank(SearchRank(F('search_vector'), query))))
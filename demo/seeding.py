@@ -0,0 +1,179 @@
+import io
+from datetime import date
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from demo.genre_index import genre_index
+from demo.models import Author, Book, Genre, LatestBook
+from demo.page_cache import ALL, bump_versions, version_key
+
+GENRE_NAMES = ['Sci fi', 'Fantasy', 'Horror', 'Lit Fic']
+
+# (author name, title, page count, genre names)
+FAMOUS_BOOKS = [
+    ('JRR Tolkien', 'Return of the King', 504, ['Fantasy']),
+    ('Chinua Achebe', 'Things Fall Apart', 301, ['Lit Fic']),
+    ('Han Kang', 'The Vegetarian', 200, ['Lit Fic', 'Horror'])
+]
+
+# An author with multiple books: (title, publication date, page count)
+MULTI_BOOK_AUTHOR = 'Author McAuthor'
+MULTI_BOOK_AUTHOR_BOOKS = [
+    ('Apple Book', date(2016, 5, 1), 100),
+    ('Banana Book', date(2018, 10, 10), 200),
+    ('Pear Book', date(2020, 12, 1), 155),
+]
+
+DEFAULT_ROWS = 100_000
+DEFAULT_BATCH_SIZE = 5_000
+
+AUTHOR_COLUMNS = ['id', 'name', 'book_count']
+BOOK_COLUMNS = ['id', 'title', 'title_without_index', 'page_count', 'publication_date', 'author_id']
+BOOK_GENRE_COLUMNS = ['book_id', 'genre_id']
+
+
+def generate_rows(rows, genre_ids):
+    """ Yields ('author' | 'book' | 'book_genre', row) pairs with explicit ids,
+    in the same order the original row-by-row seeding created them.
+    Ids start at 1, so the tables must be empty with their sequences reset.
+    Author.book_count is written directly since COPY and bulk_create skip signals.
+    """
+    author_id = 0
+    book_id = 0
+    for (author_name, title, page_count, genre_names) in FAMOUS_BOOKS:
+        author_id += 1
+        book_id += 1
+        yield ('author', (author_id, author_name, 1))
+        yield ('book', (book_id, title, title, page_count, None, author_id))
+        for genre_name in genre_names:
+            yield ('book_genre', (book_id, genre_ids[genre_name]))
+
+    author_id += 1
+    yield ('author', (author_id, MULTI_BOOK_AUTHOR, len(MULTI_BOOK_AUTHOR_BOOKS)))
+    for (title, publication_date, page_count) in MULTI_BOOK_AUTHOR_BOOKS:
+        book_id += 1
+        yield ('book', (book_id, title, title, page_count, publication_date, author_id))
+
+    lit_fic_id = genre_ids['Lit Fic']
+    for i in range(rows):
+        author_id += 1
+        book_id += 1
+        title = f'Book {i}'
+        yield ('author', (author_id, f'Author {i}', 1))
+        yield ('book', (book_id, title, title, 100, None, author_id))
+        yield ('book_genre', (book_id, lit_fic_id))
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def copy_rows(cursor, table, columns, rows):
+    """ Streams rows into `table` with COPY FROM STDIN (PostgreSQL only). """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(value) for value in row))
+        buffer.write('\n')
+    sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN'
+    if hasattr(cursor, 'copy_expert'):
+        # psycopg2
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+    else:
+        # psycopg 3
+        with cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+
+class _CopyWriter:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def write(self, model, columns, rows):
+        copy_rows(self.cursor, model._meta.db_table, columns, rows)
+
+
+class _BulkCreateWriter:
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def write(self, model, columns, rows):
+        model.objects.bulk_create(
+            [model(**dict(zip(columns, row))) for row in rows],
+            batch_size=self.batch_size
+        )
+
+
+def clear_tables():
+    if connection.vendor == 'postgresql':
+        tables = [LatestBook, Book.genres.through, Book, Author, Genre]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'TRUNCATE {", ".join(m._meta.db_table for m in tables)} RESTART IDENTITY CASCADE'
+            )
+        return
+    Genre.objects.all().delete()
+    Book.objects.all().delete()
+    Author.objects.all().delete()
+
+
+def reset_sequences():
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [Author, Book, Genre, Book.genres.through]
+    )
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def seed(rows=DEFAULT_ROWS, batch_size=DEFAULT_BATCH_SIZE, use_copy=None):
+    """ Clears the demo tables and writes `rows` generated authors and books
+    (plus a handful of hand-written ones) in batches.
+
+    Uses COPY FROM STDIN on PostgreSQL unless `use_copy` is False, and
+    bulk_create everywhere else.
+    """
+    if use_copy is None:
+        use_copy = connection.vendor == 'postgresql'
+
+    with transaction.atomic():
+        clear_tables()
+        genres = Genre.objects.bulk_create([Genre(name=name) for name in GENRE_NAMES])
+        genre_ids = {genre.name: genre.id for genre in genres}
+
+        with connection.cursor() as cursor:
+            writer = _CopyWriter(cursor) if use_copy else _BulkCreateWriter(batch_size)
+            targets = {
+                'author': (Author, AUTHOR_COLUMNS),
+                'book': (Book, BOOK_COLUMNS),
+                'book_genre': (Book.genres.through, BOOK_GENRE_COLUMNS),
+            }
+            # Authors must be flushed before the books that reference them, and
+            # books before their genres, so batches are written in that order.
+            pending = {kind: [] for kind in targets}
+
+            def flush():
+                for kind in ['author', 'book', 'book_genre']:
+                    if pending[kind]:
+                        model, columns = targets[kind]
+                        writer.write(model, columns, pending[kind])
+                        pending[kind] = []
+
+            for (kind, row) in generate_rows(rows, genre_ids):
+                pending[kind].append(row)
+                if len(pending[kind]) >= batch_size:
+                    flush()
+            flush()
+
+        reset_sequences()
+        # COPY and bulk_create skip the signals that maintain this table
+        LatestBook.rebuild(batch_size=batch_size)
+        transaction.on_commit(genre_index.invalidate)
+        bump_versions([version_key(ALL)])
@@ -0,0 +1,214 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.functions import Greatest, Now
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from demo.analytics import book_snapshot
+from demo.cache import author_cache, book_cache
+from demo.genre_index import genre_index
+from demo.models import Author, Book, Genre, LatestBook
+from demo.page_cache import AUTHORS, BOOKS, GENRES, bump_versions, version_key
+from demo.perf import install as install_perf_wrapper
+from demo.prepared import install as install_statement_preparer
+
+
+def _adjust_book_count(author_id, delta):
+    if author_id is not None:
+        # Clamped: after writes that bypass the signals the count may already
+        # be 0, and a negative one would violate the column's CHECK
+        Author.objects.filter(id=author_id).update(book_count=Greatest(F('book_count') + delta, 0), updated_at=Now())
+        author_cache.invalidate([author_id])
+        bump_versions([version_key('author', author_id)])
+
+
+@receiver(post_save, sender=Book)
+def update_book_count_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        _adjust_book_count(instance.author_id, 1)
+    else:
+        loaded_author_id = getattr(instance, '_loaded_author_id', instance.author_id)
+        if loaded_author_id != instance.author_id:
+            _adjust_book_count(loaded_author_id, -1)
+            _adjust_book_count(instance.author_id, 1)
+    instance._loaded_author_id = instance.author_id
+
+
+@receiver(post_delete, sender=Book)
+def update_book_count_on_delete(sender, instance, **kwargs):
+    _adjust_book_count(instance.author_id, -1)
+
+
+@receiver(pre_save, sender=Book)
+def remember_previous_author(sender, instance, **kwargs):
+    # update_book_count_on_save resets _loaded_author_id, so capture it first.
+    instance._previous_author_id = getattr(instance, '_loaded_author_id', None)
+    instance._previous_title = getattr(instance, '_loaded_title', None)
+    instance._previous_publication_date = getattr(instance, '_loaded_publication_date', None)
+
+
+@receiver(post_save, sender=Book)
+def update_latest_book_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous_author_id = getattr(instance, '_previous_author_id', None)
+    # Only a new book, a new author or a new date can change whose latest book it is.
+    # (A deferred publication_date is in neither __dict__ and is not saved.)
+    if (created or previous_author_id != instance.author_id
+            or instance._previous_publication_date != instance.__dict__.get('publication_date')):
+        LatestBook.refresh_authors([instance.author_id, previous_author_id])
+    instance._loaded_publication_date = instance.__dict__.get('publication_date')
+
+
+@receiver(post_delete, sender=Book)
+def update_latest_book_on_delete(sender, instance, **kwargs):
+    LatestBook.refresh_authors([instance.author_id])
+
+
+##########################################
+# CACHE INVALIDATION
+##########################################
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book(sender, instance, **kwargs):
+    book_cache.invalidate([instance.pk], [instance.title])
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def mark_book_dirty_in_snapshot(sender, instance, **kwargs):
+    # Marked again after commit so a refresh in between cannot keep the old row
+    book_id = instance.pk
+    book_snapshot.mark_dirty([book_id])
+    transaction.on_commit(lambda: book_snapshot.mark_dirty([book_id]))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author(sender, instance, **kwargs):
+    author_cache.invalidate([instance.pk])
+    # Cached books carry their author through select_related.
+    book_cache.invalidate(Book.objects.filter(author_id=instance.pk).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+def invalidate_genre_books(sender, instance, created=False, **kwargs):
+    # Cached books carry their genres through prefetch_related. On delete the
+    # books are only known before the m2m rows go.
+    if not created:
+        book_cache.invalidate(Book.objects.filter(genres=instance).values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=Book.genres.through)
+def invalidate_book_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            book_cache.invalidate([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        book_cache.invalidate(pk_set)
+    elif action == 'pre_clear':
+        # genre.book_set.clear(): the affected books are only known before clearing.
+        book_cache.invalidate(Book.objects.filter(genres=instance).values_list('id', flat=True))
+
+
+##########################################
+# PAGE CACHE VERSIONS
+##########################################
+@receiver(post_save, sender=Book)
+def bump_book_versions_on_save(sender, instance, created, **kwargs):
+    keys = [version_key('book', instance.pk)]
+    previous_author_id = getattr(instance, '_previous_author_id', None)
+    # A new, retitled or reassigned book moves in the (title, id) ordered
+    # lists and in its authors' lists.
+    if created or instance._previous_title != instance.title or previous_author_id != instance.author_id:
+        keys += [version_key(BOOKS), version_key('author_books', instance.author_id)]
+        if previous_author_id is not None:
+            keys.append(version_key('author_books', previous_author_id))
+    instance._loaded_title = instance.title
+    bump_versions(keys)
+
+
+@receiver(post_delete, sender=Book)
+def bump_book_versions_on_delete(sender, instance, **kwargs):
+    bump_versions([
+        version_key('book', instance.pk), version_key(BOOKS), version_key('author_books', instance.author_id)
+    ])
+
+
+@receiver(post_save, sender=Author)
+def bump_author_versions_on_save(sender, instance, created, **kwargs):
+    bump_versions([version_key('author', instance.pk)] + ([version_key(AUTHORS)] if created else []))
+
+
+@receiver(post_delete, sender=Author)
+def bump_author_versions_on_delete(sender, instance, **kwargs):
+    bump_versions([version_key('author', instance.pk), version_key(AUTHORS)])
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def bump_genre_versions(sender, instance, **kwargs):
+    bump_versions([version_key(GENRES)])
+
+
+@receiver(m2m_changed, sender=Book.genres.through)
+def bump_book_genre_versions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_versions([version_key('book', instance.pk)])
+    elif action in ('post_add', 'post_remove'):
+        bump_versions([version_key('book', book_id) for book_id in pk_set])
+    elif action == 'post_clear':
+        # Cheaper than finding the books beforehand, and rare
+        bump_versions([version_key(GENRES)])
+
+
+##########################################
+# GENRE INDEX
+##########################################
+@receiver(m2m_changed, sender=Book.genres.through)
+def update_genre_index(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove'):
+            genre_index.set_genres([instance.pk], pk_set, action == 'post_add')
+        elif action == 'post_clear':
+            genre_index.clear_books([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        genre_index.set_genres(pk_set, [instance.pk], action == 'post_add')
+    elif action == 'post_clear':
+        genre_index.clear_genre(instance.pk)
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_genre_index(sender, instance, **kwargs):
+    # The m2m rows are deleted along with the book without an m2m_changed signal.
+    genre_index.clear_books([instance.pk])
+
+
+@receiver(post_save, sender=Genre)
+def save_genre_in_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        genre_index.save_genre(instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Genre)
+def remove_genre_from_index(sender, instance, **kwargs):
+    genre_index.delete_genre(instance.pk)
+
+
+@receiver(connection_created)
+def record_queries_for_perf_middleware(sender, connection, **kwargs):
+    install_perf_wrapper(connection)
+
+
+@receiver(connection_created)
+def prepare_hot_statements(sender, connection, **kwargs):
+    # psycopg 3 prepares statements itself (see DB_PREPARE_THRESHOLD in settings)
+    if (settings.DB_PREPARE_THRESHOLD is not None and connection.vendor == 'postgresql'
+            and connection.Database.__name__ == 'psycopg2'):
+        install_statement_preparer(connection, settings.DB_PREPARE_THRESHOLD)
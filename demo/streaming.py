@@ -0,0 +1,24 @@
+from demo.models import Book
+
+# On PostgreSQL `.iterator()` runs over a named (server-side) cursor and fetches
+# `chunk_size` rows per round trip, so memory stays flat however big the table is.
+DEFAULT_CHUNK_SIZE = 2_000
+# Upper bound for chunk sizes taken from requests: one chunk is held in memory at a time
+MAX_CHUNK_SIZE = 20_000
+
+
+def iter_books_with_author_names(chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Streaming counterpart of get_books_with_author_names_select_related:
+    yields (title, author name) tuples without building model instances.
+    """
+    yield from Book.objects.values_list('title', 'author__name').iterator(chunk_size=chunk_size)
+
+
+def iter_books_with_author_info(chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Streaming counterpart of get_books_with_author_info_SELECT_RELATED. """
+    rows = (Book.objects
+            .order_by('title', 'author__name')
+            .values_list('title', 'author__name')
+            .iterator(chunk_size=chunk_size))
+    for (title, author_name) in rows:
+        yield f'{title} is by {author_name}'
@@ -1,3 +1,1202 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import threading
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, connections, router, transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+
+from demo.analytics import book_snapshot
+from demo.batching import STRATEGIES, fetch_in
+from demo.benchmark import command_module, get_query_set, run_benchmark
+from demo.cache import LRUCache, author_cache, book_cache
+from demo.genre_index import genre_index
+from demo.ingest import InvalidRow, parse_ndjson
+from demo.instrumentation import QueryBudgetExceeded, fingerprint, query_budget
+from demo.jobs import REPORTS, claim_job, purge_expired_jobs, request_report, requeue_stale_jobs, run_job
+from demo.models import Author, Book, Genre, LatestBook, ReportJob
+from demo.pagination import encode_cursor
+from demo.partitioning import (
+    book_partitioning, book_partitions, partition_book_table, refuse_partitioned_migrate, unpartition_book_table
+)
+from demo.perf import RequestProfile, RollingHistogram, perf_registry
+from demo.prepared import StatementPreparer, prepared_statements, to_server_placeholders
+from demo.routers import PIN_COOKIE, ReplicaLagMonitor, ReplicaPinMiddleware, lag_monitor
+from demo.seeding import seed
+from demo.views import perf_stats
+
+GOLDEN_DIR = Path(__file__).parent / 'golden_plans'
+# Big enough that the planner prefers the indexes the optimized variants rely
+# on, small enough that the N+1 variants stay quick.
+SEED_ROWS = 10_000
+QUERY_SET_SIZE = 200
+SCAN_TYPES = ('Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan')
+# Set to record the current plans as the new golden files
+UPDATE_GOLDEN = os.environ.get('DEMO_UPDATE_GOLDEN') == '1'
+
+
+def normalize_plan(plan):
+    """ One line per plan node with its shape only (node type, join type or
+    strategy, index and relation), dropping costs, row counts and timings.
+    """
+    def describe(node, depth):
+        line = node['Node Type']
+        qualifier = node.get('Join Type') or node.get('Strategy')
+        if qualifier:
+            line += f' ({qualifier})'
+        if 'Index Name' in node:
+            line += f' using {node["Index Name"]}'
+        if 'Relation Name' in node:
+            line += f' on {node["Relation Name"]}'
+        lines = ['  ' * depth + line]
+        for child in node.get('Plans', []):
+            lines += describe(child, depth + 1)
+        return lines
+
+    root = plan[0]['Plan'] if isinstance(plan, list) else plan['Plan']
+    return describe(root, 0)
+
+
+def scans(plan_lines):
+    """ {relation: set of scan node types} for a normalized plan. """
+    found = {}
+    for line in plan_lines:
+        line = line.strip()
+        if ' on ' in line and line.startswith(SCAN_TYPES):
+            scan_type = next(scan_type for scan_type in SCAN_TYPES if line.startswith(scan_type))
+            found.setdefault(line.rsplit(' on ', 1)[1], set()).add(scan_type)
+    return found
+
+
+def capture(case):
+    """ Runs a case once warm and returns its query count and the SQL and
+    normalized plan of its first few distinct statements.
+    """
+    result = run_benchmark(case.func, case.args, warmup=1, trials=1, explain=True, name=case.name)
+    return {
+        'queries': result.queries,
+        'statements': [
+            {'sql': fingerprint(explain['sql']), 'plan': normalize_plan(explain['plan'])}
+            for explain in result.explains
+        ],
+    }
+
+
+class QueryPlanRegressionTests(TestCase):
+    """ Compares each function in the demo, optimize_me and challenge commands
+    against demo/golden_plans/<case>.json, failing when it issues more queries
+    than recorded, or when a table it used to reach through an index is now
+    sequentially scanned. Needs PostgreSQL.
+
+    A case without a golden file fails. Record new cases, or re-record after
+    an intended change, with
+    DEMO_UPDATE_GOLDEN=1 python manage.py test demo
+    and commit the files.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        seed(rows=SEED_ROWS)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        # In-process indexes built from other data (or never built)
+        genre_index.invalidate()
+        book_snapshot.load()
+
+    def setUp(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Query plans are only recorded for PostgreSQL')
+
+    def test_query_plans_match_golden_files(self):
+        for case in get_query_set(size=QUERY_SET_SIZE):
+            with self.subTest(case=case.name):
+                # A savepoint per case, so one failing query doesn't abort the rest
+                with transaction.atomic():
+                    actual = capture(case)
+                path = GOLDEN_DIR / f'{case.name}.json'
+                if UPDATE_GOLDEN:
+                    path.write_text(json.dumps(actual, indent=2) + '\n')
+                    continue
+                if not path.exists():
+                    self.fail(f'{path.name} is missing; record it with DEMO_UPDATE_GOLDEN=1')
+                self.assert_no_regression(case.name, json.loads(path.read_text()), actual)
+
+    def assert_no_regression(self, name, golden, actual):
+        self.assertLessEqual(
+            actual['queries'], golden['queries'],
+            f'{name} now issues {actual["queries"]} queries instead of {golden["queries"]}'
+        )
+        self.assertEqual(
+            [statement['sql'] for statement in actual['statements']],
+            [statement['sql'] for statement in golden['statements']],
+            f'{name} issues different SQL'
+        )
+        for (golden_statement, actual_statement) in zip(golden['statements'], actual['statements']):
+            golden_scans = scans(golden_statement['plan'])
+            for (relation, scan_types) in scans(actual_statement['plan']).items():
+                previously = golden_scans.get(relation, set())
+                if 'Seq Scan' in scan_types and previously and 'Seq Scan' not in previously:
+                    self.fail(
+                        f'{name} now sequentially scans {relation} instead of using '
+                        f'{", ".join(sorted(previously))}:\n' + '\n'.join(actual_statement['plan'])
+                    )
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_at_least_one_trial(self):
+        with self.assertRaises(ValueError):
+            run_benchmark(list, trials=0)
+        with self.assertRaisesMessage(CommandError, 'must be at least 1, not 0'):
+            call_command('benchmark', '--trials=0')
+
+
+##########################################
+# QUERY BUDGET
+##########################################
+def create_authors_with_books(count):
+    """ `count` authors with one book each. Returns (author ids, book ids). """
+    authors = [Author.objects.create(name=f'Author {i}') for i in range(count)]
+    books = [
+        Book.objects.create(title=f'Book {i}', title_without_index=f'Book {i}', page_count=100, author=author)
+        for (i, author) in enumerate(authors)
+    ]
+    return ([author.id for author in authors], [book.id for book in books])
+
+
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        (cls.author_ids, cls.book_ids) = create_authors_with_books(12)
+
+    def setUp(self):
+        self.optimize_me = command_module('optimize_me')
+
+    def test_n_plus_one_functions_exceed_the_budget(self):
+        for func in [self.optimize_me.get_formatted_author_intros, self.optimize_me.get_book_intros]:
+            with self.subTest(func=func.__name__):
+                with self.assertRaisesRegex(QueryBudgetExceeded, 'Possible N\\+1'):
+                    with query_budget(repeat_threshold=10):
+                        func(self.author_ids if 'author' in func.__name__ else self.book_ids)
+
+    def test_optimized_functions_stay_within_the_budget(self):
+        for (func, ids) in [
+            (self.optimize_me.get_formatted_author_intros_OPTIMIZED_ANNOTATE, self.author_ids),
+            (self.optimize_me.get_formatted_author_intros_OPTIMIZED_DENORMALIZED, self.author_ids),
+            (self.optimize_me.get_book_intros_OPTIMIZED_SELECT_RELATED, self.book_ids),
+            (self.optimize_me.get_book_intros_OPTIMIZED_ANNOTATE, self.book_ids),
+        ]:
+            with self.subTest(func=func.__name__):
+                with query_budget(max_queries=1, repeat_threshold=1) as budget:
+                    self.assertEqual(len(func(ids)), 12)
+                self.assertEqual(budget.total, 1)
+
+    def test_max_queries(self):
+        with self.assertRaisesRegex(QueryBudgetExceeded, '2 queries exceeded the budget of 1'):
+            with query_budget(max_queries=1):
+                Author.objects.count()
+                Book.objects.count()
+
+    def test_log_action_does_not_raise(self):
+        with self.assertLogs('demo.instrumentation', 'WARNING'):
+            with query_budget(max_queries=0, action='log'):
+                Author.objects.count()
+
+    def test_nested_entries_of_one_instance_count_separately(self):
+        budget = query_budget(max_queries=2)
+
+        @budget
+        def count(depth):
+            Author.objects.count()
+            if depth:
+                count(depth - 1)
+
+        with self.assertRaisesRegex(QueryBudgetExceeded, '3 queries exceeded the budget of 2'):
+            count(2)
+        # The inner entries (1 and 2 queries) stayed within the budget
+        count(1)
+        self.assertEqual(budget.total, 2)
+
+    def test_threads_count_their_own_queries(self):
+        budget = query_budget(max_queries=1)
+        (a_entered, b_entered, a_exited) = (threading.Event(), threading.Event(), threading.Event())
+        outcomes = {}
+
+        def a():
+            try:
+                with budget:
+                    Author.objects.count()
+                    a_entered.set()
+                    b_entered.wait(5)
+            finally:
+                a_exited.set()
+
+        def b():
+            a_entered.wait(5)
+            with budget:
+                b_entered.set()
+                # A leaves first, while B is still inside
+                a_exited.wait(5)
+                Author.objects.count()
+                Author.objects.count()
+
+        def run(name, body):
+            try:
+                body()
+                outcomes[name] = 'within budget'
+            except QueryBudgetExceeded as e:
+                outcomes[name] = str(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(name, body)) for (name, body) in [('a', a), ('b', b)]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(outcomes, {'a': 'within budget', 'b': '2 queries exceeded the budget of 1'})
+
+
+##########################################
+# AUTHOR BOOK COUNTS
+##########################################
+def create_book(title, author, **fields):
+    fields.setdefault('page_count', 100)
+    return Book.objects.create(title=title, title_without_index=title, author=author, **fields)
+
+
+class BookCountTests(TestCase):
+    def setUp(self):
+        self.tolkien = Author.objects.create(name='JRR Tolkien')
+        self.achebe = Author.objects.create(name='Chinua Achebe')
+
+    def book_counts(self):
+        authors = Author.objects.filter(id__in=[self.tolkien.id, self.achebe.id])
+        return {author.name: author.book_count for author in authors}
+
+    def test_create_and_delete(self):
+        hobbit = create_book('The Hobbit', self.tolkien)
+        create_book('Return of the King', self.tolkien)
+        self.assertEqual(self.book_counts(), {'JRR Tolkien': 2, 'Chinua Achebe': 0})
+        hobbit.delete()
+        self.assertEqual(self.book_counts(), {'JRR Tolkien': 1, 'Chinua Achebe': 0})
+
+    def test_reassignment(self):
+        book = create_book('Things Fall Apart', self.tolkien)
+        book.author = self.achebe
+        book.save()
+        self.assertEqual(self.book_counts(), {'JRR Tolkien': 0, 'Chinua Achebe': 1})
+        # Saving again without a change adjusts nothing
+        book.save()
+        self.assertEqual(self.book_counts(), {'JRR Tolkien': 0, 'Chinua Achebe': 1})
+
+    def test_delete_after_drift_does_not_go_negative(self):
+        book = create_book('The Hobbit', self.tolkien)
+        Author.objects.filter(id=self.tolkien.id).update(book_count=0)
+        book.delete()
+        self.assertEqual(self.book_counts()['JRR Tolkien'], 0)
+
+    def test_repair_book_counts(self):
+        Book.objects.bulk_create([
+            Book(title=title, title_without_index=title, page_count=100, author=self.achebe)
+            for title in ['Things Fall Apart', 'No Longer at Ease']
+        ])
+        Author.objects.filter(id=self.tolkien.id).update(book_count=5)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            call_command('repair_book_counts')
+        self.assertIn('Repaired book_count for 2 author(s)', out.getvalue())
+        self.assertEqual(self.book_counts(), {'JRR Tolkien': 0, 'Chinua Achebe': 2})
+        self.assertEqual(Author.refresh_book_counts(), 0)
+
+
+##########################################
+# MODEL CACHE
+##########################################
+class LRUCacheTests(SimpleTestCase):
+    def test_get_set_delete(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+
+    def test_evicts_the_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_entries_expire(self):
+        cache = LRUCache(timeout=5)
+        with mock.patch('demo.cache.monotonic', return_value=100):
+            cache.set('a', 1)
+        with mock.patch('demo.cache.monotonic', return_value=104):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('demo.cache.monotonic', return_value=106):
+            self.assertIsNone(cache.get('a'))
+
+    def test_zero_size_caches_nothing(self):
+        cache = LRUCache(max_size=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class ModelCacheTests(TransactionTestCase):
+    """ Against real commits and rollbacks, which TestCase would wrap in its own transaction. """
+    def setUp(self):
+        caches['default'].clear()
+        book_cache.local.clear()
+        author_cache.local.clear()
+        self.author = Author.objects.create(name='Han Kang')
+        self.genre = Genre.objects.create(name='Lit Fic')
+        self.book = create_book('The Vegetarian', self.author)
+        self.book.genres.add(self.genre)
+
+    def cached_title(self):
+        return book_cache.get(self.book.id).title
+
+    def test_miss_then_hit(self):
+        with self.assertNumQueries(2):
+            book = book_cache.get(self.book.id)
+        self.assertEqual((book.author.name, [genre.name for genre in book.genres.all()]), ('Han Kang', ['Lit Fic']))
+        with self.assertNumQueries(0):
+            book_cache.get(self.book.id)
+        # The shared tier still has it
+        book_cache.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(book_cache.get_many([self.book.id]).keys(), {self.book.id})
+
+    def test_get_by_lookup_field(self):
+        self.assertEqual(book_cache.get_by('The Vegetarian').id, self.book.id)
+        with self.assertNumQueries(0):
+            book_cache.get_by('The Vegetarian')
+        self.assertIsNone(book_cache.get_by('Human Acts'))
+
+    def test_save_and_delete_invalidate(self):
+        self.cached_title()
+        self.book.title = 'Human Acts'
+        self.book.save()
+        self.assertEqual(self.cached_title(), 'Human Acts')
+        self.assertIsNone(book_cache.get_by('The Vegetarian'))
+        self.book.delete()
+        self.assertIsNone(book_cache.get(self.book.id))
+
+    def test_invalidates_again_on_commit(self):
+        stale = book_cache.get(self.book.id)
+        with transaction.atomic():
+            self.book.title = 'Human Acts'
+            self.book.save()
+            # A reader in another process re-caches the still committed old row
+            book_cache.local.set(book_cache.key(self.book.id), stale)
+            book_cache.shared.set(book_cache.key(self.book.id), stale)
+            self.assertEqual(self.cached_title(), 'The Vegetarian')
+        self.assertEqual(self.cached_title(), 'Human Acts')
+
+    def test_rollback_leaves_no_uncommitted_row_cached(self):
+        self.cached_title()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.book.title = 'Human Acts'
+            self.book.save()
+            self.assertEqual(self.cached_title(), 'Human Acts')
+            raise RuntimeError('roll back')
+        self.assertEqual(self.cached_title(), 'The Vegetarian')
+
+    def test_author_change_invalidates_books(self):
+        self.cached_title()
+        self.author.name = 'Kang Han'
+        self.author.save()
+        self.assertEqual(book_cache.get(self.book.id).author.name, 'Kang Han')
+        self.assertEqual(author_cache.get(self.author.id).name, 'Kang Han')
+
+    def test_genre_rename_and_delete_invalidate_books(self):
+        book_cache.get(self.book.id)
+        self.genre.name = 'Literary Fiction'
+        self.genre.save()
+        self.assertEqual([genre.name for genre in book_cache.get(self.book.id).genres.all()], ['Literary Fiction'])
+        self.genre.delete()
+        self.assertEqual(list(book_cache.get(self.book.id).genres.all()), [])
+
+
+##########################################
+# PAGINATION
+##########################################
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author McAuthor')
+        for title in ['Apple Book', 'Banana Book', 'Pear Book']:
+            create_book(title, author)
+
+    def test_pages_follow_the_cursor(self):
+        titles = []
+        url = '/demo/books/?limit=2'
+        while url:
+            page = self.client.get(url).json()
+            titles += [book['title'] for book in page['results']]
+            url = page['next']
+        self.assertEqual(titles, ['Apple Book', 'Banana Book', 'Pear Book'])
+
+    def test_cursors_that_do_not_fit_are_rejected(self):
+        for (url, cursor) in [
+            ('/demo/books/', 'not base64 json'),
+            ('/demo/books/', encode_cursor(['Apple Book'])),
+            ('/demo/books/', encode_cursor([None, 5])),
+            ('/demo/books/', encode_cursor(['Apple Book', [5]])),
+            ('/demo/books/', encode_cursor(['Apple Book', 'abc'])),
+            ('/demo/authors/', encode_cursor(['abc'])),
+            ('/demo/authors/', encode_cursor([True])),
+            ('/demo/async/authors/', encode_cursor(['abc'])),
+            ('/demo/books/search/?q=book', encode_cursor(['abc', 1])),
+            ('/demo/books/search/?q=book', encode_cursor([{}, 1])),
+            ('/demo/catalogue/books/', encode_cursor([None, 5])),
+            ('/demo/catalogue/authors/', encode_cursor(['abc'])),
+        ]:
+            with self.subTest(url=url, cursor=cursor):
+                separator = '&' if '?' in url else '?'
+                response = self.client.get(f'{url}{separator}after={cursor}')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.content, b'Malformed cursor')
+
+
+##########################################
+# LATEST BOOKS
+##########################################
+class LatestBookTests(TestCase):
+    def setUp(self):
+        self.tolkien = Author.objects.create(name='JRR Tolkien')
+        self.achebe = Author.objects.create(name='Chinua Achebe')
+        self.hobbit = create_book('The Hobbit', self.tolkien, publication_date=date(1937, 9, 21))
+        self.king = create_book('Return of the King', self.tolkien, publication_date=date(1955, 10, 20))
+
+    def latest(self):
+        return dict(LatestBook.objects.values_list('author__name', 'book__title'))
+
+    def assert_matches_rebuild(self):
+        incremental = self.latest()
+        LatestBook.rebuild()
+        self.assertEqual(self.latest(), incremental)
+
+    def test_insert(self):
+        self.assertEqual(self.latest(), {'JRR Tolkien': 'Return of the King'})
+        create_book('Things Fall Apart', self.achebe, publication_date=date(1958, 1, 1))
+        create_book('The Silmarillion', self.tolkien, publication_date=date(1977, 9, 15))
+        self.assertEqual(self.latest(), {'JRR Tolkien': 'The Silmarillion', 'Chinua Achebe': 'Things Fall Apart'})
+        self.assert_matches_rebuild()
+
+    def test_delete(self):
+        self.king.delete()
+        self.assertEqual(self.latest(), {'JRR Tolkien': 'The Hobbit'})
+        self.hobbit.delete()
+        self.assertEqual(self.latest(), {})
+        self.assert_matches_rebuild()
+
+    def test_reassignment(self):
+        self.king.author = self.achebe
+        self.king.save()
+        self.assertEqual(self.latest(), {'JRR Tolkien': 'The Hobbit', 'Chinua Achebe': 'Return of the King'})
+        self.assert_matches_rebuild()
+
+    def test_publication_date_change(self):
+        hobbit = Book.objects.get(id=self.hobbit.id)
+        hobbit.publication_date = date(2000, 1, 1)
+        hobbit.save()
+        self.assertEqual(self.latest(), {'JRR Tolkien': 'The Hobbit'})
+        self.assert_matches_rebuild()
+
+    def test_other_changes_skip_the_refresh(self):
+        hobbit = Book.objects.get(id=self.hobbit.id)
+        hobbit.page_count = 310
+        with CaptureQueriesContext(connection) as queries:
+            hobbit.save()
+        self.assertFalse([query for query in queries if LatestBook._meta.db_table in query['sql']])
+
+
+##########################################
+# BATCHED LOOKUPS
+##########################################
+class FetchInTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author McAuthor')
+        cls.ids = [create_book(f'Book {i}', author).id for i in range(5)]
+
+    def test_strategies_return_the_same_rows_in_key_order(self):
+        (a, b, c, missing) = (self.ids[3], self.ids[0], self.ids[1], max(self.ids) + 1)
+        keys = [a, b, missing, a, c]
+        for strategy in STRATEGIES:
+            for chunk_size in [None, 2]:
+                with self.subTest(strategy=strategy, chunk_size=chunk_size):
+                    books = fetch_in(Book.objects.all(), 'id', keys, strategy=strategy, chunk_size=chunk_size)
+                    self.assertEqual([book.id for book in books], [a, b, a, c])
+                    rows = fetch_in(Book.objects.values('title'), 'title', ['Book 4', 'Book 9', 'Book 2'],
+                                    strategy=strategy, chunk_size=chunk_size)
+                    self.assertEqual(list(rows), [{'title': 'Book 4'}, {'title': 'Book 2'}])
+
+    def test_values_list_needs_a_key(self):
+        queryset = Book.objects.values_list('id', 'title')
+        with self.assertRaises(ValueError):
+            list(fetch_in(queryset, 'id', self.ids))
+        rows = fetch_in(queryset, 'id', self.ids[:2], key=lambda row: row[0])
+        self.assertEqual([row[1] for row in rows], ['Book 0', 'Book 1'])
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            list(fetch_in(Book.objects.all(), 'id', self.ids, strategy='join'))
+
+
+class ConcurrentFetchInTests(TransactionTestCase):
+    """ The workers' own connections only see committed rows. """
+    def setUp(self):
+        author = Author.objects.create(name='Author McAuthor')
+        self.ids = [create_book(f'Book {i}', author).id for i in range(10)]
+
+    def test_workers_return_the_same_rows(self):
+        keys = self.ids[::-1] + self.ids[:3]
+        serial = [book.id for book in fetch_in(Book.objects.all(), 'id', keys, chunk_size=3)]
+        concurrent = [book.id for book in fetch_in(Book.objects.all(), 'id', keys, chunk_size=3, workers=3)]
+        self.assertEqual((serial, concurrent), (keys, keys))
+
+    def test_abandoning_the_generator_stops_the_workers(self):
+        from demo.batching import _filter
+        (fetched, released) = ([], threading.Event())
+
+        def filter_chunk(queryset, field, keys, strategy):
+            fetched.append(keys)
+            if keys != self.ids[:1]:
+                released.wait(5)
+            return _filter(queryset, field, keys, strategy)
+
+        running = set(threading.enumerate())
+        with mock.patch('demo.batching._filter', filter_chunk):
+            books = fetch_in(Book.objects.all(), 'id', self.ids, chunk_size=1, workers=2)
+            self.assertEqual(next(books).id, self.ids[0])
+            books.close()
+            released.set()
+            for thread in set(threading.enumerate()) - running:
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+        # The first chunk and at most one more per worker
+        self.assertLessEqual(len(fetched), 3)
+
+
+##########################################
+# GENRE INDEX
+##########################################
+class GenreIndexTests(TransactionTestCase):
+    """ The index applies updates on commit, which TestCase never reaches. """
+    def setUp(self):
+        genre_index.invalidate()
+        author = Author.objects.create(name='Ursula K. Le Guin')
+        self.fantasy = Genre.objects.create(name='Fantasy')
+        self.scifi = Genre.objects.create(name='Science fiction')
+        self.earthsea = create_book('A Wizard of Earthsea', author)
+        self.dispossessed = create_book('The Dispossessed', author)
+        self.earthsea.genres.add(self.fantasy)
+
+    def assert_matches_orm(self):
+        for names in [['Fantasy'], ['Science fiction'], ['Fantasy', 'Science fiction'], ['Poetry'], ['Utopia']]:
+            with self.subTest(names=names):
+                expected = Book.objects.filter(genres__name__in=names).values_list('id', flat=True)
+                self.assertEqual(list(genre_index.books_in(names)), sorted(set(expected)))
+
+    def test_lookups_match_the_orm_after_adding_and_removing_genres(self):
+        self.assert_matches_orm()
+        self.dispossessed.genres.add(self.scifi, self.fantasy)
+        self.assert_matches_orm()
+        self.dispossessed.genres.remove(self.fantasy)
+        self.assert_matches_orm()
+        self.scifi.book_set.add(self.earthsea)
+        self.assert_matches_orm()
+        newer = create_book('The Lathe of Heaven', self.earthsea.author)
+        newer.genres.add(Genre.objects.create(name='Utopia'), self.scifi)
+        self.assert_matches_orm()
+        self.scifi.book_set.clear()
+        self.assert_matches_orm()
+        self.fantasy.delete()
+        self.assert_matches_orm()
+
+    def test_updates_leave_earlier_snapshots_alone(self):
+        (matrix, genre_ids, names) = genre_index._current()
+        before = (matrix.copy(), list(genre_ids), dict(names))
+        self.earthsea.genres.clear()
+        self.dispossessed.genres.add(Genre.objects.create(name='Utopia'), self.scifi)
+        self.scifi.delete()
+        self.assertEqual(list(genre_index.books_in(['Utopia'])), [self.dispossessed.id])
+        self.assertTrue((matrix == before[0]).all())
+        self.assertEqual((genre_ids, names), before[1:])
+
+
+##########################################
+# IMPORT
+##########################################
+NDJSON_BOOK = json.dumps({
+    'title': 'Things Fall Apart', 'author_name': 'Chinua Achebe', 'page_count': 209, 'genres': ['Lit Fic'],
+}) + '\n'
+
+
+class ImportTests(TestCase):
+    def test_parse_ndjson(self):
+        [row] = parse_ndjson([NDJSON_BOOK])
+        self.assertEqual((row.title, row.author_name, row.page_count, row.genre_names),
+                         ('Things Fall Apart', 'Chinua Achebe', 209, ['Lit Fic']))
+
+    def test_invalid_genres_are_invalid_rows(self):
+        for genres in ['5', '{"name": "Lit Fic"}', '[5]', '["' + 'x' * 300 + '"]']:
+            with self.subTest(genres=genres):
+                line = f'{{"title": "T", "author_name": "A", "page_count": 1, "genres": {genres}}}'
+                with self.assertRaisesRegex(InvalidRow, 'line 1: .*genre'):
+                    list(parse_ndjson([line]))
+
+    def post(self, client=None, body=NDJSON_BOOK, **headers):
+        return (client or self.client).post('/demo/books/import/', body, content_type='application/x-ndjson',
+                                            **headers)
+
+    def test_anonymous_requests_are_forbidden(self):
+        self.assertEqual(self.post().status_code, 403)
+        with self.settings(DEMO_IMPORT_TOKEN='secret'):
+            self.assertEqual(self.post(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertFalse(Book.objects.exists())
+
+    def test_bearer_token(self):
+        with self.settings(DEMO_IMPORT_TOKEN='secret'):
+            response = self.post(HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual((response.status_code, response.json()['rows']), (200, 1))
+        self.assertEqual(Book.objects.get().genres.get().name, 'Lit Fic')
+
+    def test_staff_sessions_need_a_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.post(client).status_code, 403)
+        client.cookies['csrftoken'] = 'a' * 32
+        self.assertEqual(self.post(client, HTTP_X_CSRFTOKEN='a' * 32).status_code, 200)
+
+    def test_invalid_rows_are_bad_requests(self):
+        with self.settings(DEMO_IMPORT_TOKEN='secret'):
+            response = self.post(body='{"title": "T", "author_name": "A", "page_count": 1, "genres": 5}\n',
+                                 HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 400)
+
+
+##########################################
+# PREPARED STATEMENTS
+##########################################
+class FakeDatabaseConnection:
+    """ Stands in for the DB-API connection _states is keyed by. """
+
+
+class StatementPreparerTests(TestCase):
+    SQL = 'SELECT "title" FROM "demo_book" WHERE "id" = %s'
+
+    def setUp(self):
+        self.executed = []
+        self.fail_prepare = False
+        self.context = {
+            'connection': mock.Mock(vendor='postgresql', connection=FakeDatabaseConnection(), alias='default'),
+            'cursor': mock.Mock(cursor=mock.Mock(spec=[])),
+        }
+
+    def execute(self, sql, params, many, context):
+        if self.fail_prepare and sql.startswith('PREPARE'):
+            raise DatabaseError('could not determine data type of parameter $1')
+        self.executed.append(sql)
+
+    def call(self, preparer, sql=SQL, params=(7,), times=1, many=False):
+        for _ in range(times):
+            preparer(self.execute, sql, list(params), many, self.context)
+
+    def test_placeholders(self):
+        self.assertEqual(
+            to_server_placeholders('WHERE "title" = %s AND "id" IN (%s, %s) AND "title" LIKE \'a%%\''),
+            ('WHERE "title" = $1 AND "id" IN ($2, $3) AND "title" LIKE \'a%\'', 3)
+        )
+        self.assertEqual(to_server_placeholders('SELECT 1'), ('SELECT 1', 0))
+
+    def test_prepares_on_the_threshold_and_executes_afterwards(self):
+        preparer = StatementPreparer(threshold=3)
+        self.call(preparer, times=2)
+        self.assertEqual(self.executed, [self.SQL] * 2)
+        self.call(preparer, times=2)
+        name = self.executed[2].split()[1]
+        self.assertEqual(self.executed[2:], [
+            f'PREPARE {name} AS SELECT "title" FROM "demo_book" WHERE "id" = $1',
+            f'EXECUTE {name}(%s)',
+            f'EXECUTE {name}(%s)',
+        ])
+
+    def test_statements_left_alone(self):
+        preparer = StatementPreparer(threshold=1)
+        self.call(preparer, sql='UPDATE "demo_book" SET "page_count" = %s')
+        self.call(preparer, params=())
+        self.call(preparer, many=True)
+        self.context['cursor'].cursor = mock.Mock(spec=['name'])
+        self.context['cursor'].cursor.name = 'named_cursor'
+        self.call(preparer)
+        self.assertFalse([sql for sql in self.executed if sql.startswith(('PREPARE', 'EXECUTE'))])
+
+    def test_parameter_count_mismatch_is_never_prepared(self):
+        preparer = StatementPreparer(threshold=1)
+        self.call(preparer, params=(7, 8), times=3)
+        self.assertEqual(self.executed, [self.SQL] * 3)
+
+    def test_failed_prepare_is_not_retried(self):
+        preparer = StatementPreparer(threshold=1)
+        self.fail_prepare = True
+        self.call(preparer, times=3)
+        self.assertEqual(self.executed, [self.SQL] * 3)
+
+    def test_evicts_the_least_recently_used(self):
+        preparer = StatementPreparer(threshold=1, max_prepared=2)
+        (a, b, c) = [f'{self.SQL} AND {column} > 0' for column in ('"page_count"', '"author_id"', '"id"')]
+        self.call(preparer, sql=a)
+        self.call(preparer, sql=b)
+        self.call(preparer, sql=a)
+        name_b = self.executed[2].split()[1]
+        self.executed.clear()
+        self.call(preparer, sql=c)
+        self.assertEqual(self.executed[0], f'DEALLOCATE {name_b}')
+        self.assertTrue(self.executed[1].startswith('PREPARE'))
+        self.executed.clear()
+        self.call(preparer, sql=a)
+        self.assertEqual(len(self.executed), 1)
+        self.assertTrue(self.executed[0].startswith('EXECUTE'))
+
+    def test_against_the_database(self):
+        author = Author.objects.create(name='Han Kang')
+        book = create_book('The Vegetarian', author)
+        with prepared_statements(threshold=2):
+            titles = [Book.objects.filter(id=book.id).values_list('title', flat=True).get() for _ in range(4)]
+        self.assertEqual(titles, ['The Vegetarian'] * 4)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_prepared_statements WHERE name LIKE 'demo\\_%%'")
+            self.assertGreaterEqual(cursor.fetchone()[0], 1)
+
+
+##########################################
+# CATALOGUE PAGES
+##########################################
+class CataloguePageCacheTests(TransactionTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.genre = Genre.objects.create(name='Fable')
+        self.book = create_book('Animal Farm', Author.objects.create(name='George Orwell'))
+        self.book.genres.add(self.genre)
+
+    def get(self, **headers):
+        return Client().get('/demo/catalogue/books/', headers=headers)
+
+    def test_warm_page_is_served_without_queries(self):
+        first = self.get()
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            second = self.get()
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(if_none_match=first['ETag']).status_code, 304)
+
+    def test_genre_rename_changes_the_etag(self):
+        etag = self.get()['ETag']
+        self.genre.name = 'Satire'
+        self.genre.save()
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'(Satire)', response.content)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.get(if_none_match=response['ETag']).status_code, 304)
+
+
+##########################################
+# REPORT JOBS
+##########################################
+def age_job(job, **fields):
+    """ Moves `fields` of `job` an hour into the past. """
+    ReportJob.objects.filter(id=job.id).update(
+        **{field: timezone.now() - timedelta(hours=1) for field in fields}
+    )
+
+
+class ReportJobTests(TestCase):
+    def test_requests_are_coalesced(self):
+        job = request_report('prize_candidates')
+        self.assertEqual(request_report('prize_candidates').id, job.id)
+        self.assertNotEqual(request_report('prize_candidates', {'genre': 'Fable'}).id, job.id)
+        with self.assertRaises(ValueError):
+            request_report('everything')
+
+    def test_one_active_job_per_key(self):
+        job = request_report('prize_candidates')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReportJob.objects.create(report=job.report, params=job.params, key=job.key)
+        # Finished jobs are outside the partial unique index
+        ReportJob.objects.create(report=job.report, params=job.params, key=job.key, status=ReportJob.Status.DONE)
+
+    def test_result_is_served_until_it_expires(self):
+        author = Author.objects.create(name='Ursula K. Le Guin')
+        create_book('Rocannon\'s World', author, publication_date=date(1966, 1, 1))
+        create_book('The Dispossessed', author, publication_date=date(1974, 1, 1))
+        job = request_report('prize_candidates')
+        claimed = claim_job('worker-1')
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts), (job.id, ReportJob.Status.RUNNING, 1))
+        self.assertIsNone(claim_job('worker-2'))
+        self.assertTrue(run_job(claimed))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (ReportJob.Status.DONE, ['Rocannon\'s World']))
+        self.assertEqual(request_report('prize_candidates').id, job.id)
+
+        age_job(job, expires_at=True)
+        fresh = request_report('prize_candidates')
+        self.assertNotEqual(fresh.id, job.id)
+        self.assertEqual(fresh.status, ReportJob.Status.PENDING)
+        self.assertEqual(purge_expired_jobs(), 1)
+        self.assertFalse(ReportJob.objects.filter(id=job.id).exists())
+
+    def test_failures_fail_the_job(self):
+        def broken():
+            raise ValueError('no such shelf')
+
+        reports = {'prize_candidates': broken, 'author_intros': lambda: {'not', 'json'}}
+        with mock.patch.dict(REPORTS, reports):
+            for report in reports:
+                job = request_report(report)
+                with self.assertLogs('demo.jobs', 'ERROR'):
+                    self.assertFalse(run_job(claim_job('worker-1')))
+                job.refresh_from_db()
+                self.assertEqual(job.status, ReportJob.Status.FAILED)
+                self.assertIsNone(job.result)
+        self.assertIn('ValueError: no such shelf', ReportJob.objects.get(report='prize_candidates').error)
+        self.assertIn('is not JSON serializable', ReportJob.objects.get(report='author_intros').error)
+
+    def test_stale_jobs_are_requeued_then_failed(self):
+        job = request_report('prize_candidates')
+        claim_job('worker-1')
+        self.assertEqual(requeue_stale_jobs(timeout=60, max_attempts=2), (0, 0))
+        age_job(job, started_at=True)
+        self.assertEqual(requeue_stale_jobs(timeout=60, max_attempts=2), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (ReportJob.Status.PENDING, ''))
+
+        self.assertEqual(claim_job('worker-2').attempts, 2)
+        age_job(job, started_at=True)
+        self.assertEqual(requeue_stale_jobs(timeout=60, max_attempts=2), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.Status.FAILED)
+
+    def test_outcome_of_a_requeued_run_is_discarded(self):
+        job = request_report('prize_candidates')
+        first = claim_job('worker-1')
+        age_job(job, started_at=True)
+        requeue_stale_jobs(timeout=60)
+        second = claim_job('worker-2')
+        with self.assertLogs('demo.jobs', 'WARNING') as logs:
+            self.assertFalse(run_job(first))
+        self.assertIn('outcome is discarded', logs.output[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (ReportJob.Status.RUNNING, 'worker-2'))
+        self.assertTrue(run_job(second))
+
+
+class ClaimJobTests(TransactionTestCase):
+    def test_locked_jobs_are_skipped(self):
+        first = request_report('prize_candidates')
+        second = request_report('author_intros')
+        claimed = []
+
+        def claim():
+            try:
+                claimed.append(claim_job('worker-2'))
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            # Another worker is claiming the oldest job
+            ReportJob.objects.select_for_update().get(id=first.id)
+            thread = threading.Thread(target=claim)
+            thread.start()
+            thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([job.id for job in claimed], [second.id])
+        self.assertEqual(claim_job('worker-1').id, first.id)
+
+
+##########################################
+# READ REPLICAS
+##########################################
+REPLICA = 'replica_1'
+# A second connection standing in for a replica, like DB_REPLICAS=/demodb_replica
+# configures; as a test mirror it is pointed at the primary's test database
+connections.settings.setdefault(REPLICA, {
+    **connections.settings['default'],
+    'TEST': {**connections.settings['default']['TEST'], 'MIRROR': 'default'},
+})
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """ Routing between the primary and REPLICA, whose lag is patched. """
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        self.lags = {REPLICA: 0}
+        patcher = mock.patch.object(lag_monitor, 'lag', side_effect=lambda alias: self.lags[alias])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # As mysite/settings.py configures them when DB_REPLICAS is set
+        routing = override_settings(
+            DB_REPLICAS=[REPLICA], DATABASE_ROUTERS=['demo.routers.ReplicaRouter'],
+            MIDDLEWARE=[settings.MIDDLEWARE[0], 'demo.routers.ReplicaPinMiddleware', *settings.MIDDLEWARE[1:]]
+        )
+        routing.enable()
+        self.addCleanup(routing.disable)
+
+    def route(self, view, cookies=None):
+        """ Runs `view` behind ReplicaPinMiddleware; it returns what to respond with. """
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        return ReplicaPinMiddleware(lambda request: HttpResponse(view()))(request)
+
+    def test_reads_go_to_a_fresh_replica(self):
+        self.assertEqual(self.route(lambda: router.db_for_read(Book)).content, REPLICA.encode())
+        self.assertEqual(self.route(lambda: router.db_for_read(ReportJob)).content, b'default')
+
+    def test_falls_back_to_the_primary_when_replicas_are_behind_or_down(self):
+        for lag in (6, float('inf')):
+            self.lags[REPLICA] = lag
+            self.assertEqual(self.route(lambda: router.db_for_read(Book)).content, b'default')
+
+    def test_writes_pin_the_request_and_the_client(self):
+        def write_then_read():
+            router.db_for_write(Book)
+            return router.db_for_read(Book)
+
+        response = self.route(write_then_read)
+        self.assertEqual(response.content, b'default')
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.DB_REPLICA_PIN_SECONDS)
+
+        pinned = self.route(lambda: router.db_for_read(Book), cookies={PIN_COOKIE: '1'})
+        self.assertEqual(pinned.content, b'default')
+        self.assertNotIn(PIN_COOKIE, pinned.cookies)
+        self.assertEqual(self.route(lambda: router.db_for_read(Book)).content, REPLICA.encode())
+
+    def test_stays_on_the_primary_in_transactions(self):
+        def read_in_transaction():
+            with transaction.atomic():
+                return router.db_for_read(Book)
+
+        self.assertEqual(self.route(read_in_transaction).content, b'default')
+
+    def test_requests_read_from_the_replica(self):
+        create_book('Kindred', Author.objects.create(name='Octavia E. Butler'))
+        with CaptureQueriesContext(connection) as primary, CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = Client().get('/demo/books/')
+        self.assertEqual([book['title'] for book in response.json()['results']], ['Kindred'])
+        self.assertEqual(len(primary), 0)
+        self.assertEqual(len(replica), 2)
+
+    def test_cache_fills_read_from_the_primary(self):
+        book = create_book('Dawn', Author.objects.create(name='Octavia E. Butler'))
+        book.genres.add(Genre.objects.create(name='Science fiction'))
+        book_cache.local.clear()
+        caches['default'].clear()
+        with CaptureQueriesContext(connections[REPLICA]) as replica:
+            self.route(lambda: [genre.name for genre in book_cache.get(book.id).genres.all()])
+            self.route(lambda: book_cache.get_by('Dawn').title)
+        self.assertEqual(len(replica), 0)
+
+
+class ReplicaLagMonitorTests(TestCase):
+    def test_a_database_that_is_not_a_standby_is_not_behind(self):
+        monitor = ReplicaLagMonitor()
+        self.assertEqual(monitor.lag('default'), 0)
+        with self.assertNumQueries(0):
+            monitor.lag('default')
+
+    def test_an_unreachable_replica_is_infinitely_behind(self):
+        monitor = ReplicaLagMonitor()
+        with mock.patch.object(connection, 'cursor', side_effect=OperationalError('connection refused')), \
+                self.assertLogs('demo.routers', 'WARNING'):
+            self.assertEqual(monitor.lag('default'), float('inf'))
+
+
+##########################################
+# PARTITIONING
+##########################################
+def book_table_schema():
+    """ The book table's indexes, constraints, identity sequence and the
+    foreign keys referencing it, as PostgreSQL reports them.
+    """
+    table = Book._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s', [table])
+        indexes = set(cursor.fetchall())
+        cursor.execute('''
+            SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = %s::regclass OR confrelid = %s::regclass
+        ''', [table, table])
+        constraints = set(cursor.fetchall())
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        (sequence,) = cursor.fetchone()
+    return {'indexes': indexes, 'constraints': constraints, 'sequence': sequence}
+
+
+class PartitioningTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(name='Italo Calvino')
+        self.book = create_book('Invisible Cities', self.author, publication_date=date(1972, 1, 1))
+        self.book.genres.add(Genre.objects.create(name='Fabulism'))
+        create_book('Cosmicomics', Author.objects.create(name='Calvino'), publication_date=date(1965, 1, 1))
+        # DDL cannot run on tables with foreign key checks still pending
+        connection.check_constraints()
+
+    def books(self):
+        return list(Book.objects.order_by('id').values_list('id', 'title', 'author_id', 'publication_date'))
+
+    def test_round_trip_keeps_rows_sequence_indexes_and_constraints(self):
+        (books, schema) = (self.books(), book_table_schema())
+        with connection.schema_editor() as editor:
+            partition_book_table(editor, 'author_hash', partitions=4)
+        with connection.cursor() as cursor:
+            self.assertEqual(book_partitioning(cursor), 'author_hash')
+            self.assertEqual(len(book_partitions(cursor)), 4)
+        self.assertEqual(self.books(), books)
+        partitioned = book_table_schema()
+        self.assertEqual(partitioned['sequence'], schema['sequence'])
+        self.assertEqual({name for (name, _) in partitioned['indexes']} - {'demo_book_pkey', 'book_author_title_uniq'},
+                         {name for (name, _) in schema['indexes']} - {'demo_book_pkey', 'book_author_title_uniq'})
+        self.assertIn(('demo_book', 'demo_book_pkey', 'PRIMARY KEY (id, author_id)'), partitioned['constraints'])
+        self.assertIn(('demo_book', 'book_author_title_uniq', 'UNIQUE (author_id, title)'), partitioned['constraints'])
+
+        with connection.schema_editor() as editor:
+            unpartition_book_table(editor)
+        self.assertEqual(self.books(), books)
+        self.assertEqual(book_table_schema(), schema)
+        self.assertGreater(create_book('The Baron in the Trees', self.author).id, books[-1][0])
+
+    def test_partitioned_table_keeps_upserts_and_references(self):
+        with connection.schema_editor() as editor:
+            partition_book_table(editor, 'author_hash', partitions=4)
+        Book.objects.bulk_create(
+            [Book(title='Invisible Cities', title_without_index='Invisible Cities', page_count=165,
+                  author=self.author)],
+            update_conflicts=True, unique_fields=['author', 'title'], update_fields=['page_count']
+        )
+        self.assertEqual(Book.objects.get(id=self.book.id).page_count, 165)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Book.genres.through.objects.create(book_id=0, genre=Genre.objects.get())
+            connection.check_constraints()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM demo_book WHERE id = %s', [self.book.id])
+            connection.check_constraints()
+        # The ORM deletes the references first
+        self.book.delete()
+        connection.check_constraints()
+
+    def test_migrations_are_refused_while_partitioned(self):
+        demo = apps.get_app_config('demo')
+        plan = [(mock.Mock(app_label='demo'), False)]
+        refuse_partitioned_migrate(demo, 'default', plan=plan)
+        with connection.schema_editor() as editor:
+            partition_book_table(editor, 'author_hash', partitions=4)
+        refuse_partitioned_migrate(demo, 'default', plan=[])
+        with self.assertRaisesMessage(CommandError, 'partition_books none'):
+            refuse_partitioned_migrate(demo, 'default', plan=plan)
+
+    def test_date_range_is_only_benchmarked(self):
+        with connection.schema_editor() as editor, self.assertRaises(ValueError):
+            partition_book_table(editor, 'date_range')
+
+
+##########################################
+# REQUEST PERFORMANCE
+##########################################
+def perf_probe(request):
+    """ An N+1 over the authors, then one statement slow enough to be the slowest. """
+    counts = [Book.objects.filter(author=author).count() for author in Author.objects.order_by('id')]
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_sleep(0.05)')
+    return HttpResponse(str(counts))
+
+
+urlpatterns = [
+    path('perf/', perf_probe, name='perf_probe'),
+    path('_perf', perf_stats, name='perf_stats'),
+]
+
+
+def profile_of(total_ms):
+    profile = RequestProfile()
+    profile.total_ms = total_ms
+    return profile
+
+
+@override_settings(ROOT_URLCONF='demo.tests', DEMO_PERF_SLOW_MS=10 ** 6, DEMO_PERF_LOG_SAMPLE_RATE=0)
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        perf_registry.clear()
+        create_authors_with_books(3)
+
+    def test_server_timing_and_histogram(self):
+        response = Client().get('/perf/')
+        timing = re.fullmatch(
+            r'total;dur=([\d.]+), db;dur=([\d.]+);desc="5 queries, 2 duplicates", db-slowest;dur=([\d.]+)',
+            response['Server-Timing']
+        )
+        self.assertIsNotNone(timing, response['Server-Timing'])
+        (total_ms, db_ms, slowest_ms) = map(float, timing.groups())
+        self.assertTrue(total_ms >= db_ms >= slowest_ms >= 50)
+
+        stats = Client().get('/_perf').json()['urls']
+        self.assertEqual(list(stats), ['perf_probe'])
+        self.assertEqual((stats['perf_probe']['requests'], stats['perf_probe']['mean_queries'],
+                          stats['perf_probe']['mean_duplicates']), (1, 5, 2))
+        self.assertEqual(sum(stats['perf_probe']['buckets'].values()), 1)
+
+    @override_settings(DEMO_PERF_SLOW_MS=10)
+    def test_slow_requests_are_logged_with_their_slowest_statement(self):
+        with self.assertLogs('demo.perf', 'INFO') as logs:
+            Client().get('/perf/')
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['url_name'], entry['queries'], entry['duplicates']), ('perf_probe', 5, 2))
+        self.assertEqual(entry['slowest_sql'], fingerprint('SELECT pg_sleep(0.05)'))
+        self.assertGreaterEqual(entry['slowest_ms'], 50)
+
+    def test_a_sample_of_requests_is_logged(self):
+        with mock.patch('demo.perf.random.random', return_value=0.5):
+            with override_settings(DEMO_PERF_LOG_SAMPLE_RATE=0.4), self.assertNoLogs('demo.perf', 'INFO'):
+                Client().get('/perf/')
+            with override_settings(DEMO_PERF_LOG_SAMPLE_RATE=0.6), self.assertLogs('demo.perf', 'INFO'):
+                Client().get('/perf/')
+
+
+class RollingHistogramTests(SimpleTestCase):
+    def test_percentiles_and_rollover(self):
+        histogram = RollingHistogram(bounds=(10, 100), slot_seconds=60, slots=2)
+        histogram.add(profile_of(5), now=0)
+        histogram.add(profile_of(50), now=60)
+        histogram.add(profile_of(500), now=61)
+        stats = histogram.snapshot(now=61)
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['buckets'], {'le_10': 1, 'le_100': 1, 'overflow': 1})
+        self.assertEqual((stats['p50_ms'], stats['p99_ms']), (100, None))
+        # The first slot falls out of the window, then the second
+        self.assertEqual(histogram.snapshot(now=120)['buckets'], {'le_10': 0, 'le_100': 1, 'overflow': 1})
+        self.assertIsNone(histogram.snapshot(now=180))
+        histogram.add(profile_of(5), now=180)
+        self.assertEqual(histogram.snapshot(now=180)['requests'], 1)
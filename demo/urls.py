@@ -4,4 +4,18 @@ from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
-]
\ No newline at end of file
+    path("books/", views.list_books, name="list_books"),
+    path("authors/", views.list_authors, name="list_authors"),
+    path("async/books/", views.alist_books, name="alist_books"),
+    path("async/authors/", views.alist_authors, name="alist_authors"),
+    path("books/stream/", views.stream_books, name="stream_books"),
+    path("books/search/", views.search_books, name="search_books"),
+    path("books/import/", views.import_books, name="import_books"),
+    path("reports/<str:name>/", views.report, name="report"),
+    path("reports/jobs/<int:pk>/", views.report_job, name="report_job"),
+    path("_perf", views.perf_stats, name="perf_stats"),
+    path("catalogue/books/", views.catalogue_books, name="catalogue_books"),
+    path("catalogue/books/<int:pk>/", views.catalogue_book, name="catalogue_book"),
+    path("catalogue/authors/", views.catalogue_authors, name="catalogue_authors"),
+    path("catalogue/authors/<int:pk>/", views.catalogue_author, name="catalogue_author"),
+]
@@ -1,6 +1,399 @@
-from django.http import HttpResponse
+import asyncio
+import csv
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+)
+from django.middleware.csrf import CsrfViewMiddleware
 from django.shortcuts import render
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from demo.ingest import DEFAULT_BATCH_SIZE as DEFAULT_IMPORT_BATCH_SIZE, INGEST_FORMATS, InvalidRow, ingest_books
+from demo.jobs import get_job, request_report
+from demo.models import Author, Book, ReportJob
+from demo.page_cache import (
+    AUTHORS, BOOKS, author_keys, book_keys, cache_versioned, depend_on, render_fragments, set_validators,
+    skip_page_cache, version_key
+)
+from demo.pagination import InvalidCursor, decode_cursor, encode_cursor, parse_page_size, seek
+from demo.perf import perf_registry
+from demo.search import SEARCH_MODES, search_books as search_books_queryset
+from demo.streaming import DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE, iter_books_with_author_names
 
 
 def index(request):
-    return HttpResponse("Hello, world. You're at the demo index.")
\ No newline at end of file
+    return HttpResponse("Hello, world. You're at the demo index.")
+
+
+class _Echo:
+    """ File-like object whose write() hands the line back to csv.writer's caller. """
+    def write(self, value):
+        return value
+
+
+def _csv_lines(rows, header):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(rows, header):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row))) + '\n'
+
+
+STREAM_FORMATS = {
+    'ndjson': (_ndjson_lines, 'application/x-ndjson'),
+    'csv': (_csv_lines, 'text/csv'),
+}
+
+
+def stream_books(request):
+    """ Streams every book with its author's name as NDJSON (default) or CSV. """
+    output_format = request.GET.get('format', 'ndjson')
+    if output_format not in STREAM_FORMATS:
+        return HttpResponseBadRequest(f'format must be one of {", ".join(STREAM_FORMATS)}')
+    try:
+        chunk_size = int(request.GET.get('chunk_size', DEFAULT_CHUNK_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest('chunk_size must be an integer')
+
+    (serialize, content_type) = STREAM_FORMATS[output_format]
+    rows = iter_books_with_author_names(chunk_size=max(1, min(chunk_size, MAX_CHUNK_SIZE)))
+    response = StreamingHttpResponse(serialize(rows, ['title', 'author_name']), content_type=content_type)
+    if output_format == 'csv':
+        response['Content-Disposition'] = 'attachment; filename="books.csv"'
+    return response
+
+
+BOOK_LIST_FIELDS = ['title', 'id']
+BOOK_LIST_VALUES = ['id', 'title', 'page_count', 'publication_date', 'author_id', 'author__name']
+AUTHOR_LIST_FIELDS = ['id']
+AUTHOR_LIST_VALUES = ['id', 'name', 'birth_date', 'book_count']
+
+
+def _page_queryset(request, queryset, fields):
+    """ Returns (queryset, page_size) for the page requested by `request`.
+    The queryset fetches one extra row to learn whether there is a next page.
+    """
+    after = request.GET.get('after')
+    after = decode_cursor(after, len(fields)) if after else None
+    page_size = parse_page_size(request.GET.get('limit'))
+    return (seek(queryset, fields, after)[:page_size + 1], page_size)
+
+
+def _next_page(request, rows, fields, page_size):
+    """ Returns (rows, next_url) after trimming the extra row. """
+    if len(rows) <= page_size:
+        return (rows, None)
+    rows = rows[:page_size]
+    query = request.GET.copy()
+    query['after'] = encode_cursor([rows[-1][field.lstrip('-')] for field in fields])
+    return (rows, f'{request.path}?{query.urlencode()}')
+
+
+def _book_genres(book_ids):
+    return (Book.genres.through.objects
+            .filter(book_id__in=book_ids)
+            .order_by('genre__name')
+            .values_list('book_id', 'genre__name'))
+
+
+def _serialize_books(rows, genre_rows):
+    genre_names = defaultdict(list)
+    for (book_id, genre_name) in genre_rows:
+        genre_names[book_id].append(genre_name)
+    return [
+        {
+            'id': row['id'],
+            'title': row['title'],
+            'page_count': row['page_count'],
+            'publication_date': row['publication_date'],
+            'author': {'id': row['author_id'], 'name': row['author__name']},
+            'genres': genre_names[row['id']],
+        }
+        for row in rows
+    ]
+
+
+def list_books(request):
+    """ Books ordered by (title, id), with author and genre names. """
+    queryset = Book.objects.select_related('author').values(*BOOK_LIST_VALUES)
+    try:
+        (page, page_size) = _page_queryset(request, queryset, BOOK_LIST_FIELDS)
+    except InvalidCursor as e:
+        return HttpResponseBadRequest(str(e))
+
+    (rows, next_url) = _next_page(request, list(page), BOOK_LIST_FIELDS, page_size)
+    # A single query for the genres of the whole page
+    genre_rows = _book_genres([row['id'] for row in rows])
+    return JsonResponse({'results': _serialize_books(rows, genre_rows), 'next': next_url})
+
+
+def list_authors(request):
+    """ Authors ordered by id, with their book counts. """
+    queryset = Author.objects.values(*AUTHOR_LIST_VALUES)
+    try:
+        (page, page_size) = _page_queryset(request, queryset, AUTHOR_LIST_FIELDS)
+    except InvalidCursor as e:
+        return HttpResponseBadRequest(str(e))
+    (rows, next_url) = _next_page(request, list(page), AUTHOR_LIST_FIELDS, page_size)
+    return JsonResponse({'results': rows, 'next': next_url})
+
+
+SEARCH_LIST_FIELDS = ['-rank', 'id']
+
+
+def search_books(request):
+    """ Books whose title matches ?q=, best match first. ?mode= is one of
+    demo.search.SEARCH_MODES (default 'text').
+    """
+    text = request.GET.get('q', '').strip()
+    mode = request.GET.get('mode', 'text')
+    if not text:
+        return HttpResponseBadRequest('q is required')
+    if mode not in SEARCH_MODES:
+        return HttpResponseBadRequest(f'mode must be one of {", ".join(SEARCH_MODES)}')
+
+    queryset = search_books_queryset(text, mode).select_related('author').values(*BOOK_LIST_VALUES, 'rank')
+    try:
+        (page, page_size) = _page_queryset(request, queryset, SEARCH_LIST_FIELDS)
+    except InvalidCursor as e:
+        return HttpResponseBadRequest(str(e))
+
+    (rows, next_url) = _next_page(request, list(page), SEARCH_LIST_FIELDS, page_size)
+    results = _serialize_books(rows, _book_genres([row['id'] for row in rows]))
+    for (result, row) in zip(results, rows):
+        result['rank'] = row['rank']
+    return JsonResponse({'results': results, 'next': next_url})
+
+
+IMPORT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+}
+
+
+def _import_forbidden(request):
+    """ None if `request` may import books, else the response refusing it.
+    Allowed are requests with `Authorization: Bearer <settings.DEMO_IMPORT_TOKEN>`
+    and, with a CSRF token, staff users' sessions.
+    """
+    token = settings.DEMO_IMPORT_TOKEN
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return None
+    if request.user.is_staff:
+        # A session is sent along by the browser, so it needs the CSRF check
+        # the view is exempt from for token clients
+        return CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+    return HttpResponseForbidden('Importing needs a staff user or the DEMO_IMPORT_TOKEN bearer token')
+
+
+@csrf_exempt
+@require_POST
+def import_books(request):
+    """ Upserts the books in a CSV or NDJSON request body (see demo.ingest),
+    chosen by ?format= or the Content-Type. The body is parsed as it is read.
+    Only for staff users and holders of DEMO_IMPORT_TOKEN (see _import_forbidden).
+    """
+    forbidden = _import_forbidden(request)
+    if forbidden is not None:
+        return forbidden
+    input_format = request.GET.get('format') or IMPORT_CONTENT_TYPES.get(request.content_type)
+    if input_format not in INGEST_FORMATS:
+        return HttpResponseBadRequest(
+            f'Send text/csv or application/x-ndjson, or pass format={" or ".join(INGEST_FORMATS)}'
+        )
+    try:
+        batch_size = int(request.GET.get('batch_size', DEFAULT_IMPORT_BATCH_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest('batch_size must be an integer')
+
+    lines = (line.decode(request.encoding or 'utf-8') for line in request)
+    try:
+        result = ingest_books(lines, input_format, batch_size=max(1, batch_size))
+    except (InvalidRow, UnicodeDecodeError) as e:
+        return HttpResponseBadRequest(f'{e} (earlier batches were committed)')
+    return JsonResponse(result.to_dict())
+
+
+@csrf_exempt
+@require_POST
+def report(request, name):
+    """ Requests a report computed by the run_jobs workers (see demo.jobs).
+    Answers 200 with the result when a fresh one is stored, else 202 with
+    the queued or running job, whose status URL is in the Location header.
+    Identical requests share one job.
+    """
+    try:
+        job = request_report(name)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return _job_response(job)
+
+
+def report_job(request, pk):
+    """ Status of a report job, with its result once done. """
+    job = get_job(pk)
+    if job is None:
+        return JsonResponse({'error': 'No such job; finished jobs are deleted when their result expires'},
+                            status=404)
+    return _job_response(job)
+
+
+def _job_response(job):
+    finished = job.status in (ReportJob.Status.DONE, ReportJob.Status.FAILED)
+    response = JsonResponse(job.to_dict(), status=200 if finished else 202)
+    response['Location'] = reverse('report_job', args=[job.id])
+    return response
+
+
+##########################################
+# ASYNC VARIANTS (served through mysite.asgi)
+##########################################
+async def alist_books(request):
+    """ Async list_books. The page and its genres are fetched concurrently: the
+    genre query selects the page's ids through a subquery instead of waiting
+    for the first result.
+    """
+    queryset = Book.objects.select_related('author').values(*BOOK_LIST_VALUES)
+    try:
+        (page, page_size) = _page_queryset(request, queryset, BOOK_LIST_FIELDS)
+    except InvalidCursor as e:
+        return HttpResponseBadRequest(str(e))
+
+    page_ids = page.values('id')[:page_size]
+    (rows, genre_rows) = await asyncio.gather(
+        _alist(page),
+        _alist(_book_genres(page_ids)),
+    )
+    (rows, next_url) = _next_page(request, rows, BOOK_LIST_FIELDS, page_size)
+    return JsonResponse({'results': _serialize_books(rows, genre_rows), 'next': next_url})
+
+
+async def alist_authors(request):
+    queryset = Author.objects.values(*AUTHOR_LIST_VALUES)
+    try:
+        (page, page_size) = _page_queryset(request, queryset, AUTHOR_LIST_FIELDS)
+    except InvalidCursor as e:
+        return HttpResponseBadRequest(str(e))
+    (rows, next_url) = _next_page(request, await _alist(page), AUTHOR_LIST_FIELDS, page_size)
+    return JsonResponse({'results': rows, 'next': next_url})
+
+
+async def _alist(queryset):
+    return [row async for row in queryset]
+
+
+def perf_stats(request):
+    """ Per-URL latency, DB time and query counts recorded by
+    demo.perf.PerformanceMiddleware in this process over the last few minutes.
+    """
+    return JsonResponse(perf_registry.snapshot())
+
+
+##########################################
+# CATALOGUE PAGES (HTML)
+##########################################
+# Rows are rendered from per-object fragments and whole pages are cached by
+# demo.page_cache.VersionedPageCacheMiddleware, so a warm page needs no queries.
+def _book_contexts(book_ids):
+    genre_names = defaultdict(list)
+    for (book_id, genre_name) in _book_genres(book_ids):
+        genre_names[book_id].append(genre_name)
+    return {
+        book.id: {
+            'book': book,
+            'genres': genre_names[book.id],
+            'updated_at': max(book.updated_at, book.author.updated_at),
+            'version_keys': book_keys(book.id, book.author_id),
+        }
+        for book in Book.objects.filter(id__in=book_ids).select_related('author')
+    }
+
+
+def _author_contexts(author_ids):
+    return {
+        author.id: {'author': author, 'updated_at': author.updated_at}
+        for author in Author.objects.filter(id__in=author_ids)
+    }
+
+
+def _book_rows(request, rows):
+    """ [(html, updated_at)] of the _book_row fragments of `rows` (dicts with id and author_id). """
+    fragments = render_fragments(
+        request, 'demo/_book_row.html',
+        {row['id']: book_keys(row['id'], row['author_id']) for row in rows},
+        _book_contexts
+    )
+    return [fragments[row['id']] for row in rows if row['id'] in fragments]
+
+
+def _render_rows(request, template_name, context, rows, ids, updated_ats=()):
+    """ Renders a page of (html, updated_at) fragments with its validators. """
+    response = render(request, template_name, {**context, 'rows': [html for (html, _) in rows]})
+    return set_validators(response, [updated_at for (_, updated_at) in rows] + list(updated_ats), ids)
+
+
+@cache_versioned
+def catalogue_books(request):
+    """ Books ordered by (title, id), with author and genre names. """
+    depend_on(request, [version_key(BOOKS)])
+    try:
+        (page, page_size) = _page_queryset(request, Book.objects.values('id', 'title', 'author_id'), BOOK_LIST_FIELDS)
+    except InvalidCursor as e:
+        return HttpResponseBadRequest(str(e))
+    (rows, next_url) = _next_page(request, list(page), BOOK_LIST_FIELDS, page_size)
+    return _render_rows(request, 'demo/book_list.html', {'next_url': next_url}, _book_rows(request, rows),
+                        [row['id'] for row in rows])
+
+
+@cache_versioned
+def catalogue_book(request, pk):
+    author_id = Book.objects.filter(id=pk).values_list('author_id', flat=True).first()
+    if author_id is None:
+        raise Http404('No such book')
+    depend_on(request, book_keys(pk, author_id))
+    context = _book_contexts([pk]).get(pk)
+    if context is None:
+        raise Http404('No such book')
+    if context['book'].author_id != author_id:
+        skip_page_cache(request)
+    return set_validators(render(request, 'demo/book_detail.html', context), [context['updated_at']], [pk])
+
+
+@cache_versioned
+def catalogue_authors(request):
+    """ Authors ordered by id, with their book counts. """
+    depend_on(request, [version_key(AUTHORS)])
+    try:
+        (page, page_size) = _page_queryset(request, Author.objects.values('id'), AUTHOR_LIST_FIELDS)
+    except InvalidCursor as e:
+        return HttpResponseBadRequest(str(e))
+    (rows, next_url) = _next_page(request, list(page), AUTHOR_LIST_FIELDS, page_size)
+    author_ids = [row['id'] for row in rows]
+    fragments = render_fragments(
+        request, 'demo/_author_row.html', {author_id: author_keys(author_id) for author_id in author_ids},
+        _author_contexts
+    )
+    return _render_rows(request, 'demo/author_list.html', {'next_url': next_url},
+                        [fragments[author_id] for author_id in author_ids if author_id in fragments], author_ids)
+
+
+@cache_versioned
+def catalogue_author(request, pk):
+    """ An author with their books, whose rows are shared with catalogue_books. """
+    depend_on(request, author_keys(pk) + [version_key('author_books', pk)])
+    author = Author.objects.filter(id=pk).first()
+    if author is None:
+        raise Http404('No such author')
+    rows = list(Book.objects.filter(author_id=pk).order_by(*BOOK_LIST_FIELDS).values('id', 'author_id'))
+    return _render_rows(request, 'demo/author_detail.html', {'author': author}, _book_rows(request, rows),
+                        [pk] + [row['id'] for row in rows], [author.updated_at])
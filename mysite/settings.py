@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import importlib.util
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,9 +40,11 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 ]
 
 MIDDLEWARE = [
+    'demo.perf.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'demo.page_cache.VersionedPageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
@@ -74,14 +79,154 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Connection reuse is configured through the environment:
+#   DB_CONN_MAX_AGE        seconds to keep a connection open between requests
+#                          (0 closes it after every request, "none" keeps it forever)
+#   DB_CONN_HEALTH_CHECKS  ping persistent connections before reusing them
+#   DB_POOL                use psycopg 3's connection pool instead of persistent
+#                          connections (needs `pip install "psycopg[binary,pool]"`)
+#   DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT
+# DB_HOST, DB_PORT, DB_USER and DB_PASSWORD override the libpq defaults.
+
+def env_bool(name, default=False):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+def env_conn_max_age():
+    value = os.environ.get('DB_CONN_MAX_AGE', '60')
+    return None if value.lower() == 'none' else int(value)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'demodb'
+        'NAME': os.environ.get('DB_NAME', 'demodb'),
+        'CONN_MAX_AGE': env_conn_max_age(),
+        'CONN_HEALTH_CHECKS': env_bool('DB_CONN_HEALTH_CHECKS', True),
+        'OPTIONS': {},
+    }
+}
+
+for setting in ['HOST', 'PORT', 'USER', 'PASSWORD']:
+    if os.environ.get(f'DB_{setting}'):
+        DATABASES['default'][setting] = os.environ[f'DB_{setting}']
+
+if env_bool('DB_POOL'):
+    # Pooled connections are returned to the pool at the end of each request,
+    # which Django requires to be combined with CONN_MAX_AGE = 0.
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
     }
+
+# Server-side prepared statements for hot query shapes:
+#   DB_PREPARE_THRESHOLD   prepare a statement once it has run this many times on a
+#                          connection. With psycopg 3 this is its own automatic
+#                          preparation (with server-side parameter binding); with
+#                          psycopg2 demo.prepared issues PREPARE/EXECUTE. Unset: never.
+
+DB_PREPARE_THRESHOLD = int(os.environ['DB_PREPARE_THRESHOLD']) if os.environ.get('DB_PREPARE_THRESHOLD') else None
+if DB_PREPARE_THRESHOLD is not None and importlib.util.find_spec('psycopg'):
+    DATABASES['default']['OPTIONS']['server_side_binding'] = True
+    DATABASES['default']['OPTIONS']['prepare_threshold'] = DB_PREPARE_THRESHOLD
+
+# Read replicas, used by demo.routers.ReplicaRouter for Author, Book and Genre reads:
+#   DB_REPLICAS             comma-separated replicas as host[:port][/name]. Parts left
+#                           out are the primary's, so "/demodb_replica" names a second
+#                           database on the same server standing in for a replica.
+#   DB_REPLICA_MAX_LAG      seconds a replica may be behind before reads fall back
+#                           to the primary (default 5)
+#   DB_REPLICA_PIN_SECONDS  seconds a client's reads stay on the primary after one
+#                           of its requests writes (default 5)
+
+def env_replicas():
+    replicas = {}
+    for (i, spec) in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+        (address, _, name) = spec.strip().partition('/')
+        (host, _, port) = address.partition(':')
+        replica = {**DATABASES['default'], 'OPTIONS': dict(DATABASES['default']['OPTIONS'])}
+        replica.update({setting: value for (setting, value) in
+                        [('HOST', host), ('PORT', port), ('NAME', name)] if value})
+        # Tests run against the primary's test database
+        replica['TEST'] = {'MIRROR': 'default'}
+        replicas[f'replica_{i}'] = replica
+    return replicas
+
+DATABASES.update(env_replicas())
+DB_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', 5))
+DB_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
+DATABASE_ROUTERS = ['demo.routers.ReplicaRouter'] if DB_REPLICAS else []
+if DB_REPLICAS:
+    # Right after PerformanceMiddleware, before anything that could write
+    MIDDLEWARE.insert(1, 'demo.routers.ReplicaPinMiddleware')
+
+# Partitioning of demo_book, applied by migration 0009 (see demo.partitioning;
+# change it later with `python manage.py partition_books`):
+#   DB_BOOK_PARTITIONING  "author_hash" (HASH (author_id)); unset keeps one table
+#   DB_BOOK_PARTITIONS    number of author_hash partitions (default 16)
+
+DB_BOOK_PARTITIONING = os.environ.get('DB_BOOK_PARTITIONING') or None
+DB_BOOK_PARTITIONS = int(os.environ.get('DB_BOOK_PARTITIONS', 16))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# demo.cache puts a small in-process LRU in front of this backend. locmem stands
+# in for a shared backend locally; point it at Redis or Memcached in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'demo',
+        'OPTIONS': {
+            'MAX_ENTRIES': 200_000,
+        },
+    }
+}
+
+
+# Request performance
+# demo.perf.PerformanceMiddleware adds Server-Timing headers, keeps per-URL
+# histograms (served at /demo/_perf) and logs a sample of requests as JSON:
+#   DEMO_PERF_LOG_SAMPLE_RATE  share of requests logged (default 0.01)
+#   DEMO_PERF_SLOW_MS          requests at least this slow are always logged
+
+DEMO_PERF_LOG_SAMPLE_RATE = float(os.environ.get('DEMO_PERF_LOG_SAMPLE_RATE', 0.01))
+DEMO_PERF_SLOW_MS = float(os.environ.get('DEMO_PERF_SLOW_MS', 500))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'demo.perf': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'demo.jobs': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
 }
 
 
+# Book import
+# POST /demo/books/import/ upserts the catalogue. Besides staff users, clients
+# sending "Authorization: Bearer $DEMO_IMPORT_TOKEN" may use it; unset, only staff can.
+
+DEMO_IMPORT_TOKEN = os.environ.get('DEMO_IMPORT_TOKEN') or None
+
+
+# Background reports
+# Run by `python manage.py run_jobs` workers (see demo/jobs.py):
+#   DEMO_REPORT_TTL        seconds a finished report is served before it is recomputed
+#   DEMO_JOB_TIMEOUT       seconds a job may run before it is requeued, presuming its
+#                          worker died
+#   DEMO_JOB_MAX_ATTEMPTS  claims of a job before a timeout fails it instead
+
+DEMO_REPORT_TTL = int(os.environ.get('DEMO_REPORT_TTL', 60 * 60))
+DEMO_JOB_TIMEOUT = int(os.environ.get('DEMO_JOB_TIMEOUT', 10 * 60))
+DEMO_JOB_MAX_ATTEMPTS = int(os.environ.get('DEMO_JOB_MAX_ATTEMPTS', 3))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 